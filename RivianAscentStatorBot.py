@@ -2,17 +2,30 @@
 # Import libraries
 ########################################################################################
 import pandas as pd
+import numpy as np
+import argparse
+import hashlib
 import os
 import requests
 import json
-import schedule
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
 import time
 import pytz
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import closing, contextmanager
 from datetime import datetime, timedelta
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-from pyspark.sql import SparkSession
-from databricks import sql
+from io import StringIO
+
+# slack_sdk, schedule and the Databricks connector are imported where they are first
+# used, so a one-shot run only pays for what its code path needs
 
 
 ########################################################################################
@@ -22,30 +35,400 @@ DATABRICKS_SERVER_HOSTNAME = "rivian-prod-us-west-2.cloud.databricks.com"
 DATABRICKS_HTTP_PATH = "/sql/1.0/warehouses/b050a7573faba9ab"
 DATABRICKS_ACCESS_TOKEN = os.getenv("DATABRICKS_ACCESS_TOKEN")
 
+# Upper bound on warehouse queries in flight at once (and on pooled connections)
+DATABRICKS_MAX_PARALLEL_QUERIES = int(os.getenv("DATABRICKS_MAX_PARALLEL_QUERIES", "4"))
+# "databricks", or "duckdb" for the offline stand-in in local_warehouse.py
+WAREHOUSE_BACKEND = os.getenv("WAREHOUSE_BACKEND", "databricks")
+# Pooled connections idle for longer than this are reopened instead of reused
+DATABRICKS_CONNECTION_MAX_IDLE_SECONDS = int(os.getenv("DATABRICKS_CONNECTION_MAX_IDLE_SECONDS", str(4 * 3600)))
+# Query budget per run: queries still running this long after job() starts are cancelled
+# on the warehouse and their sections are posted as pending (0 waits for every query)
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "300"))
+
+########################################################################################
+# Local State Configuration
+########################################################################################
+# Directory for local stores that outlive a single run (hour-bucket cache, ...)
+STATOR_BOT_STATE_DIR = os.getenv("STATOR_BOT_STATE_DIR", ".stator_bot_state")
+HOUR_BUCKET_RETENTION_HOURS = int(os.getenv("HOUR_BUCKET_RETENTION_HOURS", "48"))
+
+# Distinct-serial sketches: "exact" keeps serial sets, "hll" HyperLogLog registers,
+# "auto" keeps exact sets up to EXACT_SKETCH_MAX_SERIALS serials and switches to HLL above
+DISTINCT_SKETCH_MODE = os.getenv("DISTINCT_SKETCH_MODE", "auto")
+EXACT_SKETCH_MAX_SERIALS = int(os.getenv("EXACT_SKETCH_MAX_SERIALS", "2048"))
+SKETCH_RETENTION_HOURS = int(os.getenv("SKETCH_RETENTION_HOURS", str(24 * 35)))
+
+# Local stator -> hairpin-nest genealogy index, refreshed incrementally every run
+GENEALOGY_INDEX_ENABLED = os.getenv("GENEALOGY_INDEX_ENABLED", "1") == "1"
+GENEALOGY_INDEX_BOOTSTRAP_DAYS = int(os.getenv("GENEALOGY_INDEX_BOOTSTRAP_DAYS", "14"))
+GENEALOGY_INDEX_RETENTION_DAYS = int(os.getenv("GENEALOGY_INDEX_RETENTION_DAYS", "60"))
+# Re-read this much before the high-water mark to pick up late-arriving rows
+GENEALOGY_INDEX_OVERLAP_MINUTES = int(os.getenv("GENEALOGY_INDEX_OVERLAP_MINUTES", "60"))
+
+# Per-run query/stage metrics: appended as JSON lines, last run as a Prometheus textfile
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH", os.path.join(STATOR_BOT_STATE_DIR, "metrics.jsonl"))
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", os.path.join(STATOR_BOT_STATE_DIR, "stator_bot.prom"))
+
+# Local Parquet history of hourly fail counts and the anomaly baseline computed from it
+TREND_STORE_ENABLED = os.getenv("TREND_STORE_ENABLED", "1") == "1"
+TREND_STORE_PATH = os.getenv("TREND_STORE_PATH", os.path.join(STATOR_BOT_STATE_DIR, "trend_store"))
+TREND_RETENTION_DAYS = int(os.getenv("TREND_RETENTION_DAYS", "90"))
+TREND_BASELINE_HOURS = int(os.getenv("TREND_BASELINE_HOURS", str(7 * 24)))
+TREND_MIN_HISTORY_HOURS = int(os.getenv("TREND_MIN_HISTORY_HOURS", "24"))
+# An hour is flagged when its robust z-score reaches TREND_ANOMALY_Z with at least
+# TREND_ANOMALY_MIN_COUNT fails
+TREND_ANOMALY_Z = float(os.getenv("TREND_ANOMALY_Z", "3.5"))
+TREND_ANOMALY_MIN_COUNT = int(os.getenv("TREND_ANOMALY_MIN_COUNT", "3"))
+
+# Warehouse results cached as Parquet, keyed by normalized SQL and window bounds.
+# "cache" reuses a window's results for QUERY_CACHE_TTL_HOURS (least recently used
+# evicted past QUERY_CACHE_MAX_MB), "record" keeps every result of a run under
+# QUERY_RECORDING_DIR, "replay" answers every query from that recording, "off" disables it
+QUERY_CACHE_MODE = os.getenv("QUERY_CACHE_MODE", "cache")
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", os.path.join(STATOR_BOT_STATE_DIR, "query_cache"))
+QUERY_CACHE_TTL_HOURS = float(os.getenv("QUERY_CACHE_TTL_HOURS", "24"))
+QUERY_CACHE_MAX_MB = float(os.getenv("QUERY_CACHE_MAX_MB", "512"))
+QUERY_RECORDING_DIR = os.getenv("QUERY_RECORDING_DIR", os.path.join(STATOR_BOT_STATE_DIR, "query_recording"))
+
+# Cold-start budget for importing this module (checked by --check-startup)
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3"))
+
 slack_token = os.getenv("SLACK_TOKEN")
 url = os.getenv("URL")
 
+# "webhook" posts each report to its target's webhook once every query is in.
+# "progressive" posts the station counts with chat.postMessage as soon as their queries
+# are in, then fills in the rest of the same message with chat.update; it needs
+# SLACK_TOKEN and a "slack_channel" per target (default: SLACK_CHANNEL).
+SLACK_DELIVERY_MODE = os.getenv("SLACK_DELIVERY_MODE", "webhook")
+SLACK_CHANNEL = os.getenv("SLACK_CHANNEL")
+
+# Webhook posts are retried on 429 (after its Retry-After), 5xx and connection errors,
+# otherwise backing off SLACK_RETRY_BACKOFF_SECONDS * 2^attempt
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "5"))
+SLACK_RETRY_BACKOFF_SECONDS = float(os.getenv("SLACK_RETRY_BACKOFF_SECONDS", "1"))
+SLACK_TIMEOUT_SECONDS = float(os.getenv("SLACK_TIMEOUT_SECONDS", "10"))
+# Webhooks posted to at once when a report fans out to per-station channels
+SLACK_FANOUT_WORKERS = int(os.getenv("SLACK_FANOUT_WORKERS", "4"))
+# Slack's limits: characters per section text, blocks per message
+SLACK_MAX_SECTION_CHARS = 3000
+SLACK_MAX_BLOCKS = 50
+# Default per-station webhooks for targets without "station_channels", e.g. {"090": "https://..."}
+SLACK_STATION_CHANNELS = json.loads(os.getenv("SLACK_STATION_CHANNELS", "{}"))
+# Webhook messages wait in a local outbox until Slack accepts them; rows (delivered or
+# not) and the results stored with them are dropped after OUTBOX_RETENTION_HOURS
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", str(7 * 24)))
+
 ########################################################################################
 # Slack setup
 ########################################################################################
-client = WebClient(token=slack_token)
+_slack_client = None
+
+
+def get_slack_client():
+    global _slack_client
+    if _slack_client is None:
+        from slack_sdk import WebClient
+        from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
+
+        _slack_client = WebClient(token=slack_token)
+        # Web API calls wait out a 429's Retry-After like the webhook sender does
+        _slack_client.retry_handlers.append(RateLimitErrorRetryHandler(max_retry_count=SLACK_MAX_RETRIES))
+    return _slack_client
+
+
+########################################################################################
+# Functions to Split Blocks to Fit Slack's Section and Message Limits
+########################################################################################
+def split_section_text(text, limit=SLACK_MAX_SECTION_CHARS):
+    # An oversized ```table``` is split on line boundaries, each part fenced again and
+    # starting with the table's header row
+    if len(text) <= limit:
+        return [text]
+    fence = "```" if text.startswith("```") and text.endswith("```") and len(text) >= 6 else ""
+    lines = text[len(fence) : len(text) - len(fence)].split("\n")
+    header = lines.pop(0) + "\n" if fence and len(lines) > 1 else ""
+    budget = limit - 2 * len(fence) - len(header)
+    parts, current = [], None
+    for line in lines:
+        # A single line longer than a section is cut
+        while len(line) > budget:
+            if current is not None:
+                parts.append(current)
+                current = None
+            parts.append(line[:budget])
+            line = line[budget:]
+        if current is not None and len(current) + 1 + len(line) <= budget:
+            current += "\n" + line
+        else:
+            if current is not None:
+                parts.append(current)
+            current = line
+    if current is not None:
+        parts.append(current)
+    return [fence + header + part + fence for part in parts]
+
+
+def chunk_blocks(blocks, max_blocks=SLACK_MAX_BLOCKS):
+    # Returns the blocks as a list of messages, each within Slack's limits
+    fitted = []
+    for block in blocks:
+        text = block.get("text", {}).get("text") if block.get("type") == "section" else None
+        if text is None:
+            fitted.append(block)
+            continue
+        for part in split_section_text(text):
+            fitted.append(dict(block, text=dict(block["text"], text=part)))
+    return [fitted[i : i + max_blocks] for i in range(0, len(fitted), max_blocks)] or [[]]
+
+
+########################################################################################
+# Pooled, Retrying Webhook Sender
+########################################################################################
+# One requests.Session per process keeps connections to Slack open between posts (and
+# between daemon runs); its pool fits SLACK_FANOUT_WORKERS webhooks posted to at once.
+class SlackSender:
+    def __init__(
+        self,
+        max_retries=SLACK_MAX_RETRIES,
+        backoff_seconds=SLACK_RETRY_BACKOFF_SECONDS,
+        timeout=SLACK_TIMEOUT_SECONDS,
+        workers=SLACK_FANOUT_WORKERS,
+    ):
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Content-type"] = "application/json"
+
+    def post(self, url, payload):
+        # Returns True once Slack accepted the payload
+        data = json.dumps(payload)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(url, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code == 200:
+                    return True
+                error = f"{response.status_code} - {response.text}"
+                if response.status_code != 429 and response.status_code < 500:
+                    # Rejected payload (bad blocks, revoked webhook): retrying won't help
+                    break
+                try:
+                    retry_after = float(response.headers["Retry-After"])
+                except (KeyError, ValueError):
+                    pass
+            if attempt == self.max_retries:
+                break
+            delay = retry_after if retry_after is not None else self.backoff_seconds * 2**attempt
+            print(f"Slack post failed ({error}); retry {attempt + 1}/{self.max_retries} in {delay:g}s")
+            time.sleep(delay)
+        print(f"Slack API Error: {error}")
+        return False
+
+    def send(self, url, blocks):
+        # Oversized blocks are split across sections and messages, posted in order
+        messages = chunk_blocks(blocks)
+        sent = 0
+        for message_blocks in messages:
+            sent += self.post(url, {"blocks": message_blocks})
+        if len(messages) > 1:
+            print(f"Report split into {len(messages)} messages, {sent} sent")
+        return sent == len(messages)
+
+
+_slack_sender = None
+
+
+def get_slack_sender():
+    global _slack_sender
+    if _slack_sender is None:
+        _slack_sender = SlackSender()
+    return _slack_sender
+
+
+########################################################################################
+# Durable Slack Outbox
+########################################################################################
+# Rendered webhook messages are written to SQLite, one row per message chunk, together
+# with the results they were rendered from, before any delivery attempt; flush() then
+# delivers from there. A Slack outage only delays delivery: any later run (or
+# --flush-outbox) retries without touching the warehouse. Messages are keyed
+# "<window>/<shop>/<line>/<destination>", so a window already delivered to a
+# destination isn't delivered again when it is re-rendered.
+class SlackOutbox:
+    def __init__(self, path=None, retention_hours=OUTBOX_RETENTION_HOURS):
+        self.path = path or os.path.join(STATOR_BOT_STATE_DIR, "slack_outbox.sqlite")
+        self.retention_hours = retention_hours
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    message_key TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    window_start TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    blocks_json TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    sent_at TEXT,
+                    PRIMARY KEY (message_key, chunk)
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox_results (
+                    window_start TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    results_json TEXT NOT NULL,
+                    PRIMARY KEY (window_start, target)
+                )
+                """
+            )
+
+    def enqueue(self, window_start, target, destination, url, blocks):
+        # Returns the number of chunks queued (0 for a duplicate of a delivered message)
+        message_key = f"{window_start}/{target_id(target)}/{destination}"
+        if not url:
+            print(f"Outbox: no webhook configured for {message_key}, not queued")
+            return 0
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [
+            (message_key, chunk, window_start, url, json.dumps(message_blocks), created_at)
+            for chunk, message_blocks in enumerate(chunk_blocks(blocks))
+        ]
+        with closing(sqlite3.connect(self.path)) as db, db:
+            delivered = db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE message_key = ? AND sent_at IS NOT NULL", (message_key,)
+            ).fetchone()[0]
+            if delivered:
+                print(f"Outbox: {message_key} was already delivered, dropping the duplicate")
+                return 0
+            # A re-render replaces the undelivered version of the same message
+            db.execute("DELETE FROM outbox WHERE message_key = ?", (message_key,))
+            db.executemany(
+                "INSERT INTO outbox (message_key, chunk, window_start, url, blocks_json, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def store_results(self, window_start, target, results):
+        results_json = json.dumps(
+            {name: df.to_json(orient="split", index=False, default_handler=str) for name, df in results.items()}
+        )
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO outbox_results VALUES (?, ?, ?)", (window_start, target_id(target), results_json)
+            )
+
+    def flush(self, sender=None):
+        # Delivers every queued chunk; returns how many are still queued afterwards
+        sender = sender or get_slack_sender()
+        with closing(sqlite3.connect(self.path)) as db:
+            rows = db.execute(
+                "SELECT message_key, chunk, url, blocks_json FROM outbox WHERE sent_at IS NULL "
+                "ORDER BY window_start, message_key, chunk"
+            ).fetchall()
+        if not rows:
+            return 0
+        by_url = {}
+        for message_key, chunk, url, blocks_json in rows:
+            by_url.setdefault(url, []).append((message_key, chunk, blocks_json))
+
+        def drain(url, messages):
+            # In order per webhook: after a failure, later messages wait for the next flush
+            sent = []
+            for message_key, chunk, blocks_json in messages:
+                if not sender.post(url, {"blocks": json.loads(blocks_json)}):
+                    return sent, (message_key, chunk)
+                sent.append((message_key, chunk))
+            return sent, None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(sender.workers, len(by_url)))) as executor:
+            drained = list(executor.map(drain, by_url.keys(), by_url.values()))
+        sent = [key for keys, _ in drained for key in keys]
+        failed = [failed for _, failed in drained if failed is not None]
+        sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.executemany(
+                "UPDATE outbox SET sent_at = ?, attempts = attempts + 1 WHERE message_key = ? AND chunk = ?",
+                [(sent_at, message_key, chunk) for message_key, chunk in sent],
+            )
+            db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1 WHERE message_key = ? AND chunk = ?", failed
+            )
+        queued = len(rows) - len(sent)
+        if queued:
+            print(f"Outbox: {len(sent)} message(s) delivered, {queued} still queued for the next flush")
+        else:
+            print(f"Outbox: {len(sent)} message(s) delivered")
+        return queued
+
+    def resend(self, window_start):
+        # Queues a window's messages again, e.g. after they went to the wrong channel
+        with closing(sqlite3.connect(self.path)) as db, db:
+            return db.execute(
+                "UPDATE outbox SET sent_at = NULL, attempts = 0 WHERE window_start = ?", (window_start,)
+            ).rowcount
+
+    def evict(self):
+        cutoff = (datetime.now() - timedelta(hours=self.retention_hours)).strftime("%Y-%m-%d %H:00")
+        with closing(sqlite3.connect(self.path)) as db, db:
+            dropped = db.execute(
+                "DELETE FROM outbox WHERE window_start < ? AND sent_at IS NULL", (cutoff,)
+            ).rowcount
+            db.execute("DELETE FROM outbox WHERE window_start < ?", (cutoff,))
+            db.execute("DELETE FROM outbox_results WHERE window_start < ?", (cutoff,))
+        if dropped:
+            print(f"Outbox: dropped {dropped} undelivered message(s) older than {self.retention_hours}h")
 
 
 ########################################################################################
 # Function To Send Message TO Slack
 ########################################################################################
-def send_message_to_slack(channel, text):
+# With ts, the message posted earlier is updated in place (channel must then be the
+# channel ID Slack returned for it). Blocks beyond one message's limits follow as new
+# messages. Returns (channel ID, ts) of the first message, or None on error.
+def send_message_to_slack(channel, text, blocks=None, ts=None):
+    from slack_sdk.errors import SlackApiError
+
+    messages = chunk_blocks(blocks) if blocks else [None]
     try:
-        response = client.chat_postMessage(channel=channel, text=text)
-        print(f"Message sent to {channel} with timestamp {response['ts']}")
+        if ts is None:
+            response = get_slack_client().chat_postMessage(channel=channel, text=text, blocks=messages[0])
+            print(f"Message sent to {channel} with timestamp {response['ts']}")
+        else:
+            response = get_slack_client().chat_update(channel=channel, ts=ts, text=text, blocks=messages[0])
+            print(f"Message {ts} updated in {channel}")
+        for message_blocks in messages[1:]:
+            get_slack_client().chat_postMessage(channel=response["channel"], text=text, blocks=message_blocks)
+        return response["channel"], response["ts"]
     except SlackApiError as e:
         print(f"Error sending message to Slack: {e.response['error']}")
+        return None
 
 
 ########################################################################################
 # Function to Connect to Databricks
 ########################################################################################
 def create_databricks_connection():
+    if WAREHOUSE_BACKEND == "duckdb":
+        from local_warehouse import connect_local_warehouse
+
+        return connect_local_warehouse()
+
+    from databricks import sql
+
     return sql.connect(
         server_hostname=DATABRICKS_SERVER_HOSTNAME,
         http_path=DATABRICKS_HTTP_PATH,
@@ -56,1176 +439,2040 @@ def create_databricks_connection():
 ########################################################################################
 # Function to Execute Query and Get Results
 ########################################################################################
-def execute_query(query, conn):
+# Results are fetched as Arrow tables and converted to pandas column-wise, so no Python
+# Row object is ever built per result row
+def arrow_to_pandas(table):
+    table = table.rename_columns([name.upper() for name in table.column_names])
+    # split_blocks + self_destruct release each Arrow column as soon as it is converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+# Returns the Arrow table; callers convert it with arrow_to_pandas once it is cached.
+# stats, if given, is filled with execute/fetch seconds, row count and Arrow bytes;
+# on_cursor, if given, is handed the cursor before the query starts (to cancel it)
+def execute_query(query, conn, stats=None, on_cursor=None):
     with conn.cursor() as cursor:
+        if on_cursor is not None:
+            on_cursor(cursor)
+        started = time.perf_counter()
         cursor.execute(query)
-        result = cursor.fetchall()
-        columns = [desc[0].upper() for desc in cursor.description]
-        return pd.DataFrame(result, columns=columns)
+        executed = time.perf_counter()
+        table = cursor.fetchall_arrow()
+        if stats is not None:
+            stats.update(
+                execute_seconds=executed - started,
+                fetch_seconds=time.perf_counter() - executed,
+                rows=table.num_rows,
+                bytes=table.nbytes,
+            )
+        return table
 
 
 ########################################################################################
-# Function defining all queries to run every hour
+# Pool of Databricks Connections Shared by the Query Workers
 ########################################################################################
-def job():
-    t0 = time.time()
-    conn = create_databricks_connection()
+class DatabricksConnectionPool:
+    def __init__(
+        self,
+        size=DATABRICKS_MAX_PARALLEL_QUERIES,
+        connect=create_databricks_connection,
+        max_idle_seconds=DATABRICKS_CONNECTION_MAX_IDLE_SECONDS,
+    ):
+        self.size = max(1, size)
+        self._connect = connect
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    @contextmanager
+    def connection(self):
+        # At most `size` connections are ever checked out; idle ones are reused
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+            except Exception:
+                # Don't hand a connection that failed mid-query to the next worker
+                self._discard(conn)
+                raise
+            self._idle.put((conn, time.monotonic()))
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - released_at <= self.max_idle_seconds:
+                return conn
+            # Long-idle sessions (e.g. between daemon runs) may have expired server-side
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing Databricks connection: {e}")
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
 
-    local_tz = pytz.timezone("America/Chicago")  # Change this to your expected timezone
-    utc_now = datetime.now(pytz.utc)  # Get current UTC time
-    local_now = utc_now.astimezone(local_tz)  # Convert to local timezone
-    current_hour = local_now.hour
-    current_time = local_now.strftime("%Y-%m-%d %H:00")
 
-    one_hour_before = datetime.now() - timedelta(hours=1)
-    recorded_at = one_hour_before.strftime("%Y-%m-%d %H:00")
-    eight_hours_before = datetime.now() - timedelta(hours=8)
-    recorded_at_summary = eight_hours_before.strftime("%Y-%m-%d %H:00")
+########################################################################################
+# Content-Addressed Query-Result Cache With Record/Replay
+########################################################################################
+# Results are stored as the Arrow tables the warehouse returned, one Parquet file per
+# key, with an SQLite index of their size and last use. The key is the query text with
+# comments and whitespace runs (outside string literals) collapsed, plus the window
+# bounds it was run for. A query is passed `window` = (start, end), () when its text
+# alone identifies its result (e.g. a serial lookup), or None when its result can change
+# after the run (open-ended queries): those are recorded and replayed but never reused,
+# and are keyed by query name, since their text carries the run's high-water marks.
+SQL_NOISE = re.compile(r"('(?:[^']|'')*')|(?:\s|--[^\n]*)+")
+
+
+def normalize_query(query):
+    return SQL_NOISE.sub(lambda match: match.group(1) or " ", query).strip().rstrip(";").strip()
+
+
+class QueryResultCache:
+    def __init__(self, path=None, mode=QUERY_CACHE_MODE, ttl_hours=QUERY_CACHE_TTL_HOURS, max_mb=QUERY_CACHE_MAX_MB):
+        self.mode = mode
+        # A recording is kept whole: no TTL, no size limit
+        self.path = path or (QUERY_RECORDING_DIR if mode in ("record", "replay") else QUERY_CACHE_PATH)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = max_mb * 2**20
+        self.index_path = os.path.join(self.path, "index.sqlite")
+        os.makedirs(self.path, exist_ok=True)
+        with closing(sqlite3.connect(self.index_path)) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_results (
+                    key TEXT PRIMARY KEY,
+                    window_start TEXT,
+                    window_end TEXT,
+                    query_text TEXT NOT NULL,
+                    rows INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
 
-    # Define the queries
-    ########################################################################################
-    # Query 20 - Every Hour
-    ########################################################################################
-    query_20 = f"""
-    select count(distinct product_serial) as COUNT, STATION_NAME , work_location_desc as PARAMETER_NAME
-    from manufacturing.mes.fct_work_location_jobs
-    where shop_name = 'DU03'
-    and line_name ilike '%STTR%'
-    and station_name = '020'
-    and started_at > '{recorded_at}'
-    and job_status != 'OK'
-    group by station_name, work_location_desc
-    """
-    ########################################################################################
-    # Query 40 - Every Hour
-    ########################################################################################
-    query_40 = f"""
-    SELECT COUNT(distinct product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-    FROM manufacturing.spinal.fct_spinal_parameter_records
-    WHERE shop_name = 'DU03'
-    AND line_name ilike '%STTR%'
-    AND STATION_NAME ilike '%40%'
-    AND PARAMETER_NAME = 'Force process value'
-    AND parameter_id = 2
-    AND overall_process_status = 'NOK'
-    AND recorded_at > '{recorded_at}'
-    GROUP BY STATION_NAME, PARAMETER_NAME
-    """
+    def key(self, name, query, window):
+        if window is None:
+            return hashlib.sha256(json.dumps(["name", str(name)]).encode()).hexdigest()
+        bounds = [str(bound) for bound in window]
+        return hashlib.sha256(json.dumps([normalize_query(query), bounds]).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.parquet")
+
+    def load(self, name, query, window=None):
+        # The stored Arrow table, or None when the query has to go to the warehouse
+        if self.mode == "record" or (self.mode == "cache" and window is None):
+            return None
+        import pyarrow.parquet as pq
+
+        key = self.key(name, query, window)
+        with closing(sqlite3.connect(self.index_path, timeout=30)) as db, db:
+            row = db.execute("SELECT created_at FROM query_results WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.mode == "cache" and time.time() - row[0] > self.ttl_seconds:
+                row = None
+            if row is not None:
+                db.execute("UPDATE query_results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        if row is not None:
+            try:
+                return pq.read_table(self._file(key))
+            except FileNotFoundError:
+                pass
+        if self.mode == "replay":
+            raise KeyError(f"No recorded result in {self.path} for query {name}: {normalize_query(query)[:200]}")
+        return None
+
+    def store(self, name, query, window, table):
+        if self.mode == "replay" or (self.mode == "cache" and window is None):
+            return
+        import pyarrow.parquet as pq
+
+        key = self.key(name, query, window)
+        # Written under a temporary name so a reader never sees a partial file
+        tmp_path = f"{self._file(key)}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self._file(key))
+        start, end = (None, None) if not window else window
+        now = time.time()
+        with closing(sqlite3.connect(self.index_path, timeout=30)) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO query_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, start, end, normalize_query(query), table.num_rows, os.path.getsize(self._file(key)), now, now),
+            )
 
-    ########################################################################################
-    # Query 50 - Every Hour
-    ########################################################################################
-    query_50 = f"""
-    WITH alarm_data AS (
-        SELECT *,
-            LAG(cleared_at) OVER (PARTITION BY alarm_source_scada_short_name ORDER BY activated_at) AS prev_cleared_at
-        FROM manufacturing.drive_unit.fct_du03_scada_alarms
-        WHERE alarm_source_scada_short_name ILIKE '%STTR01-050%'
-        AND CONVERT_TIMEZONE('UTC', 'America/Chicago', activated_at) > '{recorded_at}'
-        AND alarm_priority_desc IN ('high', 'critical')
-    )
+    def evict(self):
+        if self.mode != "cache":
+            return
+        cutoff = time.time() - self.ttl_seconds
+        with closing(sqlite3.connect(self.index_path, timeout=30)) as db, db:
+            evicted = [key for (key,) in db.execute("SELECT key FROM query_results WHERE created_at < ?", (cutoff,))]
+            # Most recently used are kept; the rest go once the total passes max_bytes
+            total = 0
+            for key, size in db.execute(
+                "SELECT key, bytes FROM query_results WHERE created_at >= ? ORDER BY accessed_at DESC", (cutoff,)
+            ).fetchall():
+                total += size
+                if total > self.max_bytes:
+                    evicted.append(key)
+            db.executemany("DELETE FROM query_results WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+
+_query_cache = None
+
+
+def get_query_cache():
+    # None when QUERY_CACHE_MODE is "off"
+    global _query_cache
+    if _query_cache is None and QUERY_CACHE_MODE != "off":
+        _query_cache = QueryResultCache()
+    return _query_cache
 
-    SELECT 
-        COUNT(*) AS COUNT,
-        '050' AS STATION_NAME,
-        'Twisting Check Plate Fails' AS PARAMETER_NAME
-    FROM alarm_data
-    WHERE (activated_at > prev_cleared_at + INTERVAL '30 seconds' OR prev_cleared_at IS NULL)
-    AND alarm_description ILIKE '%Assembly error%Task[301]%'
 
-    UNION ALL
+########################################################################################
+# Per-Run Metrics: Query Latency/Volume and Stage Timings
+########################################################################################
+class RunMetrics:
+    def __init__(self, run_at, jsonl_path=METRICS_JSONL_PATH, prom_path=METRICS_PROM_PATH):
+        self.run_at = run_at.strftime("%Y-%m-%d %H:%M")
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.queries = []
+        self.stages = []
+        self.messages = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._stage_started = self._started
+
+    def record_query(self, key, **stats):
+        # Keys are "name", (scope, name) or ((window_start, window_end), name)
+        scope, name = key if isinstance(key, tuple) else (None, key)
+        if isinstance(scope, tuple):
+            scope = scope[0]
+        record = {"query": str(name), "scope": None if scope is None else str(scope), **stats}
+        with self._lock:
+            self.queries.append(record)
+
+    def record_message(self, target, destination, blocks):
+        # Which report went where, by destination name (never the webhook URL)
+        with self._lock:
+            self.messages.append({"target": target, "destination": destination, "blocks": blocks})
+
+    def end_stage(self, name):
+        # Stages are consecutive: each one runs from the end of the previous one. A stage
+        # repeated per target adds up under one name.
+        now = time.perf_counter()
+        for record in self.stages:
+            if record["stage"] == name:
+                record["seconds"] += now - self._stage_started
+                break
+        else:
+            self.stages.append({"stage": name, "seconds": now - self._stage_started})
+        self._stage_started = now
+
+    def write(self):
+        total_seconds = time.perf_counter() - self._started
+        os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+        with open(self.jsonl_path, "a") as f:
+            for record in self.queries:
+                f.write(json.dumps({"run_at": self.run_at, "kind": "query", **record}) + "\n")
+            for record in self.stages:
+                f.write(json.dumps({"run_at": self.run_at, "kind": "stage", **record}) + "\n")
+            for record in self.messages:
+                f.write(json.dumps({"run_at": self.run_at, "kind": "message", **record}) + "\n")
+            f.write(json.dumps({"run_at": self.run_at, "kind": "run", "seconds": total_seconds}) + "\n")
+
+        lines = []
+        for metric, field, help_text in [
+            ("stator_bot_query_seconds", "seconds", "Wall time of each warehouse query, including connection wait"),
+            ("stator_bot_query_connect_seconds", "connect_seconds", "Time spent waiting for or opening a connection"),
+            ("stator_bot_query_execute_seconds", "execute_seconds", "Time until the warehouse finished executing"),
+            ("stator_bot_query_fetch_seconds", "fetch_seconds", "Time spent fetching the Arrow result"),
+            ("stator_bot_query_rows", "rows", "Rows returned by each warehouse query"),
+            ("stator_bot_query_bytes", "bytes", "Arrow bytes fetched by each warehouse query"),
+            ("stator_bot_query_cache_hit", "cache_hit", "1 when the result came from the query-result cache"),
+        ]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for record in self.queries:
+                if field in record:
+                    labels = f'query="{record["query"]}"'
+                    if record["scope"] is not None:
+                        labels += f',scope="{record["scope"]}"'
+                    lines.append(f"{metric}{{{labels}}} {record[field]}")
+        lines += ["# HELP stator_bot_stage_seconds Wall time of each job stage", "# TYPE stator_bot_stage_seconds gauge"]
+        lines += [f'stator_bot_stage_seconds{{stage="{r["stage"]}"}} {r["seconds"]}' for r in self.stages]
+        lines += [
+            "# HELP stator_bot_run_seconds Wall time of the whole job",
+            "# TYPE stator_bot_run_seconds gauge",
+            f"stator_bot_run_seconds {total_seconds}",
+            "# HELP stator_bot_last_run_timestamp_seconds When the last job finished",
+            "# TYPE stator_bot_last_run_timestamp_seconds gauge",
+            f"stator_bot_last_run_timestamp_seconds {time.time()}",
+        ]
+        # Written atomically so a textfile collector never reads a partial file
+        os.makedirs(os.path.dirname(os.path.abspath(self.prom_path)), exist_ok=True)
+        tmp_path = self.prom_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
 
-    SELECT 
-        COUNT(*) AS COUNT,
-        '050' AS STATION_NAME,
-        TRIM(BOTH ' []' FROM SPLIT_PART(alarm_description, 'Key', 2)) AS PARAMETER_NAME
-    FROM alarm_data
-    WHERE alarm_description ILIKE '%Gripper%work%'
-    GROUP BY parameter_name;
-    """
 
-    ########################################################################################
-    # Query 70 - Every Hour
-    ########################################################################################
-    query_70 = f"""
-    SELECT 
-          COUNT(*) as COUNT,
-          '070' as STATION_NAME,
-          'Bad Cuts/Welding Fail' as ALARM_DESCRIPTION
-    FROM manufacturing.drive_unit.fct_du03_scada_alarms
-    WHERE alarm_source_scada_short_name ILIKE '%STTR01-070%'
-    AND CONVERT_TIMEZONE('UTC', 'America/Chicago', activated_at) > '{recorded_at}'
-    AND alarm_priority_desc IN ('high', 'critical')
-    AND alarm_description ILIKE '%Assembly error%'
-    group by STATION_NAME
-    """
+########################################################################################
+# Function to Run Named Queries Concurrently and Collect the DataFrames
+########################################################################################
+# Queries start in order of `priorities` (lower first, default 0). With a deadline (a
+# time.monotonic() value), queries still running when it passes are cancelled on the
+# warehouse and queued ones never start; only the queries that finished are returned.
+# on_result(name, df), if given, is called from this thread as each query finishes.
+# Queries named in `windows` ({name: window}, see QueryResultCache) go through the
+# query-result cache; the others always run on the warehouse.
+def run_queries_concurrently(
+    queries,
+    pool,
+    max_workers=DATABRICKS_MAX_PARALLEL_QUERIES,
+    metrics=None,
+    priorities=None,
+    deadline=None,
+    on_result=None,
+    windows=None,
+):
+    cache = get_query_cache() if windows else None
+    running = {}
+    lock = threading.Lock()
+    expired = threading.Event()
+
+    def track(name, cursor):
+        with lock:
+            if expired.is_set():
+                raise TimeoutError(f"Query {name} reached the deadline before it started")
+            running[name] = cursor
+
+    def fetch(name, query):
+        started = time.perf_counter()
+        cached = cache is not None and name in windows
+        table = cache.load(name, query, windows[name]) if cached else None
+        if table is not None:
+            stats = {"cache_hit": 1, "rows": table.num_rows, "bytes": table.nbytes}
+        else:
+            stats = {}
+            try:
+                with pool.connection() as conn:
+                    stats["connect_seconds"] = time.perf_counter() - started
+                    table = execute_query(query, conn, stats, lambda cursor: track(name, cursor))
+            finally:
+                with lock:
+                    running.pop(name, None)
+            if cached:
+                cache.store(name, query, windows[name], table)
+        if metrics is not None:
+            metrics.record_query(name, seconds=time.perf_counter() - started, **stats)
+        return arrow_to_pandas(table)
+
+    # Workers take queued queries first in, first out, so queue them by priority
+    order = sorted(queries, key=lambda name: (priorities or {}).get(name, 0))
+    futures = {name: Future() for name in order}
+    tasks = queue.Queue()
+    for name in order:
+        tasks.put(name)
+
+    def work():
+        while True:
+            try:
+                name = tasks.get_nowait()
+            except queue.Empty:
+                return
+            future = futures[name]
+            # False when the deadline cancelled the query before it started
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fetch(name, queries[name]))
+            except BaseException as e:
+                future.set_exception(e)
+
+    # Daemon threads rather than a ThreadPoolExecutor, whose workers are joined at exit:
+    # a query that ignores its cancel must not keep a one-shot run alive after the post
+    for _ in range(max(1, min(max_workers, len(queries)))):
+        threading.Thread(target=work, daemon=True).start()
+    names = {future: name for name, future in futures.items()}
+    done, late = set(), set(futures.values())
+    while late:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        finished, late = wait(late, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not finished:
+            break
+        done |= finished
+        if on_result is not None:
+            for future in finished:
+                if future.exception() is None:
+                    on_result(names[future], future.result())
+    if late:
+        with lock:
+            expired.set()
+            cursors = list(running.items())
+        for future in late:
+            future.cancel()
+        for name, cursor in cursors:
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"Error cancelling query {name}: {e}")
+    # Cancelled queries finish in the background; nothing waits for them, even at exit
+
+    results = {}
+    for name, future in futures.items():
+        if future in done:
+            results[name] = future.result()
+        else:
+            print(f"Query {name} missed the deadline and was cancelled")
+            if metrics is not None:
+                metrics.record_query(name, missed_deadline=True)
+    return results
 
-    ########################################################################################
-    # Query 90 - Every Hour
-    ########################################################################################
-    query_90 = f"""
-    SELECT 
-    COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
+
+########################################################################################
+# Spec-Limit Registry
+########################################################################################
+# spec_limits.json holds one entry per (limit set, parameter, work location) with its
+# lo/hi limits. Queries join against the enabled entries instead of spelling the limits
+# out as OR chains; flip "enabled" to switch a limit on or off.
+SPEC_LIMITS_PATH = os.getenv(
+    "SPEC_LIMITS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "spec_limits.json"),
+)
+
+
+def load_spec_limits(path=SPEC_LIMITS_PATH):
+    with open(path) as f:
+        registry = json.load(f)
+    limits = [limit for limit in registry["limits"] if limit.get("enabled", True)]
+    print(f"Loaded spec limits v{registry['version']} ({len(limits)} enabled) from {path}")
+    return registry["version"], limits
+
+
+_spec_limits = None
+
+
+def get_spec_limits():
+    # Read on first use, so importing the module doesn't touch the registry
+    global _spec_limits
+    if _spec_limits is None:
+        _, _spec_limits = load_spec_limits()
+    return _spec_limits
+
+
+def spec_limit_sets(limits=None):
+    limits = get_spec_limits() if limits is None else limits
+    return {limit.get("limit_set", limit["station"]) for limit in limits}
+
+
+########################################################################################
+# Function to Render Spec Limits as an Inline VALUES Relation
+########################################################################################
+def build_spec_limits_relation(limit_sets, limits=None, alias="spec_limits"):
+    limits = get_spec_limits() if limits is None else limits
+    rows = []
+    for limit in limits:
+        limit_set = limit.get("limit_set", limit["station"])
+        if limit_set not in limit_sets:
+            continue
+        parameter = limit["parameter"].replace("'", "''")
+        work_location = limit.get("work_location")
+        work_location = "CAST(NULL AS INT)" if work_location is None else int(work_location)
+        rows.append(
+            f"('{limit_set}', '{parameter}', {work_location}, {limit['lo']}, {limit['hi']})"
+        )
+    if not rows:
+        # Keep the relation well-formed; the NULL row never matches a join
+        rows.append("(CAST(NULL AS STRING), CAST(NULL AS STRING), CAST(NULL AS INT), NULL, NULL)")
+    values = ",\n            ".join(rows)
+    return f"""(VALUES
+            {values}
+        ) AS {alias}(LIMIT_SET, PARAMETER_NAME, WORK_LOCATION, LO, HI)"""
+
+
+########################################################################################
+# Monitored Shop/Line Targets
+########################################################################################
+# STATOR_BOT_TARGETS is a JSON list of {"shop", "line", "alarm_table", "channel"} where
+# "channel" is the Slack webhook for that line (default: URL); progressive delivery posts
+# to "slack_channel" instead (default: SLACK_CHANNEL). "station_channels" maps stations to
+# webhooks that also get that station's part of each report (default: SLACK_STATION_CHANNELS).
+# All targets are fetched together, one query per source table grouped by shop and line,
+# and split locally.
+DEFAULT_TARGETS = [
+    {"shop": "DU03", "line": "STTR01", "alarm_table": "manufacturing.drive_unit.fct_du03_scada_alarms"},
+]
+
+
+def load_targets(targets_json=None):
+    targets = json.loads(targets_json or os.getenv("STATOR_BOT_TARGETS") or "null") or DEFAULT_TARGETS
+    return [
+        dict(
+            target,
+            channel=target.get("channel") or url,
+            slack_channel=target.get("slack_channel") or SLACK_CHANNEL,
+            station_channels=target.get("station_channels") or SLACK_STATION_CHANNELS,
+        )
+        for target in targets
+    ]
+
+
+def target_id(target):
+    return f"{target['shop']}/{target['line']}"
+
+
+def _sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def target_filter(targets, shop_column="shop_name", line_column="line_name"):
+    # Coarse IN filters keep partition pruning; exact (shop, line) pairs are split locally
+    shops = ", ".join(sorted({_sql_string(t["shop"]) for t in targets}))
+    lines = ", ".join(sorted({_sql_string(t["line"]) for t in targets}))
+    return f"{shop_column} IN ({shops}) AND {line_column} IN ({lines})"
+
+
+def split_target_results(results, targets):
+    # {name: df with SHOP_NAME/LINE_NAME} -> {"<shop>/<line>/<name>": df without them}
+    split = {}
+    for name, df in results.items():
+        for target in targets:
+            df_target = df[(df["SHOP_NAME"] == target["shop"]) & (df["LINE_NAME"] == target["line"])]
+            split[f"{target_id(target)}/{name}"] = df_target.drop(columns=["SHOP_NAME", "LINE_NAME"]).reset_index(
+                drop=True
+            )
+    return split
+
+
+def target_results(results, target):
+    prefix = target_id(target) + "/"
+    return {name[len(prefix):]: df for name, df in results.items() if name.startswith(prefix)}
+
+
+def target_pending(pending, target):
+    prefix = target_id(target) + "/"
+    return {name[len(prefix):] for name in pending if name.startswith(prefix)}
+
+
+def target_result_names(targets):
+    return [f"{target_id(target)}/{name}" for target in targets for name in HOURLY_RESULT_NAMES]
+
+
+########################################################################################
+# Station Metrics Read From fct_spinal_parameter_records
+########################################################################################
+# Every metric is answered by the same scan of the spinal fact table, restricted to the
+# targets' shops and lines. `station_filter` is the coarse per-station predicate pushed
+# into the scan, `where` the metric's own predicate; the CASE in
+# build_spinal_station_query tags each row with its metric.
+# Metrics with a `limit_set` only count rows outside that set's spec limits.
+SPINAL_STATION_METRICS = [
+    {
+        "name": "df_40",
+        "metric": "040",
+        "station_filter": "STATION_NAME ilike '%40%'",
+        "where": """PARAMETER_NAME = 'Force process value'
+                AND parameter_id = 2
+                AND overall_process_status = 'NOK'""",
+    },
+    {
+        "name": "df_90",
+        "metric": "090",
+        "station_filter": "STATION_NAME = '090'",
+        "limit_set": "090",
+        "value_column": "TRY_CAST(parameter_value_raw AS DOUBLE)",
+    },
+    {
+        "name": "df_100",
+        "metric": "100",
+        "station_filter": "STATION_NAME = '100'",
+        "where": "overall_process_status = 'NOK'",
+        "limit_set": "100",
+        "value_column": "parameter_value_num",
+        "work_location_column": "CAST(work_location_id AS INT)",
+    },
+    {
+        "name": "df_180",
+        "metric": "180",
+        "station_filter": "STATION_NAME = '180'",
+        "where": "overall_process_status = 'NOK'",
+        "limit_set": "180",
+        "value_column": "parameter_value_num",
+        "work_location_column": "CAST(work_location_id AS INT)",
+    },
+    {
+        # Unique serial count across all 210 parameters, used in place of the per-parameter sum
+        "name": "df_210_unique_sn",
+        "metric": "210",
+        "unique_sn": True,
+        "station_filter": "STATION_NAME = '210'",
+        "where": "overall_process_status = 'NOK'",
+        "limit_set": "210",
+        "value_column": "parameter_value_num",
+        # Names are strings ('01'); TRY_CAST so one non-numeric name can't fail the scan
+        "work_location_column": "TRY_CAST(work_location_name AS INT)",
+    },
+]
+
+
+def _case_on_metric(values, default="NULL"):
+    if not values:
+        return default
+    branches = "\n".join(
+        f"                WHEN '{metric}' THEN {value}" for metric, value in values.items()
+    )
+    return f"""CASE METRIC
+{branches}
+            END"""
+
+
+########################################################################################
+# Function to Build the Single-Scan Query for All Spinal Station Metrics
+########################################################################################
+def build_spinal_station_query(recorded_at, recorded_until, targets, metrics=SPINAL_STATION_METRICS, limits=None):
+    # A limit set with no enabled registry entries leaves its metric unfiltered
+    active_sets = spec_limit_sets(limits)
+    limited = [m for m in metrics if m.get("limit_set") in active_sets]
+
+    scan_filter = "\n        OR ".join(f"({m['station_filter']})" for m in metrics)
+    metric_cases = "\n".join(
+        f"""            WHEN ({m['station_filter']})
+                AND {m.get('where', 'TRUE')}
+            THEN '{m['metric']}'"""
+        for m in metrics
+    )
+    limit_set = _case_on_metric(
+        {m["metric"]: f"'{m['limit_set']}'" for m in limited}, "CAST(NULL AS STRING)"
+    )
+    parameter_value = _case_on_metric({m["metric"]: m["value_column"] for m in limited})
+    work_location = _case_on_metric(
+        {m["metric"]: m["work_location_column"] for m in limited if m.get("work_location_column")},
+        "CAST(NULL AS INT)",
+    )
+    spec_limits = build_spec_limits_relation({m["limit_set"] for m in limited}, limits)
+    unique_sn = ", ".join(f"'{m['metric']}'" for m in metrics if m.get("unique_sn")) or "''"
+
+    return f"""
+    WITH spec_limits AS (
+        SELECT * FROM {spec_limits}
+    ),
+
+    spinal_records AS (
+        SELECT
+            product_serial,
+            shop_name AS SHOP_NAME,
+            line_name AS LINE_NAME,
+            station_name AS STATION_NAME,
+            parameter_name AS PARAMETER_NAME,
+            parameter_value_raw,
+            parameter_value_num,
+            work_location_id,
+            work_location_name,
+            date_trunc('HOUR', recorded_at) AS WINDOW_HOUR,
+            CASE
+{metric_cases}
+            END AS METRIC
         FROM manufacturing.spinal.fct_spinal_parameter_records
-        WHERE SHOP_NAME = 'DU03'
-        AND line_name = 'STTR01'
-        AND STATION_NAME = '090'
-        -- AND overall_process_status = 'NOK'
-        AND recorded_at > '{recorded_at}'
+        WHERE recorded_at >= '{recorded_at}'
+        AND recorded_at < '{recorded_until}'
+        AND {target_filter(targets)}
         AND (
-            (PARAMETER_NAME = 'Value Height Pin X' AND (parameter_value_raw < 40 OR parameter_value_raw > 46.3)) OR
-            (PARAMETER_NAME = 'Value Pixle Area Pin X' AND (parameter_value_raw < 2600 OR parameter_value_raw > 7500)) OR
-            (PARAMETER_NAME = 'Value Blob X Feret Diameters Pin X' AND (parameter_value_raw < 1.8 OR parameter_value_raw > 3.6)) OR
-            (PARAMETER_NAME = 'Value Blob Y Feret Diameters Pin X' AND (parameter_value_raw < 0.8 OR parameter_value_raw > 2.2)) OR
-            (PARAMETER_NAME = 'Value Angle 1 Pin X' AND (parameter_value_raw < 13 OR parameter_value_raw > 45)) OR
-            (PARAMETER_NAME = 'Value Angle 2 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > 13)) OR
-            (PARAMETER_NAME = 'Value Level Difference' AND (parameter_value_raw < 0 OR parameter_value_raw > 0.7)) OR
-            (PARAMETER_NAME = 'Value Angle Connection Phase 1' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-            (PARAMETER_NAME = 'Value Angle Connection Phase 2' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-            (PARAMETER_NAME = 'Value Angle Connection Phase 3' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-            (PARAMETER_NAME = 'Value Height Connection Phase 1' AND (parameter_value_raw < 11.35 OR parameter_value_raw > 12.90)) OR
-            (PARAMETER_NAME = 'Value Height Connection Phase 2' AND (parameter_value_raw < 11.35 OR parameter_value_raw > 12.90)) OR
-            (PARAMETER_NAME = 'Value Height Connection Phase 3' AND (parameter_value_raw < 11.35 OR parameter_value_raw > 12.90)) OR
-            (PARAMETER_NAME = 'Value X Connection Element 1' AND (parameter_value_raw < -5.10 OR parameter_value_raw > -3.9)) OR
-            (PARAMETER_NAME = 'Value X Connection Element 2' AND (parameter_value_raw < -6.30 OR parameter_value_raw > -5.6)) OR
-            (PARAMETER_NAME = 'Value Y Connection Element 1' AND (parameter_value_raw < -23.85 OR parameter_value_raw > -22.95)) OR
-            (PARAMETER_NAME = 'Value Y Connection Element 2' AND (parameter_value_raw < -94.95 OR parameter_value_raw > -94.05)) 
+        {scan_filter}
         )
-        GROUP BY STATION_NAME, PARAMETER_NAME
-        ORDER BY COUNT DESC
+    ),
+
+    limited_records AS (
+        SELECT
+            product_serial,
+            SHOP_NAME,
+            LINE_NAME,
+            STATION_NAME,
+            PARAMETER_NAME,
+            METRIC,
+            WINDOW_HOUR,
+            {limit_set} AS LIMIT_SET,
+            {parameter_value} AS PARAMETER_VALUE,
+            {work_location} AS WORK_LOCATION
+        FROM spinal_records
+        WHERE METRIC IS NOT NULL
+    ),
+
+    metric_records AS (
+        SELECT r.product_serial, r.SHOP_NAME, r.LINE_NAME, r.STATION_NAME, r.PARAMETER_NAME, r.METRIC, r.WINDOW_HOUR
+        FROM limited_records AS r
+        LEFT JOIN spec_limits AS l
+            ON l.LIMIT_SET = r.LIMIT_SET
+            AND l.PARAMETER_NAME = r.PARAMETER_NAME
+            AND (l.WORK_LOCATION IS NULL OR l.WORK_LOCATION = r.WORK_LOCATION)
+        WHERE r.LIMIT_SET IS NULL
+        OR r.PARAMETER_VALUE < l.LO
+        OR r.PARAMETER_VALUE > l.HI
+    )
+
+    SELECT COUNT(DISTINCT product_serial) AS COUNT, STATION_NAME, PARAMETER_NAME, METRIC,
+        collect_set(product_serial) AS SERIALS, SHOP_NAME, LINE_NAME, WINDOW_HOUR
+    FROM metric_records
+    WHERE METRIC NOT IN ({unique_sn})
+    GROUP BY WINDOW_HOUR, SHOP_NAME, LINE_NAME, METRIC, STATION_NAME, PARAMETER_NAME
+
+    UNION ALL
+
+    SELECT COUNT(DISTINCT product_serial) AS COUNT, STATION_NAME, NULL AS PARAMETER_NAME, METRIC,
+        collect_set(product_serial) AS SERIALS, SHOP_NAME, LINE_NAME, WINDOW_HOUR
+    FROM metric_records
+    WHERE METRIC IN ({unique_sn})
+    GROUP BY WINDOW_HOUR, SHOP_NAME, LINE_NAME, METRIC, STATION_NAME
     """
 
-    ########################################################################################
-    # Query 100 - Every Hour
-    ########################################################################################
-    query_100 = f"""
-     SELECT COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
+
+########################################################################################
+# Function to Split the Single-Scan Result Back Into Per-Station DataFrames
+########################################################################################
+def split_spinal_station_results(df, suffix="", metrics=SPINAL_STATION_METRICS):
+    frames = {}
+    for m in metrics:
+        df_metric = df[df["METRIC"] == m["metric"]].drop(columns=["METRIC"])
+        if m.get("unique_sn"):
+            df_metric = df_metric.drop(columns=["PARAMETER_NAME"])
+        else:
+            df_metric = df_metric.sort_values(["COUNT"], ascending=False)
+        frames[m["name"] + suffix] = df_metric.reset_index(drop=True)
+    return frames
+
+
+########################################################################################
+# Hairpin Origin Attribution
+########################################################################################
+# Two phases: the window's failing serials at 040/050/090 come from one small query,
+# then genealogy and the Sttr_030 Nest records are read only for those serials.
+HAIRPIN_SERIAL_CHUNK_SIZE = int(os.getenv("HAIRPIN_SERIAL_CHUNK_SIZE", "1000"))
+
+# `origin_pattern` is matched against the Sttr_030 station the stator's hairpins came from
+HAIRPIN_ORIGIN_RESULTS = [
+    {"name": "df_40_hairpin_origin", "metric": "040", "origin_pattern": "30"},
+    {"name": "df_50_hairpin_origin", "metric": "050", "origin_pattern": "^030"},
+    {"name": "df_90_hairpin_origin", "metric": "090", "origin_pattern": "^030"},
+]
+
+
+########################################################################################
+# Function to Build the Failing-Serials Query (phase 1)
+########################################################################################
+def build_hairpin_fail_serials_query(recorded_at, recorded_until, targets):
+    return f"""
+    WITH spec_limits AS (
+        SELECT * FROM {build_spec_limits_relation({"090_hairpin"})}
+    ),
+
+    station_records AS (
+        SELECT
+            product_serial,
+            shop_name,
+            line_name,
+            station_name,
+            parameter_name,
+            TRY_CAST(parameter_value_raw AS DOUBLE) AS parameter_value,
+            date_trunc('HOUR', recorded_at) AS WINDOW_HOUR,
+            CASE
+                WHEN station_name ILIKE '%40%'
+                    AND overall_process_status = 'NOK'
+                    AND parameter_name = 'Force process value'
+                    AND parameter_id = 2
+                THEN '040'
+                WHEN station_name ILIKE '%050%' AND result_status = 'FAIL' THEN '050'
+                WHEN station_name = '090' THEN '090'
+            END AS METRIC
         FROM manufacturing.spinal.fct_spinal_parameter_records
-        WHERE SHOP_NAME = 'DU03'
-        AND line_name = 'STTR01'
-        AND STATION_NAME = '100'
-        AND overall_process_status = 'NOK'
-        AND recorded_at > '{recorded_at}'
-        -- AND (
-        --     ((PARAMETER_NAME = 'AmbientTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 50)) AND (work_location_id = 01 or work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Area Waveform UV Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Area Waveform VW Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Area Waveform WU Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Humidity Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'BalanceOfAllPhasesU Value' AND (parameter_value_num < 0 OR parameter_value_num > 1.5)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Insulation Resistance UVW to GND Value' AND (parameter_value_num < 200 OR parameter_value_num > 5000)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Insulation Voltage UVW to GND Value' AND (parameter_value_num < 450 OR parameter_value_num > 550)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'PartTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Pdiv HvAc Value' AND (parameter_value_num < 800 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Pdiv UV Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Pdiv VW Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'Pdiv WU Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        --     ((PARAMETER_NAME = 'PhaseResistance between UV Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'PhaseResistance between VW Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'PhaseResistance between WU Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Withstand Current UVW to GND Value' AND (parameter_value_num < 0 OR parameter_value_num > 15)) AND (work_location_id = 01)) OR
-        --     ((PARAMETER_NAME = 'Withstand Voltage UVW to GND Value' AND (parameter_value_num < 1850 OR parameter_value_num > 1950)) AND (work_location_id = 02)) 
-        -- )
-        GROUP BY STATION_NAME, PARAMETER_NAME
-        ORDER BY COUNT DESC
+        WHERE {target_filter(targets)}
+        AND recorded_at >= '{recorded_at}'
+        AND recorded_at < '{recorded_until}'
+        AND (station_name ILIKE '%40%' OR station_name ILIKE '%050%' OR station_name = '090')
+    )
+
+    SELECT DISTINCT r.METRIC, r.station_name AS STATION_NAME, r.product_serial AS PRODUCT_SERIAL,
+        r.shop_name AS SHOP_NAME, r.line_name AS LINE_NAME, r.WINDOW_HOUR
+    FROM station_records AS r
+    LEFT JOIN spec_limits AS l
+        ON r.METRIC = '090'
+        AND l.PARAMETER_NAME = r.parameter_name
+    WHERE r.METRIC IN ('040', '050')
+    OR (r.METRIC = '090' AND (r.parameter_value < l.LO OR r.parameter_value > l.HI))
     """
 
-    ########################################################################################
-    # Query 180 - Every Hour
-    ########################################################################################
-    query_180 = f"""
-    SELECT COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-    FROM manufacturing.spinal.fct_spinal_parameter_records
-    WHERE SHOP_NAME = 'DU03'
-    AND line_name = 'STTR01'
-    AND STATION_NAME = '180'
-    AND overall_process_status = 'NOK'
-    AND recorded_at > '{recorded_at}'
-    AND (
-         ((PARAMETER_NAME = 'AmbientTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 50)) AND (work_location_id = 01 or work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Area Waveform UV Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Area Waveform VW Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Area Waveform WU Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Humidity Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'InbalanceOfAllPhasesU Value' AND (parameter_value_num < 0 OR parameter_value_num > 1.5)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Insulation Resistance UVW to GND Value' AND (parameter_value_num < 200 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Insulation Voltage UVW to GND Value' AND (parameter_value_num < 450 OR parameter_value_num > 550)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'PartTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Pdiv HvAc Value' AND (parameter_value_num < 800 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Pdiv UV Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Pdiv VW Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'Pdiv WU Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-        ((PARAMETER_NAME = 'PhaseResistance between UV Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'PhaseResistance between VW Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'PhaseResistance between WU Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Withstand Current UVW to GND Value' AND (parameter_value_num < 0 OR parameter_value_num > 15)) AND (work_location_id = 01)) OR
-        ((PARAMETER_NAME = 'Withstand Voltage UVW to GND Value' AND (parameter_value_num < 1850 OR parameter_value_num > 1950)) AND (work_location_id = 02)) 
+
+########################################################################################
+# Function to Build the Genealogy/Nest Lookup for a Set of Stator Serials (phase 2)
+########################################################################################
+def build_hairpin_origin_query(serials, targets):
+    serial_list = ", ".join("'" + serial.replace("'", "''") + "'" for serial in serials)
+    return f"""
+    WITH genealogy_hist AS (
+        SELECT DISTINCT product_serial, scanned_child_serial
+        FROM manufacturing.mes.fct_genealogy_hist
+        WHERE {target_filter(targets)}
+        AND product_serial IN ({serial_list})
     )
-    GROUP BY STATION_NAME, PARAMETER_NAME
-    ORDER BY COUNT DESC
+
+    SELECT DISTINCT GH.product_serial AS PRODUCT_SERIAL, NPR.station_name AS STTR_030_STATION
+    FROM genealogy_hist AS GH
+    JOIN manufacturing.spinal.fct_spinal_parameter_records AS NPR
+        ON NPR.product_serial = GH.scanned_child_serial
+    WHERE {target_filter(targets, "NPR.shop_name", "NPR.line_name")}
+    AND NPR.station_name LIKE '%30%'
+    AND NPR.parameter_name = 'Nest'
     """
 
-    ########################################################################################
-    # Query 210 - Unique SN COUNT - Every Hour
-    ########################################################################################
-    query_210_unique_sn = f"""
-    select count(distinct product_serial) as COUNT, station_name
-    FROM manufacturing.spinal.fct_spinal_parameter_records
-    WHERE line_name = 'STTR01'
-    AND STATION_NAME = '210'
-    AND overall_process_status = 'NOK'
-    AND recorded_at > '{recorded_at}'
-    AND (
-        ((PARAMETER_NAME = 'AmbientTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 50)) AND (work_location_name= '01' or work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Area Waveform UV Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Area Waveform VW Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Area Waveform WU Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Humidity Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'InbalanceOfAllPhasesU Value' AND (parameter_value_num < 0 OR parameter_value_num > 1.5)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Insulation Resistance UVW to GND Value' AND (parameter_value_num < 200 OR parameter_value_num > 10000)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Insulation Voltage UVW to GND Value' AND (parameter_value_num < 450 OR parameter_value_num > 550)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'PartTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Pdiv HvAc Value' AND (parameter_value_num < 800 OR parameter_value_num > 10000)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Pdiv UV Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Pdiv VW Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'Pdiv WU Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_name= '02')) OR
-        ((PARAMETER_NAME = 'PhaseResistance between UV Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'PhaseResistance between VW Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'PhaseResistance between WU Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Withstand Current UVW to GND Value' AND (parameter_value_num < 0 OR parameter_value_num > 15)) AND (work_location_name= '01')) OR
-        ((PARAMETER_NAME = 'Withstand Voltage UVW to GND Value' AND (parameter_value_num < 1850 OR parameter_value_num > 1950)) AND (work_location_name= '02'))
+
+########################################################################################
+# Function to Look Up the Sttr_030 Nest Station for Failing Stator Serials
+########################################################################################
+# Returns None when a lookup chunk missed the deadline
+def fetch_hairpin_origins(serials, targets, pool, metrics=None, deadline=None):
+    serials = sorted({str(serial) for serial in serials})
+    if not serials:
+        return pd.DataFrame(columns=["PRODUCT_SERIAL", "STTR_030_STATION"])
+
+    chunks = [
+        serials[i : i + HAIRPIN_SERIAL_CHUNK_SIZE]
+        for i in range(0, len(serials), HAIRPIN_SERIAL_CHUNK_SIZE)
+    ]
+    queries = {(i, "hairpin_origin"): build_hairpin_origin_query(chunk, targets) for i, chunk in enumerate(chunks)}
+    # A chunk's serials are in its query text, so the text alone keys its cached result
+    fetched = run_queries_concurrently(
+        queries, pool, metrics=metrics, deadline=deadline, windows={name: () for name in queries}
     )
-    GROUP BY ALL
-    """
+    if len(fetched) < len(chunks):
+        return None
+    return pd.concat(fetched.values(), ignore_index=True)
 
-    ########################################################################################
-    # Query 40 - Fails by Hairpin Origin - Every Hour
-    ########################################################################################
-    query_40_hairpin_origin = f"""
-    with
-
-    nest_parameter_records as 
-        (
-        select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at, parameter_id, overall_process_status
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where 
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '%30%'
-            and parameter_name = 'Nest'
-        ),
-
-    genealogy_hist as 
-        (
-        select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-        from manufacturing.mes.fct_genealogy_hist
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-        ),
-
-    stack_serial as 
-        (
-        select scanned_child_serial, product_serial
-        from manufacturing.mes.fct_genealogy_hist
-        where line_name = 'STTR01'
-        -- and scanned_child_part in ('PT00237854-C') 
-        ),
-
-    wire_spool as 
-        (
-        select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '%30%'
-            and parameter_name ilike '%batch%'
-            -- and parameter_value_raw ilike '%PT00649019-C%' 
-        ),
-
-    op_forty as
-        (
-        select product_serial, station_name, recorded_at, result_status, parameter_id, overall_process_status, parameter_name
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where
-            line_name = 'STTR01'
-            and station_name ilike '%40%'
-            and overall_process_status = 'NOK'
-            and parameter_name = 'Force process value'
 
+########################################################################################
+# Function to Attribute Failing Serials to Their Hairpin Origin Station
+########################################################################################
+def attribute_hairpin_origins(fail_serials, origins):
+    fail_serials = fail_serials.astype({"PRODUCT_SERIAL": str})
+    origins = origins.astype({"PRODUCT_SERIAL": str, "STTR_030_STATION": str})
+    attributed = fail_serials.merge(origins, on="PRODUCT_SERIAL")
+
+    results = {}
+    for h in HAIRPIN_ORIGIN_RESULTS:
+        df = attributed[
+            (attributed["METRIC"] == h["metric"])
+            & attributed["STTR_030_STATION"].str.contains(h["origin_pattern"])
+        ]
+        df = df.groupby(
+            ["WINDOW_HOUR", "SHOP_NAME", "LINE_NAME", "STATION_NAME", "STTR_030_STATION"], as_index=False
+        ).agg(
+            COUNT=("PRODUCT_SERIAL", "nunique"),
+            SERIALS=("PRODUCT_SERIAL", lambda serials: sorted(set(serials))),
         )
+        df = df.rename(columns={"STTR_030_STATION": "Sttr_030_Hairpin_Origin"})
+        results[h["name"]] = df[
+            ["COUNT", "STATION_NAME", "Sttr_030_Hairpin_Origin", "SERIALS", "SHOP_NAME", "LINE_NAME", "WINDOW_HOUR"]
+        ]
+    return results
 
-    select distinct
-        -- SS.scanned_child_serial as Stack_Serial,
-        -- WS.parameter_value_raw as Copper_Wire_Spool,
-        -- -- NPR.product_serial as Nest_Product_Serial,
-        count(distinct GH.product_serial) AS COUNT,
-        opf.station_name as STATION_NAME,
-        NPR.station_name as Sttr_030_Hairpin_Origin
-        -- GH.product_serial as Stator_Assembly_Serial_Number
-        -- opf.result_status as Sttr_040_Result_Status,
-        -- opf.recorded_at as Sttr_040_Recorded_At_Central_Time,
-        -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit
-
-    from nest_parameter_records as NPR
-
-    join genealogy_hist as GH
-        on NPR.product_serial = GH.scanned_child_serial
-    join op_forty as opf
-        on GH.product_serial = opf.product_serial
-    join stack_serial as SS
-        ON GH.product_serial = SS.product_serial
-    left join wire_spool as WS
-        on NPR.product_serial = WS.product_serial
-
-    WHERE
-        opf.station_name ILIKE '%40%'
-        and opf.overall_process_status = 'NOK'
-        and opf.recorded_at > '{recorded_at}'
-        and opf.parameter_id = 2
-        AND opf.PARAMETER_NAME = 'Force process value'
-        group by all
-    """
 
-    ########################################################################################
-    # Query 50 - Fails by Hairpin Origin - Every Hour
-    #######################################################################################
-    query_50_hairpin_origin = f"""
-    with
-
-    nest_parameter_records as 
-        (
-        select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where 
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '030%'
-            and parameter_name = 'Nest'
-        ),
-
-    genealogy_hist as 
-        (
-        select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-        from manufacturing.mes.fct_genealogy_hist
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-        ),
-
-    stack_serial as 
-        (
-        select scanned_child_serial, product_serial
-        from manufacturing.mes.fct_genealogy_hist
-        where line_name = 'STTR01'
-        -- and scanned_child_part in ('PT00237854-C') 
-        ),
-
-    wire_spool as 
-        (
-        select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '030%'
-            and parameter_name ilike '%batch%'
-            -- and parameter_value_raw ilike '%PT00237846-C%' 
-        ),
-
-    op_fifty as
-        (
-        select product_serial, station_name, recorded_at, result_status
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where
-            line_name = 'STTR01'
-            and station_name ilike '%050%'
+########################################################################################
+# Local Genealogy Index (stator -> child serial -> Sttr_030 Nest station)
+########################################################################################
+# Kept in SQLite so it survives restarts. Each refresh downloads only genealogy rows
+# past the consumed_at high-water mark and Nest records past the recorded_at one.
+class GenealogyIndex:
+    # now (naive local time, default: the wall clock at each use) anchors the bootstrap
+    # window and the retention cutoff; job() passes its run_at, so replayed and
+    # back-dated runs don't bootstrap or compact relative to the runner's clock
+    def __init__(self, path=None, now=None):
+        self.path = path or os.path.join(STATOR_BOT_STATE_DIR, "genealogy_index.sqlite")
+        self.now = now
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS genealogy (
+                    product_serial TEXT NOT NULL,
+                    scanned_child_serial TEXT NOT NULL,
+                    consumed_at TEXT NOT NULL,
+                    PRIMARY KEY (product_serial, scanned_child_serial)
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS nest_records (
+                    product_serial TEXT NOT NULL,
+                    station_name TEXT NOT NULL,
+                    recorded_at TEXT NOT NULL,
+                    PRIMARY KEY (product_serial, station_name)
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS genealogy_child ON genealogy (scanned_child_serial)")
+            db.execute("CREATE TABLE IF NOT EXISTS index_state (name TEXT PRIMARY KEY, value TEXT)")
+
+    def _state(self, db, name):
+        row = db.execute("SELECT value FROM index_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
 
+    def _since(self, db, name):
+        high_water = self._state(db, name)
+        if high_water is None:
+            since = (self.now or datetime.now()) - timedelta(days=GENEALOGY_INDEX_BOOTSTRAP_DAYS)
+        else:
+            since = pd.Timestamp(high_water).to_pydatetime() - timedelta(minutes=GENEALOGY_INDEX_OVERLAP_MINUTES)
+        return since.strftime("%Y-%m-%d %H:%M:%S")
+
+    def refresh_queries(self, targets):
+        with closing(sqlite3.connect(self.path)) as db:
+            genealogy_since = self._since(db, "genealogy_high_water")
+            nest_since = self._since(db, "nest_high_water")
+        return {
+            "genealogy": f"""
+            SELECT DISTINCT product_serial AS PRODUCT_SERIAL, scanned_child_serial AS SCANNED_CHILD_SERIAL,
+                consumed_at AS CONSUMED_AT
+            FROM manufacturing.mes.fct_genealogy_hist
+            WHERE {target_filter(targets)}
+            AND consumed_at > '{genealogy_since}'
+            """,
+            "nest_records": f"""
+            SELECT product_serial AS PRODUCT_SERIAL, station_name AS STATION_NAME, max(recorded_at) AS RECORDED_AT
+            FROM manufacturing.spinal.fct_spinal_parameter_records
+            WHERE {target_filter(targets)}
+            AND station_name LIKE '%30%'
+            AND parameter_name = 'Nest'
+            AND recorded_at > '{nest_since}'
+            GROUP BY product_serial, station_name
+            """,
+        }
+
+    def apply_refresh(self, fetched):
+        genealogy = fetched["genealogy"].dropna()
+        nest_records = fetched["nest_records"].dropna()
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.executemany(
+                "INSERT OR REPLACE INTO genealogy VALUES (?, ?, ?)",
+                genealogy.astype(str)[["PRODUCT_SERIAL", "SCANNED_CHILD_SERIAL", "CONSUMED_AT"]].itertuples(index=False),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO nest_records VALUES (?, ?, ?)",
+                nest_records.astype(str)[["PRODUCT_SERIAL", "STATION_NAME", "RECORDED_AT"]].itertuples(index=False),
+            )
+            for name, df, column in [
+                ("genealogy_high_water", genealogy, "CONSUMED_AT"),
+                ("nest_high_water", nest_records, "RECORDED_AT"),
+            ]:
+                if not df.empty:
+                    high_water = max(str(df[column].max()), self._state(db, name) or "")
+                    db.execute("INSERT OR REPLACE INTO index_state VALUES (?, ?)", (name, high_water))
+        print(f"Genealogy index: +{len(genealogy)} genealogy rows, +{len(nest_records)} Nest records")
+
+    def lookup(self, serials):
+        # Returns (origins DataFrame, serials the index could not attribute)
+        serials = sorted({str(serial) for serial in serials})
+        with closing(sqlite3.connect(self.path)) as db:
+            db.execute("CREATE TEMP TABLE lookup_serials (product_serial TEXT PRIMARY KEY)")
+            db.executemany("INSERT INTO lookup_serials VALUES (?)", [(serial,) for serial in serials])
+            rows = db.execute(
+                """
+                SELECT DISTINCT g.product_serial, n.station_name
+                FROM lookup_serials AS l
+                JOIN genealogy AS g ON g.product_serial = l.product_serial
+                JOIN nest_records AS n ON n.product_serial = g.scanned_child_serial
+                """
+            ).fetchall()
+        origins = pd.DataFrame(rows, columns=["PRODUCT_SERIAL", "STTR_030_STATION"])
+        found = set(origins["PRODUCT_SERIAL"])
+        return origins, [serial for serial in serials if serial not in found]
+
+    def compact(self):
+        cutoff = ((self.now or datetime.now()) - timedelta(days=GENEALOGY_INDEX_RETENTION_DAYS)).strftime(
+            "%Y-%m-%d %H:%M:%S"
         )
+        with closing(sqlite3.connect(self.path)) as db:
+            with db:
+                db.execute("DELETE FROM genealogy WHERE consumed_at < ?", (cutoff,))
+                db.execute("DELETE FROM nest_records WHERE recorded_at < ?", (cutoff,))
+                db.execute(
+                    "INSERT OR REPLACE INTO index_state VALUES ('compacted_at', ?)",
+                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+                )
+            db.execute("VACUUM")
+
+    def compact_if_due(self, every_hours=24):
+        with closing(sqlite3.connect(self.path)) as db:
+            compacted_at = self._state(db, "compacted_at")
+        if compacted_at is None or pd.Timestamp(compacted_at) < pd.Timestamp(datetime.now() - timedelta(hours=every_hours)):
+            self.compact()
+
+
+########################################################################################
+# Function to Attribute Serials via the Genealogy Index, Falling Back to the Warehouse
+########################################################################################
+def lookup_hairpin_origins(serials, targets, pool, genealogy_index=None, metrics=None, deadline=None):
+    if genealogy_index is None:
+        return fetch_hairpin_origins(serials, targets, pool, metrics, deadline)
+    origins, missing = genealogy_index.lookup(serials)
+    if missing:
+        print(f"Genealogy index: {len(missing)} serial(s) not indexed, querying the warehouse")
+        fetched = fetch_hairpin_origins(missing, targets, pool, metrics, deadline)
+        if fetched is None:
+            return None
+        origins = pd.concat([origins, fetched], ignore_index=True)
+    return origins
 
-    select distinct
-        -- SS.scanned_child_serial as Stack_Serial,
-        -- WS.parameter_value_raw as Copper_Wire_Spool,
-        -- NPR.product_serial as Nest_Product_Serial,
-        count(distinct GH.product_serial) as COUNT,
-        opf.station_name as STATION_NAME,
-        NPR.station_name as Sttr_030_Hairpin_Origin
-        -- GH.product_serial as Stator_Assembly_Serial_Number,
-        -- opf.result_status as Sttr_050_Result_Status,
-        -- opf.recorded_at as Sttr_050_Recorded_At_Central_Time,
-        -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit
-
-    from nest_parameter_records as NPR
-
-    join genealogy_hist as GH
-        on NPR.product_serial = GH.scanned_child_serial
-    join op_fifty as opf
-        on GH.product_serial = opf.product_serial
-    join stack_serial as SS
-        ON GH.product_serial = SS.product_serial
-    left join wire_spool as WS
-        on NPR.product_serial = WS.product_serial
-
-    WHERE
-        opf.station_name ILIKE '%050%'
-        and opf.result_status = 'FAIL'
-        and opf.recorded_at > '{recorded_at}'
-        group by opf.station_name, NPR.station_name
+
+########################################################################################
+# Function defining all queries to run for one [recorded_at, recorded_until) window
+########################################################################################
+def build_station_020_query(recorded_at, recorded_until, targets):
+    return f"""
+    select count(distinct product_serial) as COUNT, STATION_NAME , work_location_desc as PARAMETER_NAME,
+        collect_set(product_serial) as SERIALS, shop_name as SHOP_NAME, line_name as LINE_NAME,
+        date_trunc('HOUR', started_at) as WINDOW_HOUR
+    from manufacturing.mes.fct_work_location_jobs
+    where {target_filter(targets)}
+    and station_name = '020'
+    and started_at >= '{recorded_at}'
+    and started_at < '{recorded_until}'
+    and job_status != 'OK'
+    group by date_trunc('HOUR', started_at), shop_name, line_name, station_name, work_location_desc
     """
 
+
+########################################################################################
+# Query-Template Registry: Every Window Query Is Defined Once
+########################################################################################
+# Each builder takes ([recorded_at, recorded_until), targets) and returns rows tagged
+# with their WINDOW_HOUR, so one query over any span serves every hour bucket in it.
+# SCADA alarm pulls (one per alarm table) are added by build_hourly_queries.
+WINDOW_QUERY_TEMPLATES = {
+    "df_20": build_station_020_query,  # Query 20
+    "df_spinal_stations": build_spinal_station_query,  # Query 40/90/100/180/210 Unique SN
+    "df_hairpin_fail_serials": build_hairpin_fail_serials_query,  # Query 40/50/90 failing serials
+}
+
+
+########################################################################################
+# Function defining all queries to run for one [recorded_at, recorded_until) window
+########################################################################################
+def build_hourly_queries(recorded_at, recorded_until, targets):
+    queries = {
+        name: build_query(recorded_at, recorded_until, targets) for name, build_query in WINDOW_QUERY_TEMPLATES.items()
+    }
+
     ########################################################################################
-    # Query 90 - Fails by Hairpin Origin - Every Hour
+    # Query 50/70 - Raw SCADA Alarms, Classified Locally by ALARM_RULES - Every Hour
     ########################################################################################
-    query_90_hairpin_origin = f"""
-    with
-
-    nest_parameter_records as 
-        (
-        select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where 
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '030%'
-            and parameter_name = 'Nest'
-        ),
-
-    genealogy_hist as 
-        (
-        select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-        from manufacturing.mes.fct_genealogy_hist
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-        ),
-
-    stack_serial as 
-        (
-        select scanned_child_serial, product_serial
-        from manufacturing.mes.fct_genealogy_hist
-        where line_name = 'STTR01'
-        -- and scanned_child_part in ('PT00237854-C') 
-        ),
-
-    wire_spool as 
-        (
-        select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-        -- from manufacturing.mes.fct_parameter_records
-        from manufacturing.spinal.fct_spinal_parameter_records
-        where
-            shop_name = 'DU03'
-            and line_name = 'STTR01'
-            and station_name like '030%'
-            and parameter_name ilike '%batch%'
-            -- and parameter_value_raw ilike '%PT00237846-C%' 
-        ),
-
-    op_sixty_five as
-        (
-        SELECT 
-            DISTINCT product_serial, STATION_NAME, PARAMETER_NAME, recorded_at
-            FROM manufacturing.spinal.fct_spinal_parameter_records
-            WHERE line_name = 'STTR01'
-            AND STATION_NAME = '090'
-            -- AND overall_process_status = 'NOK'
-            AND recorded_at > '{recorded_at}'
-            AND (
-                (PARAMETER_NAME = 'Value Height Pin X' AND (parameter_value_raw < 39 OR parameter_value_raw > 47)) OR
-                (PARAMETER_NAME = 'Value Pixle Area Pin X' AND (parameter_value_raw < 5000 OR parameter_value_raw > 12000)) OR
-                (PARAMETER_NAME = 'Value Blob X Feret Diameters Pin X' AND (parameter_value_raw < 2.6 OR parameter_value_raw > 3.9)) OR
-                (PARAMETER_NAME = 'Value Blob Y Feret Diameters Pin X' AND (parameter_value_raw < 1.2 OR parameter_value_raw > 3.0)) OR
-                (PARAMETER_NAME = 'Value Angle 1 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > 45)) OR
-                (PARAMETER_NAME = 'Value Angle 2 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > 45)) OR
-                (PARAMETER_NAME = 'Value Level Difference' AND (parameter_value_raw < 0 OR parameter_value_raw > 0.6)) OR
-                (PARAMETER_NAME = 'Value Pin 1 edge to stack edge' AND (parameter_value_raw < 0 OR parameter_value_raw > 100000)) OR
-                (PARAMETER_NAME = 'Value Pin 5 edge to stack edge' AND (parameter_value_raw < 0 OR parameter_value_raw > 100000))
-            )
-            -- GROUP BY STATION_NAME, PARAMETER_NAME
-            -- ORDER BY COUNT DESC
+    # SCADA alarms live in one table per shop: one query per table covers all its lines
+    alarm_tables = {}
+    for target in targets:
+        alarm_tables.setdefault(target["alarm_table"], []).append(target)
+    for alarm_table, table_targets in alarm_tables.items():
+        queries[f"df_alarms@{alarm_table}"] = build_alarm_query(recorded_at, recorded_until, alarm_table, table_targets)
+    return queries
 
-        ),
 
-    STTR_065_WEs AS 
-        (
-        SELECT *
-        FROM main.adhoc.sttr_065_hmi_hairpin_naming_work_elements
-        )
+########################################################################################
+# SCADA Alarm Classification Rules
+########################################################################################
+# One raw pull per alarm table and window covers every rule; each rule picks its alarms
+# by station and description pattern (matched like ILIKE '%...%') and counts them into
+# `name`. PARAMETER_NAME is either the constant `parameter` or, with `parameter_key`, the
+# description text after that key. `chatter_seconds` drops re-activations of the same
+# source within that many seconds of its previous alarm clearing.
+ALARM_PATTERN_FLAGS = re.IGNORECASE | re.DOTALL
+ALARM_RULES = [
+    {
+        "name": "df_50",
+        "station": "050",
+        "pattern": re.compile(r"Assembly error.*Task\[301\]", ALARM_PATTERN_FLAGS),
+        "parameter": "Twisting Check Plate Fails",
+        "chatter_seconds": 30,
+    },
+    {
+        "name": "df_50",
+        "station": "050",
+        "pattern": re.compile(r"Gripper.*work", ALARM_PATTERN_FLAGS),
+        "parameter_key": "Key",
+    },
+    {
+        "name": "df_70",
+        "station": "070",
+        "pattern": re.compile(r"Assembly error", ALARM_PATTERN_FLAGS),
+        "parameter": "Bad Cuts/Welding Fail",
+        "parameter_column": "ALARM_DESCRIPTION",
+    },
+]
+# Alarms this far before the window are pulled only as chatter predecessors
+ALARM_CHATTER_LOOKBACK_MINUTES = int(os.getenv("ALARM_CHATTER_LOOKBACK_MINUTES", "60"))
+
+
+# Windows are naive America/Chicago times; columns stored in UTC (activated_at) are
+# compared against UTC literals instead of being converted row by row, so the warehouse
+# can prune on them. Across DST changes consecutive windows still meet exactly.
+def to_utc_literal(local_time):
+    local = pytz.timezone("America/Chicago").localize(datetime.strptime(local_time, "%Y-%m-%d %H:%M"))
+    return local.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Alarm sources are named like "DU03-STTR01-050-PLC01"; line and station come from the name
+def _alarm_sources(targets):
+    stations = sorted({rule["station"] for rule in ALARM_RULES})
+    return [(f"%{t['line']}-{station}%", t, station) for t in targets for station in stations]
 
-    select distinct
-        -- SS.scanned_child_serial as Stack_Serial,
-        -- WS.parameter_value_raw as Copper_Wire_Spool,
-        -- NPR.product_serial as Nest_Product_Serial,
-        count(distinct GH.product_serial) as COUNT,
-        opsf.station_name as STATION_NAME,
-        NPR.station_name as Sttr_030_Hairpin_Origin
-        -- GH.product_serial as Stator_Assembly_Serial_Number
-        -- opsf.result_status as Sttr_065_Result_Status,
-        -- opsf.recorded_at as Sttr_065_Recorded_At_Central_Time,
-        -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit,
-        -- sfwe.Hairpins_In_Welded_Pin_Pair,
-            -- LEFT(sfwe.Hairpins_In_Welded_Pin_Pair, 5) 
-            -- || ' & ' || 
-            -- SUBSTRING(sfwe.Hairpins_In_Welded_Pin_Pair, POSITION('&' IN sfwe.Hairpins_In_Welded_Pin_Pair) + 2, 5) 
-            -- AS Hairpin_Short_Name
-
-    from nest_parameter_records as NPR
-
-    join genealogy_hist as GH
-        on NPR.product_serial = GH.scanned_child_serial
-    join op_sixty_five as opsf
-        on GH.product_serial = opsf.product_serial
-    join stack_serial as SS
-        ON GH.product_serial = SS.product_serial
-    left join wire_spool as WS
-        on NPR.product_serial = WS.product_serial
-    -- join STTR_065_WEs sfwe
-    --     on opsf.work_element = sfwe.DELMIA_WE_Name
-
-    WHERE
-        opsf.station_name ILIKE '%090%'
-        and opsf.recorded_at > '{recorded_at}'
-        group by opsf.station_name, NPR.station_name
+
+########################################################################################
+# Function to Build the Raw Alarm Pull for One Alarm Table
+########################################################################################
+def build_alarm_query(recorded_at, recorded_until, alarm_table, targets):
+    lookback_at = (
+        datetime.strptime(recorded_at, "%Y-%m-%d %H:%M") - timedelta(minutes=ALARM_CHATTER_LOOKBACK_MINUTES)
+    ).strftime("%Y-%m-%d %H:%M")
+    sources = _alarm_sources(targets)
+    source_filter = "\n        OR ".join(f"alarm_source_scada_short_name ILIKE '{pattern}'" for pattern, _, _ in sources)
+
+    def source_case(value):
+        branches = "\n".join(
+            f"            WHEN alarm_source_scada_short_name ILIKE '{pattern}' THEN {_sql_string(value(t, station))}"
+            for pattern, t, station in sources
+        )
+        return f"""CASE
+{branches}
+        END"""
+
+    return f"""
+    SELECT
+        alarm_source_scada_short_name AS ALARM_SOURCE,
+        alarm_description AS ALARM_DESCRIPTION,
+        activated_at AS ACTIVATED_AT,
+        cleared_at AS CLEARED_AT,
+        activated_at >= '{to_utc_literal(recorded_at)}' AS IN_WINDOW,
+        date_trunc('HOUR', CONVERT_TIMEZONE('UTC', 'America/Chicago', activated_at)) AS WINDOW_HOUR,
+        {source_case(lambda t, station: station)} AS STATION_NAME,
+        {source_case(lambda t, station: t["shop"])} AS SHOP_NAME,
+        {source_case(lambda t, station: t["line"])} AS LINE_NAME
+    FROM {alarm_table}
+    WHERE (
+        {source_filter}
+    )
+    AND activated_at >= '{to_utc_literal(lookback_at)}'
+    AND activated_at < '{to_utc_literal(recorded_until)}'
+    AND alarm_priority_desc IN ('high', 'critical')
     """
 
-#########################################################################################
-# If Statement for Summary Queries at EOS
-#########################################################################################
-    if (15 <= current_hour < 16) or (5 <= current_hour < 6):
-        # Define the queries
-        ########################################################################################
-        # Query 20 - Summary
-        ########################################################################################
-        query_20_summary = f"""
-        select count(distinct product_serial) as COUNT, STATION_NAME , work_location_desc as PARAMETER_NAME
-        from manufacturing.mes.fct_work_location_jobs
-        where shop_name = 'DU02'
-        and line_name = 'STTR01'
-        and station_name = '020'
-        and started_at > '{recorded_at_summary}'
-        and work_location_name = '02'
-        and job_status = 'NOK'
-        group by station_name, work_location_desc
-        """
-        
-        ########################################################################################
-        # Query 40 - Summary
-        ########################################################################################
-        query_40_summary = f"""
-        SELECT COUNT(distinct product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-        FROM manufacturing.spinal.fct_spinal_parameter_records
-        WHERE line_name = 'STTR01'
-        AND STATION_NAME = '040'
-        AND PARAMETER_NAME = 'Force process value'
-        AND parameter_id = 2
-        AND overall_process_status = 'NOK'
-        AND recorded_at > '{recorded_at_summary}'
-        GROUP BY STATION_NAME, PARAMETER_NAME
-        """
 
-        ########################################################################################
-        # Query 50 - Summary
-        ########################################################################################
-        query_50_summary = f"""
-        WITH alarm_data AS (
-            SELECT *,
-                LAG(cleared_at) OVER (PARTITION BY alarm_source_scada_short_name ORDER BY activated_at) AS prev_cleared_at
-            FROM manufacturing.drive_unit.fct_du02_scada_alarms
-            WHERE alarm_source_scada_short_name ILIKE '%STTR01-050%'
-            AND CONVERT_TIMEZONE('UTC', 'America/Chicago', activated_at) > '{recorded_at_summary}'
-            AND alarm_priority_desc IN ('high', 'critical')
+########################################################################################
+# Function to Drop Chattering Alarm Re-Activations (vectorized)
+########################################################################################
+def chatter_mask(sources, activated, cleared, seconds):
+    # Arrays sorted by (source, activated): keep an alarm unless the same source's previous
+    # alarm cleared less than `seconds` before it activated
+    keep = np.ones(len(sources), dtype=bool)
+    if len(sources) > 1:
+        same_source = sources[1:] == sources[:-1]
+        prev_cleared = cleared[:-1]
+        keep[1:] = ~same_source | np.isnat(prev_cleared) | (activated[1:] > prev_cleared + np.timedelta64(seconds, "s"))
+    return keep
+
+
+########################################################################################
+# Function to Classify Raw Alarms Into the Station Result DataFrames
+########################################################################################
+def classify_alarms(alarms, rules=ALARM_RULES):
+    alarms = alarms.sort_values(["ALARM_SOURCE", "ACTIVATED_AT"], kind="mergesort", ignore_index=True)
+    sources = alarms["ALARM_SOURCE"].to_numpy(dtype=object)
+    activated = pd.to_datetime(alarms["ACTIVATED_AT"]).to_numpy(dtype="datetime64[ns]")
+    cleared = pd.to_datetime(alarms["CLEARED_AT"]).to_numpy(dtype="datetime64[ns]")
+    descriptions = alarms["ALARM_DESCRIPTION"].fillna("")
+    in_window = alarms["IN_WINDOW"].fillna(False).to_numpy(dtype=bool)
+
+    frames = {}
+    for rule in rules:
+        column = rule.get("parameter_column", "PARAMETER_NAME")
+        matched = (
+            in_window
+            & (alarms["STATION_NAME"] == rule["station"]).to_numpy()
+            & descriptions.str.contains(rule["pattern"], na=False).to_numpy()
+        )
+        if rule.get("chatter_seconds") is not None:
+            matched &= chatter_mask(sources, activated, cleared, rule["chatter_seconds"])
+        if "parameter_key" in rule:
+            parameters = (
+                descriptions[matched].str.split(rule["parameter_key"], n=2, regex=False).str[1].fillna("").str.strip(" []")
+            )
+        else:
+            parameters = rule["parameter"]
+        df = pd.DataFrame(
+            {
+                "STATION_NAME": rule["station"],
+                column: parameters,
+                "SHOP_NAME": alarms["SHOP_NAME"][matched],
+                "LINE_NAME": alarms["LINE_NAME"][matched],
+                "WINDOW_HOUR": alarms["WINDOW_HOUR"][matched],
+            }
         )
+        df = df.groupby(
+            ["WINDOW_HOUR", "SHOP_NAME", "LINE_NAME", "STATION_NAME", column], sort=False
+        ).size().reset_index(name="COUNT")
+        frames.setdefault(rule["name"], []).append(
+            df[["COUNT", "STATION_NAME", column, "SHOP_NAME", "LINE_NAME", "WINDOW_HOUR"]]
+        )
+    return {name: pd.concat(dfs, ignore_index=True) for name, dfs in frames.items()}
+
+
+########################################################################################
+# Function to Check via EXPLAIN That Window Queries Prune on Their Time Column
+########################################################################################
+# Time column each window query must compare directly against [start, end) literals
+WINDOW_TIME_COLUMNS = {
+    "df_20": "started_at",
+    "df_spinal_stations": "recorded_at",
+    "df_alarms": "activated_at",
+    "df_hairpin_fail_serials": "recorded_at",
+}
+
+
+def time_predicate_bounds(plan, column):
+    # Looks for filters on the bare column: Databricks "GreaterThanOrEqual(activated_at,...)"
+    # or "(recorded_at#12 < ...)", DuckDB "activated_at>='...'". A column wrapped in a
+    # function (CONVERT_TIMEZONE(..., activated_at) >= ...) doesn't match.
+    compact = re.sub(r"[\s│─┌┐└┘┬┴├┤]", "", plan)
+    col = r"(?<!_)" + re.escape(column) + r"(#\d+L?)?"
+    lower = re.search(rf"GreaterThan(OrEqual)?\({col},|{col}>", compact, re.IGNORECASE) is not None
+    upper = re.search(rf"LessThan(OrEqual)?\({col},|{col}<", compact, re.IGNORECASE) is not None
+    return lower, upper
+
+
+def check_pruning(run_at=None, targets=None):
+    one_hour_before = (run_at or datetime.now()) - timedelta(hours=1)
+    recorded_at = one_hour_before.strftime("%Y-%m-%d %H:00")
+    recorded_until = (one_hour_before + timedelta(hours=1)).strftime("%Y-%m-%d %H:00")
+    queries = build_hourly_queries(recorded_at, recorded_until, targets or load_targets())
+    pool = DatabricksConnectionPool()
+    try:
+        plans = run_queries_concurrently({name: "EXPLAIN " + query for name, query in queries.items()}, pool)
+    finally:
+        pool.close()
+
+    rows = []
+    for name, plan in plans.items():
+        column = WINDOW_TIME_COLUMNS[name.split("@")[0]]
+        lower, upper = time_predicate_bounds("\n".join(plan.astype(str).to_numpy().ravel()), column)
+        rows.append({"QUERY": name, "COLUMN": column, "LOWER_BOUND": lower, "UPPER_BOUND": upper})
+    df_pruning = pd.DataFrame(rows)
+    print(f"Window {recorded_at} to {recorded_until}")
+    print(df_pruning.to_string(index=False))
+    if not (df_pruning["LOWER_BOUND"] & df_pruning["UPPER_BOUND"]).all():
+        print("Some window queries don't filter [start, end) on their raw time column")
+        return 1
+    return 0
+
+
+########################################################################################
+# Result DataFrames produced for every hour window
+########################################################################################
+HOURLY_RESULT_NAMES = [
+    "df_20",
+    "df_40",
+    "df_50",
+    "df_70",
+    "df_90",
+    "df_100",
+    "df_180",
+    "df_210_unique_sn",
+    "df_40_hairpin_origin",
+    "df_50_hairpin_origin",
+    "df_90_hairpin_origin",
+]
+
+
+########################################################################################
+# Query Scheduling: Start Order and What a Query Missing the Deadline Leaves Pending
+########################################################################################
+# Lower starts first: the cheap station counts behind the hourly post, then hairpin
+# attribution and the genealogy index refresh, then every query of a shift-summary window
+QUERY_PRIORITIES = {
+    "df_20": 0,
+    "df_spinal_stations": 0,
+    "df_alarms": 0,
+    "df_hairpin_fail_serials": 1,
+    "genealogy": 2,
+    "nest_records": 2,
+}
+SUMMARY_QUERY_PRIORITY = 3
+
+# Window queries behind the per-parameter table and the station Pareto
+STATION_COUNT_QUERIES = ["df_20", "df_spinal_stations", "df_alarms"]
+
+# Hourly results fed by each window query (and by the phase-2 origin lookup)
+QUERY_RESULT_NAMES = {
+    "df_20": ["df_20"],
+    "df_spinal_stations": [m["name"] for m in SPINAL_STATION_METRICS],
+    "df_alarms": list(dict.fromkeys(rule["name"] for rule in ALARM_RULES)),
+    "df_hairpin_fail_serials": [h["name"] for h in HAIRPIN_ORIGIN_RESULTS],
+    "hairpin_origin": [h["name"] for h in HAIRPIN_ORIGIN_RESULTS],
+}
+
+# Columns of each window query, for the empty stand-in of one that missed the deadline
+WINDOW_QUERY_COLUMNS = {
+    "df_20": ["COUNT", "STATION_NAME", "PARAMETER_NAME", "SERIALS", "SHOP_NAME", "LINE_NAME", "WINDOW_HOUR"],
+    "df_spinal_stations": [
+        "COUNT", "STATION_NAME", "PARAMETER_NAME", "METRIC", "SERIALS", "SHOP_NAME", "LINE_NAME", "WINDOW_HOUR"
+    ],
+    "df_hairpin_fail_serials": ["METRIC", "STATION_NAME", "PRODUCT_SERIAL", "SHOP_NAME", "LINE_NAME", "WINDOW_HOUR"],
+    "df_alarms": [
+        "ALARM_SOURCE", "ALARM_DESCRIPTION", "ACTIVATED_AT", "CLEARED_AT", "IN_WINDOW",
+        "WINDOW_HOUR", "STATION_NAME", "SHOP_NAME", "LINE_NAME",
+    ],
+}
+
+
+########################################################################################
+# Functions to Split Time Ranges Into Hour Buckets
+########################################################################################
+def hour_buckets(recorded_at, recorded_until):
+    # Every hour overlapping [recorded_at, recorded_until); bounds needn't be on the hour
+    start = datetime.strptime(recorded_at, "%Y-%m-%d %H:%M").replace(minute=0)
+    end = datetime.strptime(recorded_until, "%Y-%m-%d %H:%M")
+    hours = []
+    while start < end:
+        hours.append(start.strftime("%Y-%m-%d %H:00"))
+        start += timedelta(hours=1)
+    return hours
+
+
+def coalesce_hours(hours):
+    # Contiguous missing hours are fetched as one window instead of one query set per hour
+    windows = []
+    for hour in sorted(hours):
+        hour_end = (datetime.strptime(hour, "%Y-%m-%d %H:00") + timedelta(hours=1)).strftime(
+            "%Y-%m-%d %H:00"
+        )
+        if windows and windows[-1][1] == hour:
+            windows[-1] = (windows[-1][0], hour_end)
+        else:
+            windows.append((hour, hour_end))
+    return windows
+
+
+########################################################################################
+# Function to Split WINDOW_HOUR-Tagged Results Into Per-Hour Results
+########################################################################################
+def split_window_hours(results, hours):
+    # {name: df with WINDOW_HOUR} -> {hour: {name: df without it}}, every hour present
+    split = {hour: {} for hour in hours}
+    for name, df in results.items():
+        df_hours = pd.to_datetime(df["WINDOW_HOUR"]).dt.strftime("%Y-%m-%d %H:00").to_numpy()
+        df = df.drop(columns=["WINDOW_HOUR"])
+        for hour in hours:
+            split[hour][name] = df[df_hours == hour].reset_index(drop=True)
+    return split
+
+
+########################################################################################
+# Function to Turn One Window's Query Results Into Per-Hour, Per-Target Results
+########################################################################################
+# frames is keyed by query name (or result name, for results already derived); queries
+# not in it are skipped, so the station counts can be split before attribution is in
+def split_window_results(window, frames, targets):
+    results = {}
+    # Per-alarm-table results ("df_alarms@<table>") are stacked back into one frame per name
+    for key, df in frames.items():
+        name = key.split("@")[0]
+        results[name] = pd.concat([results[name], df], ignore_index=True) if name in results else df
+    if "df_alarms" in results:
+        results.update(classify_alarms(results.pop("df_alarms")))
+    if "df_spinal_stations" in results:
+        results.update(split_spinal_station_results(results.pop("df_spinal_stations")))
+    # Results are keyed "<shop>/<line>/<name>" from here on, each without shop/line columns
+    return {
+        hour: split_target_results(hour_results, targets)
+        for hour, hour_results in split_window_hours(results, hour_buckets(*window)).items()
+    }
+
+
+########################################################################################
+# Function to Fetch the Hourly Result DataFrames for Several Windows at Once
+########################################################################################
+# Each window is fetched with one query set however many hours it spans; results come
+# back per hour bucket: ({hour: results}, {hour: sketches}, {hour: pending names}).
+# Queries of summary_windows start after the others' attribution queries. A query that
+# misses the deadline leaves empty results, listed under the hour's pending names.
+# on_station_counts(window, {hour: results}), if given, gets each window's station counts
+# as soon as their queries are in, before attribution finishes.
+def fetch_window_results(
+    windows,
+    targets,
+    pool,
+    genealogy_index=None,
+    metrics=None,
+    deadline=None,
+    summary_windows=(),
+    on_station_counts=None,
+):
+    queries, priorities, query_windows = {}, {}, {}
+    for window in windows:
+        for name, query in build_hourly_queries(*window, targets).items():
+            queries[(window, name)] = query
+            priorities[(window, name)] = (
+                SUMMARY_QUERY_PRIORITY if window in summary_windows else QUERY_PRIORITIES[name.split("@")[0]]
+            )
+            query_windows[(window, name)] = window
+    if genealogy_index is not None:
+        # The incremental index refresh runs alongside the window queries. It reads
+        # everything past the high-water mark, so it is recorded but never reused.
+        for name, query in genealogy_index.refresh_queries(targets).items():
+            queries[("genealogy_index", name)] = query
+            priorities[("genealogy_index", name)] = QUERY_PRIORITIES[name]
+            query_windows[("genealogy_index", name)] = None
+
+    station_keys = {
+        window: {(w, name) for w, name in queries if w == window and name.split("@")[0] in STATION_COUNT_QUERIES}
+        for window in windows
+    }
+    station_frames = {window: {} for window in windows}
+
+    def collect_station_counts(key, df):
+        window, name = key
+        if key not in station_keys.get(window, ()):
+            return
+        station_frames[window][name] = df
+        if len(station_frames[window]) == len(station_keys[window]):
+            window_results = split_window_results(window, station_frames[window], targets)
+            # SERIALS only feeds the serial sketches, which are built once attribution is in
+            for results in window_results.values():
+                for name, df in results.items():
+                    results[name] = df.drop(columns=["SERIALS"], errors="ignore")
+            on_station_counts(window, window_results)
+
+    fetched = run_queries_concurrently(
+        queries,
+        pool,
+        metrics=metrics,
+        priorities=priorities,
+        deadline=deadline,
+        on_result=None if on_station_counts is None else collect_station_counts,
+        windows=query_windows,
+    )
+    missed = {key for key in queries if key not in fetched}
+
+    if genealogy_index is not None:
+        refresh = {name: fetched.pop(("genealogy_index", name), None) for name in ["genealogy", "nest_records"]}
+        if any(df is None for df in refresh.values()):
+            # The high-water marks stay put, so the next run picks the refresh up again
+            print("Genealogy index refresh missed the deadline; serials it lacks are looked up in the warehouse")
+        else:
+            genealogy_index.apply_refresh(refresh)
+
+    for window, name in missed:
+        if window != "genealogy_index":
+            fetched[(window, name)] = pd.DataFrame(columns=WINDOW_QUERY_COLUMNS[name.split("@")[0]])
+
+    # One genealogy lookup covers the failing serials of every window
+    fail_serials = {window: fetched.pop((window, "df_hairpin_fail_serials")) for window in windows}
+    origins = lookup_hairpin_origins(
+        set().union(*(df["PRODUCT_SERIAL"] for df in fail_serials.values())),
+        targets,
+        pool,
+        genealogy_index,
+        metrics,
+        deadline,
+    )
+    origins_missed = origins is None
+    if origins_missed:
+        origins = pd.DataFrame(columns=["PRODUCT_SERIAL", "STTR_030_STATION"])
+
+    hour_results, hour_sketches, hour_pending = {}, {}, {}
+    for window in windows:
+        # Names (target-keyed, like the results) left empty by a query that missed the deadline
+        pending = set()
+        for w, key in missed | ({(window, "hairpin_origin")} if origins_missed else set()):
+            if w == window:
+                name, _, alarm_table = key.partition("@")
+                for target in targets:
+                    if not alarm_table or target["alarm_table"] == alarm_table:
+                        pending.update(f"{target_id(target)}/{n}" for n in QUERY_RESULT_NAMES[name])
+
+        frames = {key: df for (w, key), df in fetched.items() if w == window}
+        frames.update(attribute_hairpin_origins(fail_serials[window], origins))
+        for hour, results in split_window_results(window, frames, targets).items():
+            hour_sketches[hour] = extract_serial_sketches(results)
+            hour_results[hour] = results
+            hour_pending[hour] = pending
+    return hour_results, hour_sketches, hour_pending
+
+
+########################################################################################
+# Function to Add Up Result DataFrames From Several Windows
+########################################################################################
+def sum_window_results(window_results, names=HOURLY_RESULT_NAMES):
+    # Counts are per-window distinct serials, so a serial failing in two hours counts twice
+    summed = {}
+    for name in names:
+        frames = [results[name] for results in window_results if name in results]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["COUNT"])
+        df["COUNT"] = pd.to_numeric(df["COUNT"])
+        keys = [column for column in df.columns if column != "COUNT"]
+        if keys and not df.empty:
+            df = df.groupby(keys, dropna=False, as_index=False, sort=False)["COUNT"].sum()
+        summed[name] = df[["COUNT"] + keys].sort_values(["COUNT"], ascending=False, ignore_index=True)
+    return summed
 
-        SELECT 
-            COUNT(*) AS COUNT,
-            '050' AS STATION_NAME,
-            'Twisting Check Plate Fails' AS PARAMETER_NAME
-        FROM alarm_data
-        WHERE (activated_at > prev_cleared_at + INTERVAL '30 seconds' OR prev_cleared_at IS NULL)
-        AND alarm_description ILIKE '%Assembly error%Task[301]%'
-
-        UNION ALL
-
-        SELECT 
-            COUNT(*) AS COUNT,
-            '050' AS STATION_NAME,
-            TRIM(BOTH ' []' FROM SPLIT_PART(alarm_description, 'Key', 2)) AS PARAMETER_NAME
-        FROM alarm_data
-        WHERE alarm_description ILIKE '%Gripper%work%'
-        GROUP BY parameter_name;
-        """
 
-        ########################################################################################
-        # Query 70 - Summary
-        ########################################################################################
-        query_70_summary = f"""
-        SELECT 
-            COUNT(*) as COUNT,
-            '070' as STATION_NAME,
-            'Bad Cuts/Welding Fail' as ALARM_DESCRIPTION
-        FROM manufacturing.drive_unit.fct_du03_scada_alarms
-        WHERE alarm_source_scada_short_name ILIKE '%STTR01-070%'
-        AND CONVERT_TIMEZONE('UTC', 'America/Chicago', activated_at) > '{recorded_at_summary}'
-        AND alarm_priority_desc IN ('high', 'critical')
-        AND alarm_description ILIKE '%Assembly error%'
-        group by STATION_NAME
-        """
+########################################################################################
+# Mergeable Distinct-Serial Sketches
+########################################################################################
+# count(distinct product_serial) can't be summed across windows, so every window also
+# keeps a sketch of the serials behind each count. Sketches merge by union, so any
+# larger window (shift, day, week) is answered locally from the hourly ones.
+#
+# HLL uses 2^12 one-byte registers over 64-bit serial hashes: relative standard error
+# 1.04 / sqrt(4096) ~= 1.6% (so ~95% of estimates within +/-3.3%), with linear-counting
+# correction for small counts. Exact sketches are serial sets and have no error.
+HLL_PRECISION = 12
+
+
+def _bit_length(values):
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= (np.uint64(1) << np.uint64(shift))
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class DistinctSerialSketch:
+    def __init__(self, serials=None, registers=None):
+        self.serials = serials
+        self.registers = registers
+
+    @classmethod
+    def from_serials(cls, serials, mode=None):
+        mode = mode or DISTINCT_SKETCH_MODE
+        serials = {str(serial) for serial in serials}
+        sketch = cls(serials=serials)
+        if mode == "hll" or (mode == "auto" and len(serials) > EXACT_SKETCH_MAX_SERIALS):
+            sketch = sketch.to_hll()
+        return sketch
+
+    @property
+    def exact(self):
+        return self.registers is None
+
+    def to_hll(self):
+        if not self.exact:
+            return self
+        registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+        if self.serials:
+            hashes = pd.util.hash_array(np.array(sorted(self.serials), dtype=object))
+            index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+            remainder = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+            rank = (64 - HLL_PRECISION) - _bit_length(remainder) + 1
+            np.maximum.at(registers, index, rank.astype(np.uint8))
+        return DistinctSerialSketch(registers=registers)
+
+    def merge(self, other, mode=None):
+        mode = mode or DISTINCT_SKETCH_MODE
+        if self.exact and other.exact:
+            merged = DistinctSerialSketch(serials=self.serials | other.serials)
+            if mode == "hll" or (mode == "auto" and len(merged.serials) > EXACT_SKETCH_MAX_SERIALS):
+                merged = merged.to_hll()
+            return merged
+        if mode == "exact":
+            raise ValueError("Can't merge an HLL sketch in exact mode")
+        return DistinctSerialSketch(registers=np.maximum(self.to_hll().registers, other.to_hll().registers))
+
+    def count(self):
+        if self.exact:
+            return len(self.serials)
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_blob(self):
+        if self.exact:
+            return b"E" + json.dumps(sorted(self.serials)).encode()
+        return b"H" + bytes([HLL_PRECISION]) + self.registers.tobytes()
+
+    @classmethod
+    def from_blob(cls, blob):
+        blob = bytes(blob)
+        if blob[:1] == b"E":
+            return cls(serials=set(json.loads(blob[1:].decode())))
+        if blob[1] != HLL_PRECISION:
+            raise ValueError(f"HLL sketch precision {blob[1]} != {HLL_PRECISION}")
+        return cls(registers=np.frombuffer(blob[2:], dtype=np.uint8).copy())
 
-        ########################################################################################
-        # Query 90 - Summary
-        ########################################################################################
-        query_90_summary = f"""
-        SELECT 
-        COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-            FROM manufacturing.spinal.fct_spinal_parameter_records
-            WHERE SHOP_NAME = 'DU03'
-            AND line_name = 'STTR01'
-            AND STATION_NAME = '065'
-            -- AND overall_process_status = 'NOK'
-            AND recorded_at > '{recorded_at_summary}'
-            AND (
-                (PARAMETER_NAME = 'Value Height Pin X' AND (parameter_value_raw < 40 OR parameter_value_raw > 46.3)) OR
-                (PARAMETER_NAME = 'Value Pixle Area Pin X' AND (parameter_value_raw < 2600 OR parameter_value_raw > 7500)) OR
-                (PARAMETER_NAME = 'Value Blob X Feret Diameters Pin X' AND (parameter_value_raw < 1.8 OR parameter_value_raw > 3.6)) OR
-                (PARAMETER_NAME = 'Value Blob Y Feret Diameters Pin X' AND (parameter_value_raw < 0.8 OR parameter_value_raw > 2.2)) OR
-                (PARAMETER_NAME = 'Value Angle 1 Pin X' AND (parameter_value_raw < 13 OR parameter_value_raw > 45)) OR
-                (PARAMETER_NAME = 'Value Angle 2 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > 13)) OR
-                (PARAMETER_NAME = 'Value Level Difference' AND (parameter_value_raw < 0 OR parameter_value_raw > 0.7)) OR
-                (PARAMETER_NAME = 'Value Angle Connection Phase 1' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value Angle Connection Phase 2' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value Angle Connection Phase 3' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value Height Connection Phase 1' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value Height Connection Phase 2' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value Height Connection Phase 3' AND (parameter_value_raw < -2.5 OR parameter_value_raw > 2.5)) OR
-                (PARAMETER_NAME = 'Value X Connection Element 1' AND (parameter_value_raw < -5.1 OR parameter_value_raw > -3.9)) OR
-                (PARAMETER_NAME = 'Value Y Connection Element 1' AND (parameter_value_raw < -23.85 OR parameter_value_raw > -22.95)) OR
-                (PARAMETER_NAME = 'Value X Connection Element 2' AND (parameter_value_raw < -6.3 OR parameter_value_raw > -5.6)) OR
-                (PARAMETER_NAME = 'Value Y Connection Element 2' AND (parameter_value_raw < -94.95 OR parameter_value_raw > -94.05))             
-            )
-            GROUP BY STATION_NAME, PARAMETER_NAME
-            ORDER BY COUNT DESC
-        """
 
-        ########################################################################################
-        # Query 100 - Summary
-        ########################################################################################
-        query_100_summary = f"""
-        SELECT COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-            FROM manufacturing.spinal.fct_spinal_parameter_records
-            WHERE SHOP_NAME = 'DU03'
-            AND line_name = 'STTR01'
-            AND STATION_NAME = '100'
-            AND overall_process_status = 'NOK'
-            AND recorded_at > '{recorded_at_summary}
-            -- AND (
-            --     ((PARAMETER_NAME = 'AmbientTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 50)) AND (work_location_id = 01 or work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Area Waveform UV Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Area Waveform VW Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Area Waveform WU Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Humidity Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'InbalanceOfAllPhasesU Value' AND (parameter_value_num < 0 OR parameter_value_num > 1.5)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Insulation Resistance UVW to GND Value' AND (parameter_value_num < 200 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Insulation Voltage UVW to GND Value' AND (parameter_value_num < 450 OR parameter_value_num > 550)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'PartTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Pdiv HvAc Value' AND (parameter_value_num < 800 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Pdiv UV Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Pdiv VW Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'Pdiv WU Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            --     ((PARAMETER_NAME = 'PhaseResistance between UV Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'PhaseResistance between VW Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'PhaseResistance between WU Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Withstand Current UVW to GND Value' AND (parameter_value_num < 0 OR parameter_value_num > 15)) AND (work_location_id = 01)) OR
-            --     ((PARAMETER_NAME = 'Withstand Voltage UVW to GND Value' AND (parameter_value_num < 1850 OR parameter_value_num > 1950)) AND (work_location_id = 02)) 
-            -- )
-            GROUP BY STATION_NAME, PARAMETER_NAME
-            ORDER BY COUNT DESC
-        """
+########################################################################################
+# Function to Strip SERIALS Columns From Results Into Sketches
+########################################################################################
+def extract_serial_sketches(results):
+    # Returns {name: {key_json: sketch}}; key_json holds the row's non-count columns
+    sketches = {}
+    for name, df in results.items():
+        if "SERIALS" not in df.columns:
+            continue
+        keys = [column for column in df.columns if column not in ("COUNT", "SERIALS")]
+        name_sketches = {}
+        for row in df.to_dict("records"):
+            key = {column: row[column].item() if hasattr(row[column], "item") else row[column] for column in keys}
+            serials = row["SERIALS"]
+            if isinstance(serials, str):
+                # Connectors without native complex types return arrays as JSON text
+                serials = json.loads(serials)
+            serials = [] if serials is None else serials
+            name_sketches[json.dumps(key)] = DistinctSerialSketch.from_serials(serials)
+        sketches[name] = name_sketches
+        results[name] = df.drop(columns=["SERIALS"])
+    return sketches
 
-        ########################################################################################
-        # Query 180 - Summary
-        ########################################################################################
-        query_180_summary = f"""
-        SELECT COUNT(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-        FROM manufacturing.spinal.fct_spinal_parameter_records
-        WHERE SHOP_NAME = 'DU03'
-        AND line_name = 'STTR01'
-        AND STATION_NAME = '180'
-        AND overall_process_status = 'NOK'
-        AND recorded_at > '{recorded_at}'
-        AND (
-            ((PARAMETER_NAME = 'AmbientTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 50)) AND (work_location_id = 01 or work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Area Waveform UV Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Area Waveform VW Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Area Waveform WU Value' AND (parameter_value_num < -3 OR parameter_value_num > 3)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Humidity Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'InbalanceOfAllPhasesU Value' AND (parameter_value_num < 0 OR parameter_value_num > 1.5)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Insulation Resistance UVW to GND Value' AND (parameter_value_num < 200 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Insulation Voltage UVW to GND Value' AND (parameter_value_num < 450 OR parameter_value_num > 550)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'PartTemperature Value' AND (parameter_value_num < 0 OR parameter_value_num > 100)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Pdiv HvAc Value' AND (parameter_value_num < 800 OR parameter_value_num > 10000)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Pdiv UV Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Pdiv VW Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'Pdiv WU Value' AND (parameter_value_num < 1400 OR parameter_value_num > 10000)) AND (work_location_id = 02)) OR
-            ((PARAMETER_NAME = 'PhaseResistance between UV Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'PhaseResistance between VW Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'PhaseResistance between WU Value' AND (parameter_value_num < 10.637 OR parameter_value_num > 11.523)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Withstand Current UVW to GND Value' AND (parameter_value_num < 0 OR parameter_value_num > 15)) AND (work_location_id = 01)) OR
-            ((PARAMETER_NAME = 'Withstand Voltage UVW to GND Value' AND (parameter_value_num < 1850 OR parameter_value_num > 1950)) AND (work_location_id = 02)) 
-        )
-        GROUP BY STATION_NAME, PARAMETER_NAME
-        ORDER BY COUNT DESC
-        """
 
-        ########################################################################################
-        # Query 40 - Fails by Hairpin Origin - Summary
-        ########################################################################################
-        query_40_hairpin_origin_summary = f"""
-        with
-
-            nest_parameter_records as 
-                (
-                select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at, parameter_id, overall_process_status
-                -- from manufacturing.mes.fct_parameter_records
-                from manufacturing.spinal.fct_spinal_parameter_records
-                where 
-                    shop_name = 'DU03'
-                    and line_name = 'STTR01'
-                    and station_name like '%30%'
-                    and parameter_name = 'Nest'
-                ),
-
-            genealogy_hist as 
-                (
-                select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-                from manufacturing.mes.fct_genealogy_hist
-                where
-                    shop_name = 'DU03'
-                    and line_name = 'STTR01'
-                ),
-
-            stack_serial as 
-                (
-                select scanned_child_serial, product_serial
-                from manufacturing.mes.fct_genealogy_hist
-                where line_name = 'STTR01'
-                -- and scanned_child_part in ('PT00237854-C') 
-                ),
-
-            wire_spool as 
-                (
-                select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-                -- from manufacturing.mes.fct_parameter_records
-                from manufacturing.spinal.fct_spinal_parameter_records
-                where
-                    shop_name = 'DU03'
-                    and line_name = 'STTR01'
-                    and station_name like '%30%'
-                    and parameter_name ilike '%batch%'
-                    -- and parameter_value_raw ilike '%PT00649019-C%' 
-                ),
-
-            op_forty as
-                (
-                select product_serial, station_name, recorded_at, result_status, parameter_id, overall_process_status, parameter_name
-                -- from manufacturing.mes.fct_parameter_records
-                from manufacturing.spinal.fct_spinal_parameter_records
-                where
-                    line_name = 'STTR01'
-                    and station_name ilike '%40%'
-                    and overall_process_status = 'NOK'
-                    and parameter_name = 'Force process value'
+########################################################################################
+# Functions to Merge Window Sketches and Turn Them Back Into Result DataFrames
+########################################################################################
+def merge_window_sketches(window_sketches):
+    merged = {}
+    for sketches in window_sketches:
+        for name, name_sketches in sketches.items():
+            target = merged.setdefault(name, {})
+            for key, sketch in name_sketches.items():
+                target[key] = target[key].merge(sketch) if key in target else sketch
+    return merged
 
-                )
 
-            select distinct
-                -- SS.scanned_child_serial as Stack_Serial,
-                -- WS.parameter_value_raw as Copper_Wire_Spool,
-                -- -- NPR.product_serial as Nest_Product_Serial,
-                count(distinct GH.product_serial) AS COUNT,
-                opf.station_name as STATION_NAME,
-                NPR.station_name as Sttr_030_Hairpin_Origin
-                -- GH.product_serial as Stator_Assembly_Serial_Number
-                -- opf.result_status as Sttr_040_Result_Status,
-                -- opf.recorded_at as Sttr_040_Recorded_At_Central_Time,
-                -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit
-
-            from nest_parameter_records as NPR
-
-            join genealogy_hist as GH
-                on NPR.product_serial = GH.scanned_child_serial
-            join op_forty as opf
-                on GH.product_serial = opf.product_serial
-            join stack_serial as SS
-                ON GH.product_serial = SS.product_serial
-            left join wire_spool as WS
-                on NPR.product_serial = WS.product_serial
-
-            WHERE
-                opf.station_name ILIKE '%40%'
-                and opf.overall_process_status = 'NOK'
-                and opf.recorded_at > '{recorded_at_summary}'
-                and opf.parameter_id = 2
-                AND opf.PARAMETER_NAME = 'Force process value'
-                group by all
-        """
+def sketch_results(merged):
+    results = {}
+    for name, name_sketches in merged.items():
+        rows = [dict(COUNT=sketch.count(), **json.loads(key)) for key, sketch in name_sketches.items()]
+        if rows:
+            results[name] = pd.DataFrame(rows).sort_values(["COUNT"], ascending=False, ignore_index=True)
+    return results
 
-        ########################################################################################
-        # Query 50 - Fails by Hairpin Origin - Summary
-        #######################################################################################
-        query_50_hairpin_origin_summary = f"""
-        with
-
-        nest_parameter_records as 
-            (
-            select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at
-            -- from manufacturing.mes.fct_parameter_records
-            from manufacturing.spinal.fct_spinal_parameter_records
-            where 
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-                and station_name like '030%'
-                and parameter_name = 'Nest'
-            ),
-
-        genealogy_hist as 
-            (
-            select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-            from manufacturing.mes.fct_genealogy_hist
-            where
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-            ),
-
-        stack_serial as 
-            (
-            select scanned_child_serial, product_serial
-            from manufacturing.mes.fct_genealogy_hist
-            where line_name = 'STTR01'
-            -- and scanned_child_part in ('PT00237854-C') 
-            ),
-
-        wire_spool as 
-            (
-            select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-            -- from manufacturing.mes.fct_parameter_records
-            from manufacturing.spinal.fct_spinal_parameter_records
-            where
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-                and station_name like '030%'
-                and parameter_name ilike '%batch%'
-                -- and parameter_value_raw ilike '%PT00237846-C%' 
-            ),
-
-        op_fifty as
-            (
-            select product_serial, station_name, recorded_at, result_status
-            -- from manufacturing.mes.fct_parameter_records
-            from manufacturing.spinal.fct_spinal_parameter_records
-            where
-                line_name = 'STTR01'
-                and station_name ilike '%050%'
 
+########################################################################################
+# Local Hour-Bucket Result Cache
+########################################################################################
+# Results of every hourly run are kept per window start so the shift summary can be
+# assembled locally instead of re-querying the 8-hour window.
+class HourBucketCache:
+    def __init__(
+        self,
+        path=None,
+        retention_hours=HOUR_BUCKET_RETENTION_HOURS,
+        sketch_retention_hours=SKETCH_RETENTION_HOURS,
+    ):
+        self.path = path or os.path.join(STATOR_BOT_STATE_DIR, "hour_buckets.sqlite")
+        self.retention_hours = retention_hours
+        self.sketch_retention_hours = sketch_retention_hours
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS hour_buckets (
+                    window_start TEXT NOT NULL,
+                    result_name TEXT NOT NULL,
+                    result_json TEXT NOT NULL,
+                    fetched_at TEXT NOT NULL,
+                    PRIMARY KEY (window_start, result_name)
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS hour_bucket_sketches (
+                    window_start TEXT NOT NULL,
+                    result_name TEXT NOT NULL,
+                    key_json TEXT NOT NULL,
+                    sketch BLOB NOT NULL,
+                    PRIMARY KEY (window_start, result_name, key_json)
+                )
+                """
+            )
+            # Marks hours whose sketches were stored, including ones with no failing serials
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS hour_bucket_sketch_windows (window_start TEXT PRIMARY KEY)"
             )
 
-        select distinct
-            -- SS.scanned_child_serial as Stack_Serial,
-            -- WS.parameter_value_raw as Copper_Wire_Spool,
-            -- NPR.product_serial as Nest_Product_Serial,
-            count(distinct GH.product_serial) as COUNT,
-            opf.station_name as STATION_NAME,
-            NPR.station_name as Sttr_030_Hairpin_Origin
-            -- GH.product_serial as Stator_Assembly_Serial_Number,
-            -- opf.result_status as Sttr_050_Result_Status,
-            -- opf.recorded_at as Sttr_050_Recorded_At_Central_Time,
-            -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit
-
-        from nest_parameter_records as NPR
-
-        join genealogy_hist as GH
-            on NPR.product_serial = GH.scanned_child_serial
-        join op_fifty as opf
-            on GH.product_serial = opf.product_serial
-        join stack_serial as SS
-            ON GH.product_serial = SS.product_serial
-        left join wire_spool as WS
-            on NPR.product_serial = WS.product_serial
-
-        WHERE
-            opf.station_name ILIKE '%050%'
-            and opf.result_status = 'FAIL'
-            and opf.recorded_at > '{recorded_at_summary}'
-            group by opf.station_name, NPR.station_name
-        """
+    def store(self, window_start, results):
+        fetched_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [
+            (window_start, name, df.to_json(orient="split", index=False, default_handler=str), fetched_at)
+            for name, df in results.items()
+        ]
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.executemany("INSERT OR REPLACE INTO hour_buckets VALUES (?, ?, ?, ?)", rows)
+
+    def load_hours(self, hours, names):
+        if not hours:
+            return [], []
+        placeholders = ", ".join("?" for _ in hours)
+        with closing(sqlite3.connect(self.path)) as db:
+            rows = db.execute(
+                f"SELECT window_start, result_name, result_json FROM hour_buckets "
+                f"WHERE window_start IN ({placeholders})",
+                hours,
+            ).fetchall()
+
+        by_hour = {}
+        for window_start, name, result_json in rows:
+            by_hour.setdefault(window_start, {})[name] = pd.read_json(
+                StringIO(result_json), orient="split", dtype=False
+            )
 
-        ########################################################################################
-        # Query 90 - Fails by Hairpin Origin - Summary
-        ########################################################################################
-        query_90_hairpin_origin_summary = f"""
-        with
-
-        nest_parameter_records as 
-            (
-            select product_serial, station_name, parameter_name, parameter_value_raw, overall_process_status, recorded_at
-            -- from manufacturing.mes.fct_parameter_records
-            from manufacturing.spinal.fct_spinal_parameter_records
-            where 
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-                and station_name like '030%'
-                and parameter_name = 'Nest'
-            ),
-
-        genealogy_hist as 
-            (
-            select product_serial, scanned_child_serial, consumed_at, product_part_desc, child_part_desc, scanned_child_data
-            from manufacturing.mes.fct_genealogy_hist
-            where
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-            ),
-
-        stack_serial as 
-            (
-            select scanned_child_serial, product_serial
-            from manufacturing.mes.fct_genealogy_hist
-            where line_name = 'STTR01'
-            -- and scanned_child_part in ('PT00237854-C') 
-            ),
-
-        wire_spool as 
-            (
-            select product_serial, product_part, parameter_name, parameter_value_raw, recorded_at
-            -- from manufacturing.mes.fct_parameter_records
-            from manufacturing.spinal.fct_spinal_parameter_records
-            where
-                shop_name = 'DU03'
-                and line_name = 'STTR01'
-                and station_name like '030%'
-                and parameter_name ilike '%batch%'
-                -- and parameter_value_raw ilike '%PT00237846-C%' 
-            ),
-
-        op_sixty_five as
-            (
-            SELECT DISTINCT product_serial, STATION_NAME, PARAMETER_NAME, recorded_at
-            -- SELECT count(DISTINCT product_serial) as COUNT, STATION_NAME, PARAMETER_NAME
-                FROM manufacturing.spinal.fct_spinal_parameter_records
-                WHERE line_name = 'STTR01'
-                AND STATION_NAME = '090'
-                -- AND overall_process_status = 'NOK'
-                -- AND recorded_at > '{recorded_at_summary}'
-                AND (
-                    (PARAMETER_NAME = 'Value Height Pin X' AND (parameter_value_raw < 39 OR parameter_value_raw > 47)) OR
-                    (PARAMETER_NAME = 'Value Pixle Area Pin X' AND (parameter_value_raw < 5000 OR parameter_value_raw > 12000)) OR
-                    (PARAMETER_NAME = 'Value Blob X Feret Diameters Pin X' AND (parameter_value_raw < 2.6 OR parameter_value_raw > 3.9)) OR
-                    (PARAMETER_NAME = 'Value Blob Y Feret Diameters Pin X' AND (parameter_value_raw < 1.2 OR parameter_value_raw > 3.0)) OR
-                    (PARAMETER_NAME = 'Value Angle 1 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > 45)) OR
-                    (PARAMETER_NAME = 'Value Angle 2 Pin X' AND (parameter_value_raw < -45 OR parameter_value_raw > -45)) OR
-                    (PARAMETER_NAME = 'Value Level Difference' AND (parameter_value_raw < 0 OR parameter_value_raw > 0.6)) OR
-                    (PARAMETER_NAME = 'Value Pin 1 edge to stack edge' AND (parameter_value_raw < 0 OR parameter_value_raw > 100000)) OR
-                    (PARAMETER_NAME = 'Value Pin 5 edge to stack edge' AND (parameter_value_raw < 0 OR parameter_value_raw > 100000))
+        # An hour only counts as cached when every result for it is present
+        cached, missing = [], []
+        for hour in hours:
+            results = by_hour.get(hour, {})
+            if all(name in results for name in names):
+                cached.append(results)
+            else:
+                missing.append(hour)
+        return cached, missing
+
+    def store_sketches(self, window_start, sketches):
+        rows = [
+            (window_start, name, key, sqlite3.Binary(sketch.to_blob()))
+            for name, name_sketches in sketches.items()
+            for key, sketch in name_sketches.items()
+        ]
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("DELETE FROM hour_bucket_sketches WHERE window_start = ?", (window_start,))
+            db.executemany("INSERT INTO hour_bucket_sketches VALUES (?, ?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO hour_bucket_sketch_windows VALUES (?)", (window_start,))
+
+    def load_sketches(self, hours):
+        # Returns ({hour: sketches} for the hours that have them, [hours without sketches])
+        if not hours:
+            return {}, []
+        placeholders = ", ".join("?" for _ in hours)
+        with closing(sqlite3.connect(self.path)) as db:
+            sketched = {
+                row[0]
+                for row in db.execute(
+                    f"SELECT window_start FROM hour_bucket_sketch_windows WHERE window_start IN ({placeholders})",
+                    hours,
                 )
-                -- GROUP BY STATION_NAME, PARAMETER_NAME
-                -- ORDER BY COUNT DESC
+            }
+            rows = db.execute(
+                f"SELECT window_start, result_name, key_json, sketch FROM hour_bucket_sketches "
+                f"WHERE window_start IN ({placeholders})",
+                hours,
+            ).fetchall()
+
+        by_hour = {hour: {} for hour in sketched}
+        for window_start, name, key, blob in rows:
+            by_hour[window_start].setdefault(name, {})[key] = DistinctSerialSketch.from_blob(blob)
+        return by_hour, [hour for hour in hours if hour not in sketched]
+
+    def rollup(self, recorded_at, recorded_until):
+        # Distinct-serial counts for any window made of cached hours, without the warehouse
+        hours = hour_buckets(recorded_at, recorded_until)
+        by_hour, missing = self.load_sketches(hours)
+        return sketch_results(merge_window_sketches(by_hour.values())), missing
+
+    def evict(self):
+        now = datetime.now()
+        cutoff = (now - timedelta(hours=self.retention_hours)).strftime("%Y-%m-%d %H:00")
+        sketch_cutoff = (now - timedelta(hours=self.sketch_retention_hours)).strftime("%Y-%m-%d %H:00")
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("DELETE FROM hour_buckets WHERE window_start < ?", (cutoff,))
+            db.execute("DELETE FROM hour_bucket_sketches WHERE window_start < ?", (sketch_cutoff,))
+            db.execute("DELETE FROM hour_bucket_sketch_windows WHERE window_start < ?", (sketch_cutoff,))
 
-            ),
 
-        STTR_065_WEs AS 
-            (
-            SELECT *
-            FROM main.adhoc.sttr_065_hmi_hairpin_naming_work_elements
-            )
+########################################################################################
+# Local Trend Store: Hourly Per-Parameter and Per-Station Fail Counts in Parquet
+########################################################################################
+# One file per hour and target under <path>/date=YYYY-MM-DD/ (hive partitions), with
+# LEVEL "parameter" (the combined table) or "station" (the Pareto, PARAMETER_NAME "").
+# Hours with no fails still get an empty file, so the baseline knows they were zero.
+TREND_COLUMNS = ["HOUR", "SHOP_NAME", "LINE_NAME", "LEVEL", "STATION_NAME", "PARAMETER_NAME", "COUNT"]
+TREND_KEYS = ["LEVEL", "STATION_NAME", "PARAMETER_NAME"]
+
+
+class TrendStore:
+    def __init__(self, path=TREND_STORE_PATH, retention_days=TREND_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+
+    def _hour_path(self, hour, target):
+        date, hh = hour[:10], hour[11:13]
+        return os.path.join(self.path, f"date={date}", f"{hh}00_{target['shop']}_{target['line']}.parquet")
+
+    def append(self, hour, target, df_combined, df_sum):
+        parameter_rows = df_combined[["STATION_NAME", "PARAMETER_NAME", "COUNT"]].assign(LEVEL="parameter")
+        station_rows = df_sum[["STATION_NAME", "COUNT"]].assign(LEVEL="station", PARAMETER_NAME="")
+        df = pd.concat([parameter_rows, station_rows], ignore_index=True).assign(
+            HOUR=hour, SHOP_NAME=target["shop"], LINE_NAME=target["line"]
+        )
+        df = df[TREND_COLUMNS].astype({column: str for column in TREND_COLUMNS if column != "COUNT"})
+        df["COUNT"] = pd.to_numeric(df["COUNT"]).astype("int64")
+
+        # Rewritten whole, so replaying an hour replaces it instead of adding to it
+        path = self._hour_path(hour, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    def load(self, target, since, until):
+        # (rows, hours) stored for target in [since, until); hours include empty ones
+        import pyarrow.dataset as ds
+
+        hours = [hour for hour in hour_buckets(since, until) if os.path.exists(self._hour_path(hour, target))]
+        if not hours:
+            return pd.DataFrame(columns=TREND_COLUMNS), []
+        table = ds.dataset([self._hour_path(hour, target) for hour in hours], format="parquet").to_table()
+        return table.to_pandas(), hours
+
+    def anomalies(self, hour, target):
+        # Robust z-score of this hour's counts against the per-key median/MAD of the
+        # previous TREND_BASELINE_HOURS, all keys at once on an hours x keys matrix
+        hour_start = datetime.strptime(hour, "%Y-%m-%d %H:00")
+        since = (hour_start - timedelta(hours=TREND_BASELINE_HOURS)).strftime("%Y-%m-%d %H:00")
+        history, history_hours = self.load(target, since, hour)
+        current, _ = self.load(target, hour, (hour_start + timedelta(hours=1)).strftime("%Y-%m-%d %H:00"))
+        if len(history_hours) < TREND_MIN_HISTORY_HOURS or current.empty:
+            return pd.DataFrame(columns=TREND_KEYS + ["COUNT", "BASELINE", "Z"])
+
+        current = current.groupby(TREND_KEYS, as_index=False)["COUNT"].sum()
+        keys = pd.MultiIndex.from_frame(current[TREND_KEYS])
+        matrix = (
+            history.pivot_table(index="HOUR", columns=TREND_KEYS, values="COUNT", aggfunc="sum")
+            .reindex(index=history_hours, columns=keys)
+            .fillna(0)
+            .to_numpy(dtype=float)
+        )
+        median = np.median(matrix, axis=0)
+        mad = np.median(np.abs(matrix - median), axis=0)
+        # 1.4826 * MAD estimates the standard deviation; floored so an always-zero key
+        # doesn't flag its first single fail
+        scale = np.maximum(1.4826 * mad, 1.0)
+        counts = current["COUNT"].to_numpy(dtype=float)
+        z = (counts - median) / scale
+
+        current["BASELINE"] = median
+        current["Z"] = z.round(1)
+        flagged = current[(z >= TREND_ANOMALY_Z) & (counts >= TREND_ANOMALY_MIN_COUNT)]
+        return flagged.sort_values(["Z"], ascending=False, ignore_index=True)
+
+    def evict(self):
+        if not os.path.isdir(self.path):
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime("date=%Y-%m-%d")
+        for partition in os.listdir(self.path):
+            if partition.startswith("date=") and partition < cutoff:
+                shutil.rmtree(os.path.join(self.path, partition), ignore_errors=True)
 
-        select distinct
-            -- SS.scanned_child_serial as Stack_Serial,
-            -- WS.parameter_value_raw as Copper_Wire_Spool,
-            -- NPR.product_serial as Nest_Product_Serial,
-            count(distinct GH.product_serial) as COUNT,
-            opsf.station_name as STATION_NAME,
-            NPR.station_name as Sttr_030_Hairpin_Origin
-            -- GH.product_serial as Stator_Assembly_Serial_Number
-            -- opsf.result_status as Sttr_065_Result_Status,
-            -- opsf.recorded_at as Sttr_065_Recorded_At_Central_Time,
-            -- substring (WS.parameter_value_raw, position('C' in ws.parameter_value_raw) + 1, 8) as Copper_Wire_8_Digit,
-            -- sfwe.Hairpins_In_Welded_Pin_Pair,
-                -- LEFT(sfwe.Hairpins_In_Welded_Pin_Pair, 5) 
-                -- || ' & ' || 
-                -- SUBSTRING(sfwe.Hairpins_In_Welded_Pin_Pair, POSITION('&' IN sfwe.Hairpins_In_Welded_Pin_Pair) + 2, 5) 
-                -- AS Hairpin_Short_Name
-
-        from nest_parameter_records as NPR
-
-        join genealogy_hist as GH
-            on NPR.product_serial = GH.scanned_child_serial
-        join op_sixty_five as opsf
-            on GH.product_serial = opsf.product_serial
-        join stack_serial as SS
-            ON GH.product_serial = SS.product_serial
-        left join wire_spool as WS
-            on NPR.product_serial = WS.product_serial
-        -- join STTR_065_WEs sfwe
-        --     on opsf.work_element = sfwe.DELMIA_WE_Name
-
-        WHERE
-            opsf.station_name ILIKE '%090%'
-            and opsf.recorded_at > '{recorded_at_summary}'
-            group by opsf.station_name, NPR.station_name
-        """
 
-        ########################################################################################
-        # Execute summary queries and fetch data into DataFrames
-        ########################################################################################
-        df_20_summary = pd.read_sql(query_20_summary, conn)
-        df_40_summary = pd.read_sql(query_40_summary, conn)
-        df_50_summary = pd.read_sql(query_50_summary, conn)
-        df_70_summary = pd.read_sql(query_70_summary, conn)
-        df_90_summary = pd.read_sql(query_90_summary, conn)
-        df_100_summary = pd.read_sql(query_100_summary, conn)
-        df_180_summary = pd.read_sql(query_180_summary, conn)
-
-        # df_210_unique_sn_summary = pd.read_sql(query_210_unique_sn_summary, conn)
-        df_40_hairpin_origin_summary = pd.read_sql(query_40_hairpin_origin_summary, conn)
-        df_50_hairpin_origin_summary = pd.read_sql(query_50_hairpin_origin_summary, conn)
-        df_90_hairpin_origin_summary = pd.read_sql(query_90_hairpin_origin_summary, conn)
-        
-        ########################################################################################
-        # Combine DataFrames
-        ########################################################################################
-        df_combined_summary = pd.concat(
-            [
-                df_20_summary,
-                df_40_summary,
-                df_50_summary,
-                df_70_summary,
-                df_90_summary,
-                # df_80_summary,
-                df_100_summary,
-                df_180_summary,
-                # df_210_summary,
-            ],
-            ignore_index=True,
-        )
+########################################################################################
+# Function defining all queries to run every hour
+########################################################################################
+# run_at (naive local time) replays a scheduled run; pool lets a caller keep connections warm.
+# With reuse_last_hour, an hour already closed into the cache (streaming mode) isn't re-queried.
+def job(pool=None, run_at=None, targets=None, reuse_last_hour=False):
+    owns_pool = pool is None
+    if owns_pool:
+        pool = DatabricksConnectionPool()
+    # Queries get JOB_DEADLINE_SECONDS from here; whatever misses it is posted as pending
+    deadline = time.monotonic() + JOB_DEADLINE_SECONDS if JOB_DEADLINE_SECONDS > 0 else None
 
-        df_combined_summary["PARAMETER_NAME"] = df_combined_summary[
-            "ALARM_DESCRIPTION"
-        ].fillna(df_combined_summary["PARAMETER_NAME"])
-        df_combined_summary.drop(
-            columns=["ALARM_DESCRIPTION"], inplace=True
-        )  # Remove old column
-        df_combined_summary = df_combined_summary[df_combined_summary["COUNT"] > 0]
+    local_tz = pytz.timezone("America/Chicago")  # Change this to your expected timezone
+    if run_at is None:
+        run_at = datetime.now()
+        utc_now = datetime.now(pytz.utc)  # Get current UTC time
+    else:
+        utc_now = local_tz.localize(run_at).astimezone(pytz.utc)
+    local_now = utc_now.astimezone(local_tz)  # Convert to local timezone
+    current_hour = local_now.hour
+    current_time = local_now.strftime("%Y-%m-%d %H:00")
+    end_of_shift = (15 <= current_hour < 16) or (5 <= current_hour < 6)
 
-        ########################################################################################
-        # Sort combined DataFrame by 'COUNT' column
-        ########################################################################################
-        if "COUNT" in df_combined_summary.columns:
-            df_combined_summary = df_combined_summary.sort_values(
-                ["COUNT"], ascending=False, ignore_index=True
-            )
+    one_hour_before = run_at - timedelta(hours=1)
+    recorded_at = one_hour_before.strftime("%Y-%m-%d %H:00")
+    eight_hours_before = run_at - timedelta(hours=8)
+    recorded_at_summary = eight_hours_before.strftime("%Y-%m-%d %H:00")
+    metrics = RunMetrics(run_at)
+    targets = targets or load_targets()
 
-        ########################################################################################
-        # Aggregate total failures per station (without duplicates)
-        ########################################################################################
-        df_sum_summary = (
-            df_combined_summary.groupby("STATION_NAME")["COUNT"].sum().reset_index()
+    ########################################################################################
+    # Shift summary: reuse cached hour buckets, re-query only the missing hours
+    ########################################################################################
+    hour_cache = HourBucketCache()
+    genealogy_index = GenealogyIndex(now=run_at) if GENEALOGY_INDEX_ENABLED else None
+    trend_store = TrendStore() if TREND_STORE_ENABLED else None
+    outbox = SlackOutbox()
+    result_names = target_result_names(targets)
+    fetch_hours = [recorded_at]
+    missing_hours = []
+    cached_results = []
+    last_hour_results = None
+    if reuse_last_hour:
+        cached_last_hour, _ = hour_cache.load_hours([recorded_at], result_names)
+        if cached_last_hour:
+            last_hour_results = cached_last_hour[0]
+            fetch_hours = []
+            print(f"Hour {recorded_at} read from the stream's hour buckets")
+    if end_of_shift:
+        summary_hours = hour_buckets(recorded_at_summary, recorded_at)
+        cached_results, missing_hours = hour_cache.load_hours(summary_hours, result_names)
+    # Contiguous missing hours share one hour-bucketed query set, split per hour locally.
+    # Under a deadline the last hour keeps its own set, so it can be scheduled ahead of
+    # the summary hours; without one, a cold shift summary is a single query set.
+    if deadline is None:
+        summary_windows = []
+        windows = coalesce_hours(fetch_hours + missing_hours)
+    else:
+        summary_windows = coalesce_hours(missing_hours)
+        windows = coalesce_hours(fetch_hours) + summary_windows
+    if end_of_shift:
+        print(
+            f"Shift summary: {len(cached_results)} cached hour(s), "
+            f"re-querying {len(missing_hours)} missing hour(s); {len(windows)} window(s) to fetch"
         )
+    metrics.end_stage("cache_lookup")
 
-        ########################################################################################
-        # Merge unique product serial failures for Station 210
-        ########################################################################################
-        if (
-            not df_210_unique_sn_summary.empty
-            and "STATION_NAME" in df_210_unique_sn_summary.columns
-            and "COUNT" in df_210_unique_sn_summary.columns
-        ):
-            df_210_unique_sn_summary = df_210_unique_sn_summary.rename(
-                columns={"COUNT": "FAIL_COUNT"}
-            )
-
-            # Merge Station 210's unique product serial failures into df_sum
-            df_sum_summary = df_sum_summary.merge(
-                df_210_unique_sn_summary, on="STATION_NAME", how="left"
+    ########################################################################################
+    # Execute hourly (and missing summary) queries concurrently and fetch data into DataFrames
+    ########################################################################################
+    ########################################################################################
+    # Progressive delivery: post each target's station counts as soon as the last hour's
+    # are in; post_target_report completes the same message once everything else is
+    ########################################################################################
+    label_lines = len(targets) > 1
+    messages = {}
+
+    def post_last_hour_counts(window, window_results):
+        if recorded_at not in window_results:
+            return
+        for target in targets:
+            messages[target_id(target)] = post_station_counts(
+                target,
+                target_results(window_results[recorded_at], target),
+                recorded_at,
+                one_hour_before,
+                end_of_shift,
+                f" ({target['shop']} {target['line']})" if label_lines else "",
             )
 
-            # Replace total failure count with unique serial count for Station 210
-            df_sum_summary["COUNT"] = df_sum_summary["FAIL_COUNT"].fillna(
-                df_sum["COUNT"]
+    hour_results, hour_sketches, hour_pending = {}, {}, {}
+    try:
+        if windows:
+            hour_results, hour_sketches, hour_pending = fetch_window_results(
+                windows,
+                targets,
+                pool,
+                genealogy_index,
+                metrics,
+                deadline,
+                summary_windows,
+                post_last_hour_counts if SLACK_DELIVERY_MODE == "progressive" else None,
             )
+    finally:
+        if owns_pool:
+            pool.close()
+    metrics.end_stage("fetch")
 
-            # Drop the temporary column
-            df_sum_summary.drop(columns=["FAIL_COUNT"], inplace=True)
+    if last_hour_results is None:
+        results = hour_results[recorded_at]
+    else:
+        results = last_hour_results
+        cached_results.append(last_hour_results)
+    pending = hour_pending.get(recorded_at, set())
+    summary_pending = set().union(*(hour_pending[hour] for hour in missing_hours))
+    for hour, hour_result in hour_results.items():
+        # Hours with pending results are re-queried by the next run instead of cached
+        if hour_pending[hour]:
+            continue
+        hour_cache.store(hour, hour_result)
+        hour_cache.store_sketches(hour, hour_sketches[hour])
+    hour_cache.evict()
+    if genealogy_index is not None:
+        genealogy_index.compact_if_due()
+    if trend_store is not None:
+        trend_store.evict()
+    if get_query_cache() is not None:
+        get_query_cache().evict()
+    metrics.end_stage("cache_store")
+
+    summary_results = None
+    if end_of_shift:
+        summary_results = sum_window_results(cached_results + list(hour_results.values()), result_names)
+
+        # Replace summed hourly counts with distinct-serial counts from merged sketches
+        cached_sketches, unsketched_hours = hour_cache.load_sketches(
+            [hour for hour in summary_hours if hour not in missing_hours]
+            + ([] if last_hour_results is None else [recorded_at])
+        )
+        if unsketched_hours:
+            print(f"Warning: no serial sketches for {unsketched_hours}. Using summed hourly counts.")
         else:
-            print(
-                "Warning: STATION_NAME or COUNT column missing from df_210_unique_sn. Falling back to regular sum."
+            summary_results.update(
+                sketch_results(
+                    merge_window_sketches(list(cached_sketches.values()) + list(hour_sketches.values()))
+                )
             )
 
-        ########################################################################################
-        # Convert NaNs to 0 and ensure integer counts
-        ########################################################################################
-        df_sum_summary["COUNT"] = df_sum_summary["COUNT"].fillna(0).astype(int)
-
-        ########################################################################################
-        # Sort results
-        ########################################################################################
-        df_sum_summary = df_sum_summary[df_sum_summary["COUNT"] > 0]
-        df_sum_summary = df_sum_summary.sort_values(
-            ["COUNT"], ascending=False, ignore_index=True
+    # One report per target, each posted to its own channel
+    for target in targets:
+        post_target_report(
+            target,
+            target_results(results, target),
+            None if summary_results is None else target_results(summary_results, target),
+            recorded_at,
+            one_hour_before,
+            recorded_at_summary,
+            current_time,
+            metrics,
+            f" ({target['shop']} {target['line']})" if label_lines else "",
+            trend_store,
+            target_pending(pending, target),
+            target_pending(pending | summary_pending, target),
+            messages.get(target_id(target)),
+            outbox,
         )
+    # Delivers this run's messages and anything left queued by earlier runs
+    outbox.flush()
+    outbox.evict()
+    metrics.end_stage("slack_post")
+    metrics.write()
 
-        ########################################################################################
-        # Convert DataFrames to a JSON-like format (table-like string)
-        ########################################################################################
-        def df_to_table(df):
-            table_str = df.to_string(index=False)
-            return table_str
-
-        df_combined_summary_str = df_to_table(df_combined_summary)
-        df_sum_summary_str = df_to_table(df_sum_summary)
-        df_hairpin_origin_summary = pd.concat(
-            [
-                df_40_hairpin_origin_summary,
-                df_50_hairpin_origin_summary,
-                df_90_hairpin_origin_summary,
-            ],
-            ignore_index=True,
-        )
-        
-        df_hairpin_origin_summary["COUNT"] = pd.to_numeric(df_hairpin_origin_summary["COUNT"])
-        df_hairpin_origin_summary["STATION_NAME"] = pd.to_numeric(df_hairpin_origin_summary["STATION_NAME"])
-        df_hairpin_origin_summary = df_hairpin_origin_summary.sort_values(by=["COUNT", "STATION_NAME"], ascending=[False, True], ignore_index=True)
-        
-        df_hairpin_origin_summary_str = df_to_table(df_hairpin_origin_summary)
 
-    ########################################################################################
-    # Execute hourly queries and fetch data into DataFrames
-    ########################################################################################
-    df_20 = pd.read_sql(query_20, conn)
-    df_40 = pd.read_sql(query_40, conn)
-    df_50 = pd.read_sql(query_50, conn)
-    df_70 = pd.read_sql(query_70, conn)
-    df_90 = pd.read_sql(query_90, conn)
-    df_100 = pd.read_sql(query_100, conn)
-    df_180 = pd.read_sql(query_180, conn)
-    # df_110 = pd.read_sql(query_110, conn)
-    # df_210 = pd.read_sql(query_210, conn)
-
-    df_210_unique_sn = pd.read_sql(query_210_unique_sn, conn)
-    df_40_hairpin_origin = pd.read_sql(query_40_hairpin_origin, conn)
-    df_50_hairpin_origin = pd.read_sql(query_50_hairpin_origin, conn)
-    df_90_hairpin_origin = pd.read_sql(query_90_hairpin_origin, conn)
+########################################################################################
+# Function to Combine Station Results Into the Parameter Table and Station Pareto
+########################################################################################
+def combine_station_results(results):
+    df_210_unique_sn = results["df_210_unique_sn"]
 
     ########################################################################################
     # Combine DataFrames
     ########################################################################################
     df_combined = pd.concat(
-        [df_20, df_40, df_50, df_70, df_90, df_100, df_180],
+        [results[name] for name in ["df_20", "df_40", "df_50", "df_70", "df_90", "df_100", "df_180"]],
         ignore_index=True,
     )
 
@@ -1281,6 +2528,165 @@ def job():
     ########################################################################################
     df_sum = df_sum[df_sum["COUNT"] > 0]
     df_sum = df_sum.sort_values(["COUNT"], ascending=False, ignore_index=True)
+    return df_combined, df_sum
+
+
+########################################################################################
+# Function to Describe the Results Left Out by Queries That Missed the Deadline
+########################################################################################
+def pending_note(pending):
+    stations = sorted({int(name.split("_")[1]) for name in pending if not name.endswith("_hairpin_origin")})
+    parts = [f"station {station:03d}" for station in stations]
+    if any(name.endswith("_hairpin_origin") for name in pending):
+        parts.append("hairpin origins")
+    return f"*⏳ Pending (missed the {JOB_DEADLINE_SECONDS:g}s query deadline, left out below):* " + ", ".join(parts)
+
+
+########################################################################################
+# Functions to Build the Hourly Station-Count Blocks and Post Them Ahead of the Rest
+########################################################################################
+def report_text(recorded_at, one_hour_before, line_label=""):
+    # Notification/fallback text for chat.postMessage and chat.update
+    return f"Fail count by Parameter{line_label}: {recorded_at} to {(one_hour_before + timedelta(hours=1)).strftime('%H:00')}"
+
+
+def station_count_blocks(df_combined, df_sum, recorded_at, one_hour_before, line_label=""):
+    return [
+        {"type": "divider"},
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*🚨Fail count by Parameter{line_label}:* {recorded_at} to {(one_hour_before + timedelta(hours=1)).strftime('%H:00')}"
+            },
+        },
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": "```" + df_combined.to_string(index=False) + "```",},
+        },
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": "*Fails by Station Pareto:*"},
+        },
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": "```" + df_sum.to_string(index=False) + "```",},
+        },
+    ]
+
+
+# Returns (channel ID, ts) of the posted message, for post_target_report to complete
+def post_station_counts(target, results, recorded_at, one_hour_before, end_of_shift, line_label=""):
+    df_combined, df_sum = combine_station_results(results)
+    to_follow = "Hairpin origins and the shift summary" if end_of_shift else "Hairpin origins"
+    blocks = station_count_blocks(df_combined, df_sum, recorded_at, one_hour_before, line_label) + [
+        {"type": "context", "elements": [{"type": "mrkdwn", "text": f"⏳ {to_follow} to follow"}]},
+    ]
+    return send_message_to_slack(target["slack_channel"], report_text(recorded_at, one_hour_before, line_label), blocks)
+
+
+########################################################################################
+# Function to Build the Per-Station Reports for a Target's Station Channels
+########################################################################################
+# Returns [(destination, webhook, blocks)] for the stations in target["station_channels"] that failed
+# this hour: the station's total, its rows of the parameter table and its hairpin origins
+def station_deliveries(target, df_combined, df_sum, df_hairpin_origin, recorded_at, one_hour_before, line_label=""):
+    deliveries = []
+    for station, channel in target.get("station_channels", {}).items():
+        df_station_sum = df_sum[df_sum["STATION_NAME"].astype(str) == station]
+        if df_station_sum.empty:
+            continue
+        blocks = [
+            {"type": "divider"},
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*🚨Station {station}: {df_station_sum['COUNT'].iloc[0]} fails{line_label}:* "
+                    f"{recorded_at} to {(one_hour_before + timedelta(hours=1)).strftime('%H:00')}",
+                },
+            },
+        ]
+        for title, df in [("Fail count by Parameter", df_combined), ("Fails by Hairpin Station", df_hairpin_origin)]:
+            df_station = df[df["STATION_NAME"].astype(str) == station].drop(columns=["STATION_NAME"])
+            if not df_station.empty:
+                blocks += [
+                    {"type": "section", "text": {"type": "mrkdwn", "text": f"*{title}:*"}},
+                    {"type": "section", "text": {"type": "mrkdwn", "text": "```" + df_station.to_string(index=False) + "```"}},
+                ]
+        blocks.append({"type": "divider"})
+        deliveries.append((f"station {station}", channel, blocks))
+    return deliveries
+
+
+########################################################################################
+# Function to Build and Post the Slack Report for One Shop/Line Target
+########################################################################################
+def post_target_report(
+    target,
+    results,
+    summary_results,
+    recorded_at,
+    one_hour_before,
+    recorded_at_summary,
+    current_time,
+    metrics,
+    line_label="",
+    trend_store=None,
+    pending=(),
+    summary_pending=(),
+    message=None,
+    outbox=None,
+):
+    end_of_shift = summary_results is not None
+    url = target["channel"]
+
+    df_40_hairpin_origin = results["df_40_hairpin_origin"]
+    df_50_hairpin_origin = results["df_50_hairpin_origin"]
+    df_90_hairpin_origin = results["df_90_hairpin_origin"]
+
+    if end_of_shift:
+        df_40_hairpin_origin_summary = summary_results["df_40_hairpin_origin"]
+        df_50_hairpin_origin_summary = summary_results["df_50_hairpin_origin"]
+        df_90_hairpin_origin_summary = summary_results["df_90_hairpin_origin"]
+
+        df_combined_summary, df_sum_summary = combine_station_results(summary_results)
+
+        ########################################################################################
+        # Convert DataFrames to a JSON-like format (table-like string)
+        ########################################################################################
+        def df_to_table(df):
+            table_str = df.to_string(index=False)
+            return table_str
+
+        df_combined_summary_str = df_to_table(df_combined_summary)
+        df_sum_summary_str = df_to_table(df_sum_summary)
+        df_hairpin_origin_summary = pd.concat(
+            [
+                df_40_hairpin_origin_summary,
+                df_50_hairpin_origin_summary,
+                df_90_hairpin_origin_summary,
+            ],
+            ignore_index=True,
+        )
+        
+        df_hairpin_origin_summary["COUNT"] = pd.to_numeric(df_hairpin_origin_summary["COUNT"])
+        df_hairpin_origin_summary["STATION_NAME"] = pd.to_numeric(df_hairpin_origin_summary["STATION_NAME"])
+        df_hairpin_origin_summary = df_hairpin_origin_summary.sort_values(by=["COUNT", "STATION_NAME"], ascending=[False, True], ignore_index=True)
+        
+        df_hairpin_origin_summary_str = df_to_table(df_hairpin_origin_summary)
+
+    df_combined, df_sum = combine_station_results(results)
+
+    ########################################################################################
+    # Append this hour to the trend store and flag counts abnormal against its baseline
+    ########################################################################################
+    # An hour with pending results would go into the history with its counts missing
+    df_anomalies = None
+    if trend_store is not None and not pending:
+        trend_store.append(recorded_at, target, df_combined, df_sum)
+        df_anomalies = trend_store.anomalies(recorded_at, target)
+    metrics.end_stage("processing")
 
     ########################################################################################
     # Convert DataFrames to a JSON-like format (table-like string)
@@ -1289,8 +2695,6 @@ def job():
         table_str = df.to_string(index=False)
         return table_str
 
-    df_combined_str = df_to_table(df_combined)
-    df_sum_str = df_to_table(df_sum)
     df_hairpin_origin = pd.concat(
         [df_40_hairpin_origin, df_50_hairpin_origin, df_90_hairpin_origin],
         ignore_index=True
@@ -1302,41 +2706,44 @@ def job():
     # Payload with both DataFrames formatted as tables
     ########################################################################################
     payload = {
-        "blocks": [
-            {"type": "divider"},
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn", 
-                    "text": f"*🚨Fail count by Parameter:* {recorded_at} to {(one_hour_before + timedelta(hours=1)).strftime('%H:00')}"
-                },
-            },
-            {
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": "```" + df_combined_str + "```",},
-            },
+        "blocks": station_count_blocks(df_combined, df_sum, recorded_at, one_hour_before, line_label)
+        + [
             {
                 "type": "section",
-                "text": {"type": "mrkdwn", "text": "*Fails by Station Pareto:*"},
+                "text": {"type": "mrkdwn", "text": "*Fails by Hairpin Station:*"},
             },
             {
                 "type": "section",
-                "text": {"type": "mrkdwn", "text": "```" + df_sum_str + "```",},
+                "text": {"type": "mrkdwn", "text": "```" + df_hairpin_origin_str + "```",},
             },
+            {"type": "divider"},
+        ]
+    }
+
+    if pending:
+        payload["blocks"].insert(
+            2, {"type": "section", "text": {"type": "mrkdwn", "text": pending_note(pending)}}
+        )
+
+    if df_anomalies is not None and not df_anomalies.empty:
+        df_anomalies = df_anomalies.drop(columns=["LEVEL"])
+        df_anomalies["PARAMETER_NAME"] = df_anomalies["PARAMETER_NAME"].replace("", "(station total)")
+        payload["blocks"][-1:-1] = [
             {
                 "type": "section",
-                "text": {"type": "mrkdwn", "text": "*Fails by Hairpin Station:*"},
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*📈 Unusual vs. the last {TREND_BASELINE_HOURS // 24} days (median/MAD):*",
+                },
             },
             {
                 "type": "section",
-                "text": {"type": "mrkdwn", "text": "```" + df_hairpin_origin_str + "```",},
+                "text": {"type": "mrkdwn", "text": "```" + df_to_table(df_anomalies) + "```",},
             },
-            {"type": "divider"},
         ]
-    }
 
 
-    if (15 <= current_hour < 16) or (5 <= current_hour < 6):
+    if end_of_shift:
         payload["blocks"].extend(
             [
                 {"type": "divider"},
@@ -1389,28 +2796,514 @@ def job():
                 {"type": "divider"},  # Add a divider to separate sections clearly
             ]
         )
+        if summary_pending:
+            payload["blocks"].insert(
+                -7, {"type": "section", "text": {"type": "mrkdwn", "text": pending_note(summary_pending)}}
+            )
+    metrics.end_stage("render")
+
+    ########################################################################################
+    # Queue the webhook messages (and the results behind them) in the outbox; the caller
+    # flushes it once every target's report is queued
+    ########################################################################################
+    outbox = outbox or SlackOutbox()
+    stored_results = {f"hourly/{name}": df for name, df in results.items()}
+    if end_of_shift:
+        stored_results.update({f"summary/{name}": df for name, df in summary_results.items()})
+    outbox.store_results(recorded_at, target, stored_results)
+    # Each station with its own channel also gets its part of this hour's report
+    deliveries = station_deliveries(target, df_combined, df_sum, df_hairpin_origin, recorded_at, one_hour_before, line_label)
 
     ########################################################################################
-    # Send the payload to Slack using a webhook
+    # Progressive delivery: complete the station-count message posted earlier (if any)
     ########################################################################################
-    headers = {"Content-type": "application/json"}
-    print(f"DEBUG: Sending message to Slack. Token: {slack_token}, Webhook URL: {url}")
-    print(f"DATABRICKS_ACCESS_TOKEN Loaded: {DATABRICKS_ACCESS_TOKEN is not None}")
-    print(f"SLACK_TOKEN Loaded: {slack_token is not None}")
-    print(f"SLACK_WEBHOOK_URL Loaded: {url is not None}")
-
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    if response.status_code != 200:
-        print(f"Slack API Error: {response.status_code} - {response.text}")
+    if SLACK_DELIVERY_MODE == "progressive":
+        channel, ts = message or (target["slack_channel"], None)
+        send_message_to_slack(channel, report_text(recorded_at, one_hour_before, line_label), payload["blocks"], ts)
+        metrics.record_message(target_id(target), "report", len(payload["blocks"]))
     else:
-        print("Message successfully sent to Slack")
-        
-    print("Slack Payload:", json.dumps(payload, indent=2))
+        print(f"DATABRICKS_ACCESS_TOKEN Loaded: {DATABRICKS_ACCESS_TOKEN is not None}")
+        print(f"SLACK_TOKEN Loaded: {slack_token is not None}")
+        print(f"SLACK_WEBHOOK_URL Loaded: {url is not None}")
+        deliveries.insert(0, ("report", url, payload["blocks"]))
+    for destination, channel, blocks in deliveries:
+        outbox.enqueue(recorded_at, target, destination, channel, blocks)
+        metrics.record_message(target_id(target), destination, len(blocks))
+    metrics.end_stage("slack_post")
+
+
+########################################################################################
+# Backfill: Rebuild the Local Stores for a Past Date Range
+########################################################################################
+# The range is split into BACKFILL_CHUNK_HOURS windows, each fetched with one
+# hour-bucketed query set by a pool of BACKFILL_WORKERS threads (the connection pool
+# still caps queries in flight). Results go to the hour-bucket cache, its sketches and
+# the trend store, never to Slack. Finished windows are checkpointed, so an interrupted
+# backfill resumes where it stopped; changing the targets or spec limits starts over.
+BACKFILL_CHUNK_HOURS = int(os.getenv("BACKFILL_CHUNK_HOURS", "8"))
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+
+
+class BackfillCheckpoint:
+    def __init__(self, run_key, path=None):
+        self.run_key = run_key
+        self.path = path or os.path.join(STATOR_BOT_STATE_DIR, "backfill_checkpoint.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS backfill_windows (
+                    run_key TEXT NOT NULL,
+                    window_start TEXT NOT NULL,
+                    window_end TEXT NOT NULL,
+                    done_at TEXT NOT NULL,
+                    PRIMARY KEY (run_key, window_start, window_end)
+                )
+                """
+            )
+
+    def done(self):
+        with closing(sqlite3.connect(self.path)) as db:
+            rows = db.execute(
+                "SELECT window_start, window_end FROM backfill_windows WHERE run_key = ?", (self.run_key,)
+            ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def mark_done(self, window):
+        done_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("INSERT OR REPLACE INTO backfill_windows VALUES (?, ?, ?, ?)", (self.run_key, *window, done_at))
+
+
+def backfill_windows(start, end, chunk_hours=BACKFILL_CHUNK_HOURS):
+    hours = hour_buckets(start.strftime("%Y-%m-%d %H:00"), end.strftime("%Y-%m-%d %H:%M"))
+    windows = []
+    for i in range(0, len(hours), chunk_hours):
+        chunk_end = datetime.strptime(hours[min(i + chunk_hours, len(hours)) - 1], "%Y-%m-%d %H:00") + timedelta(hours=1)
+        windows.append((hours[i], chunk_end.strftime("%Y-%m-%d %H:00")))
+    return windows
+
+
+########################################################################################
+# Function to Backfill [start, end) Into the Local Stores
+########################################################################################
+def backfill(start, end, targets=None, chunk_hours=BACKFILL_CHUNK_HOURS, workers=BACKFILL_WORKERS):
+    targets = targets or load_targets()
+    windows = backfill_windows(start, end, chunk_hours)
+    run_key = hashlib.sha1(
+        json.dumps({"targets": [target_id(t) for t in targets], "spec_limits": get_spec_limits()}, sort_keys=True).encode()
+    ).hexdigest()
+    checkpoint = BackfillCheckpoint(run_key)
+    done = checkpoint.done()
+    pending = [window for window in windows if window not in done]
+    print(
+        f"Backfill {start.strftime('%Y-%m-%d %H:%M')} to {end.strftime('%Y-%m-%d %H:%M')}: "
+        f"{len(windows)} window(s) of up to {chunk_hours}h, {len(windows) - len(pending)} already done"
+    )
+
+    hour_cache = HourBucketCache()
+    trend_store = TrendStore() if TREND_STORE_ENABLED else None
+    metrics = RunMetrics(datetime.now())
+    pool = DatabricksConnectionPool()
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(fetch_window_results, [window], targets, pool, None, metrics): window
+                for window in pending
+            }
+            # Stores are written from this thread only, as windows finish
+            for i, future in enumerate(as_completed(futures), 1):
+                window = futures[future]
+                try:
+                    hour_results, hour_sketches, _ = future.result()
+                except Exception as e:
+                    print(f"Backfill of {window[0]} to {window[1]} failed: {e}")
+                    failed.append(window)
+                    continue
+                for hour, results in hour_results.items():
+                    hour_cache.store(hour, results)
+                    hour_cache.store_sketches(hour, hour_sketches[hour])
+                    if trend_store is not None:
+                        for target in targets:
+                            trend_store.append(hour, target, *combine_station_results(target_results(results, target)))
+                checkpoint.mark_done(window)
+                print(f"Backfilled {window[0]} to {window[1]} ({i}/{len(pending)})")
+    finally:
+        pool.close()
+    metrics.end_stage("backfill")
+    metrics.write()
+    if failed:
+        print(f"{len(failed)} window(s) failed; run the same backfill again to retry them")
+        return 1
+    return 0
+
+
+########################################################################################
+# Daemon Mode: Resident Process Running the Hourly Job on the Wall Clock
+########################################################################################
+DAEMON_RUN_MINUTE = int(os.getenv("DAEMON_RUN_MINUTE", "10"))
+# Missed runs older than this are skipped rather than replayed
+DAEMON_CATCHUP_HOURS = int(os.getenv("DAEMON_CATCHUP_HOURS", "8"))
+
+
+class StatorBotDaemon:
+    def __init__(self, state_path=None):
+        self.state_path = state_path or os.path.join(STATOR_BOT_STATE_DIR, "daemon_state.json")
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        self.pool = DatabricksConnectionPool()
+        self.stopping = threading.Event()
+
+    def latest_slot(self, now):
+        slot = now.replace(minute=DAEMON_RUN_MINUTE, second=0, microsecond=0)
+        return slot if slot <= now else slot - timedelta(hours=1)
+
+    def last_run(self):
+        try:
+            with open(self.state_path) as f:
+                return datetime.strptime(json.load(f)["last_run"], "%Y-%m-%d %H:%M")
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def record_run(self, run_at):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"last_run": run_at.strftime("%Y-%m-%d %H:%M")}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def due_runs(self, now):
+        latest = self.latest_slot(now)
+        last_run = self.last_run()
+        if last_run is None:
+            # First start: nothing to catch up on, begin with the next slot
+            self.record_run(latest)
+            return []
+        earliest = max(last_run + timedelta(hours=1), latest - timedelta(hours=DAEMON_CATCHUP_HOURS - 1))
+        runs = []
+        while earliest <= latest:
+            runs.append(earliest)
+            earliest += timedelta(hours=1)
+        return runs
+
+    def run_due(self):
+        for run_at in self.due_runs(datetime.now()):
+            if self.stopping.is_set():
+                break
+            print(f"Running job for {run_at.strftime('%Y-%m-%d %H:%M')}")
+            try:
+                self.run_job(run_at)
+            except Exception as e:
+                print(f"Job for {run_at.strftime('%Y-%m-%d %H:%M')} failed: {e}")
+            self.record_run(run_at)
+
+    def run_job(self, run_at):
+        job(self.pool, run_at)
+
+    def schedule_runs(self, schedule):
+        schedule.every().hour.at(f":{DAEMON_RUN_MINUTE:02d}").do(self.run_due)
+
+    def stop(self, signum=None, frame=None):
+        print("Stopping stator bot daemon after the current run")
+        self.stopping.set()
+
+    def run(self):
+        import schedule
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.schedule_runs(schedule)
+        try:
+            # Catch up on runs missed while the daemon was down
+            self.run_due()
+            while not self.stopping.is_set():
+                schedule.run_pending()
+                idle_seconds = schedule.idle_seconds()
+                self.stopping.wait(30 if idle_seconds is None else min(max(idle_seconds, 1), 30))
+        finally:
+            schedule.clear()
+            self.pool.close()
+            print("Stator bot daemon stopped")
+
+
+########################################################################################
+# Streaming Mode: Poll New Rows Every Few Minutes and Alert on Station Fail Rates
+########################################################################################
+# Each poll fetches [watermark, now - STREAM_LAG_MINUTES) with the hourly queries, adds
+# the per-hour results to the open hours and to rolling per-station counters, and moves the
+# persisted watermark on. Closed hours go into the hour-bucket cache, so the hourly
+# report reads them back instead of querying the warehouse again.
+STREAM_POLL_MINUTES = int(os.getenv("STREAM_POLL_MINUTES", "5"))
+# Rows recorded less than this long ago are left for the next poll (late arrivals)
+STREAM_LAG_MINUTES = int(os.getenv("STREAM_LAG_MINUTES", "5"))
+STREAM_ALERT_WINDOW_MINUTES = int(os.getenv("STREAM_ALERT_WINDOW_MINUTES", "30"))
+# Fails per hour over the alert window that trigger an alert, per station ("*" = any other)
+STREAM_ALERT_RATES = json.loads(os.getenv("STREAM_ALERT_RATES", '{"*": 20}'))
+
+# Results summed into the per-station counters (the same ones as the station Pareto)
+STATION_FAIL_RESULTS = ["df_20", "df_40", "df_50", "df_70", "df_90", "df_100", "df_180", "df_210_unique_sn"]
+
 
+def station_fail_counts(results):
+    frames = [results[name][["STATION_NAME", "COUNT"]] for name in STATION_FAIL_RESULTS if not results[name].empty]
+    if not frames:
+        return {}
+    df = pd.concat(frames, ignore_index=True)
+    return pd.to_numeric(df["COUNT"]).groupby(df["STATION_NAME"].astype(str)).sum().to_dict()
 
 
+########################################################################################
+# Function to Post an Immediate Station Fail-Rate Alert
+########################################################################################
+def post_station_alert(target, station, fails, rate, threshold, since, until):
+    payload = {
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*🚨Station {station} fail rate ({target['shop']} {target['line']}):* "
+                    f"{fails} fails from {since.strftime('%H:%M')} to {until.strftime('%H:%M')} "
+                    f"({rate:.0f}/h, alert at {threshold:g}/h)",
+                },
+            },
+        ]
+    }
+    if get_slack_sender().send(target["channel"], payload["blocks"]):
+        print(f"Station {station} alert sent for {target_id(target)}")
+
+
+class StreamingMonitor(StatorBotDaemon):
+    def __init__(self, targets=None, state_path=None, watermark_path=None):
+        super().__init__(state_path)
+        self.targets = targets or load_targets()
+        self.watermark_path = watermark_path or os.path.join(STATOR_BOT_STATE_DIR, "stream_state.json")
+        self.hour_cache = HourBucketCache()
+        self.genealogy_index = GenealogyIndex() if GENEALOGY_INDEX_ENABLED else None
+        self.open_hours = {}  # hour start -> ([window results], [window sketches]) so far
+        self.station_fails = {}  # target id -> deque of (slice start, slice end, {station: fails})
+        self.alerting = set()  # (target id, station) pairs above their rate
+        self.watermark = None
+
+    def load_watermark(self, until):
+        try:
+            with open(self.watermark_path) as f:
+                watermark = datetime.strptime(json.load(f)["watermark"], "%Y-%m-%d %H:%M")
+        except (FileNotFoundError, KeyError, ValueError):
+            watermark = until
+        # Open hours are only kept in memory, so a restart re-reads the hour in progress
+        earliest = until.replace(minute=0) - timedelta(hours=DAEMON_CATCHUP_HOURS - 1)
+        return max(watermark.replace(minute=0), earliest)
+
+    def record_watermark(self):
+        tmp_path = self.watermark_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"watermark": self.watermark.strftime("%Y-%m-%d %H:%M")}, f)
+        os.replace(tmp_path, self.watermark_path)
+
+    def poll(self, now):
+        until = (now - timedelta(minutes=STREAM_LAG_MINUTES)).replace(second=0, microsecond=0)
+        if self.watermark is None:
+            self.watermark = self.load_watermark(until)
+        if until <= self.watermark:
+            return
+        since = self.watermark
+        window = (since.strftime("%Y-%m-%d %H:%M"), until.strftime("%Y-%m-%d %H:%M"))
+        # No deadline: a poll's results feed the closed hours, so they wait for every query
+        hour_results, hour_sketches, _ = fetch_window_results(
+            [window], self.targets, self.pool, self.genealogy_index
+        )
+        for hour, hour_result in hour_results.items():
+            results, sketches = self.open_hours.setdefault(hour, ([], []))
+            results.append(hour_result)
+            sketches.append(hour_sketches[hour])
+            # The poll's slice of this hour, clipped to the hour and to the poll's window
+            hour_start = datetime.strptime(hour, "%Y-%m-%d %H:00")
+            slice_start, slice_end = max(hour_start, since), min(hour_start + timedelta(hours=1), until)
+            for target in self.targets:
+                self.station_fails.setdefault(target_id(target), deque()).append(
+                    (slice_start, slice_end, station_fail_counts(target_results(hour_result, target)))
+                )
+        print(f"Stream poll {window[0]} to {window[1]}: {len(hour_results)} hour bucket(s)")
+        self.watermark = until
+        self.close_hours()
+        self.record_watermark()
+        self.check_alerts(until)
+
+    def close_hours(self):
+        names = target_result_names(self.targets)
+        for hour in sorted(self.open_hours):
+            if datetime.strptime(hour, "%Y-%m-%d %H:00") + timedelta(hours=1) > self.watermark:
+                continue
+            window_results, window_sketches = self.open_hours.pop(hour)
+            # Counts add up across polls; distinct-serial counts come from the merged sketches
+            sketches = merge_window_sketches(window_sketches)
+            results = sum_window_results(window_results, names)
+            results.update(sketch_results(sketches))
+            self.hour_cache.store(hour, results)
+            self.hour_cache.store_sketches(hour, sketches)
+            print(f"Stream closed hour {hour}")
+        self.hour_cache.evict()
+
+    def check_alerts(self, until):
+        since = until - timedelta(minutes=STREAM_ALERT_WINDOW_MINUTES)
+        for target in self.targets:
+            history = self.station_fails.setdefault(target_id(target), deque())
+            # Only slices wholly inside [since, until) count. A catch-up poll after a
+            # (re)start covers most of an hour in one slice, which would otherwise be
+            # counted as if it fell inside the alert window.
+            while history and history[0][0] < since:
+                history.popleft()
+            totals = {}
+            for _, _, counts in history:
+                for station, fails in counts.items():
+                    totals[station] = totals.get(station, 0) + fails
+            stations = set(totals) | {station for tid, station in self.alerting if tid == target_id(target)}
+            for station in sorted(stations):
+                threshold = STREAM_ALERT_RATES.get(station, STREAM_ALERT_RATES.get("*"))
+                rate = totals.get(station, 0) * 60 / STREAM_ALERT_WINDOW_MINUTES
+                key = (target_id(target), station)
+                if threshold is None or rate < threshold:
+                    # Re-armed once the station drops back under its rate
+                    self.alerting.discard(key)
+                elif key not in self.alerting:
+                    self.alerting.add(key)
+                    post_station_alert(target, station, totals[station], rate, threshold, since, until)
+
+    def run_due(self):
+        # Poll first, so an hour due for its report has been closed into the cache
+        try:
+            self.poll(datetime.now())
+        except Exception as e:
+            print(f"Stream poll failed: {e}")
+        super().run_due()
+
+    def run_job(self, run_at):
+        job(self.pool, run_at, self.targets, reuse_last_hour=True)
+
+    def schedule_runs(self, schedule):
+        for minute in range(0, 60, STREAM_POLL_MINUTES):
+            schedule.every().hour.at(f":{minute:02d}").do(self.run_due)
+
+
+########################################################################################
+# Function to Profile Cold-Start Import Time Against the Startup Budget
+########################################################################################
+def check_startup(budget_seconds=STARTUP_BUDGET_SECONDS, top=15):
+    # Import the module in a fresh interpreter, as a cron run would, under -X importtime
+    module_dir, module_file = os.path.split(os.path.abspath(__file__))
+    module = os.path.splitext(module_file)[0]
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=module_dir,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        print(result.stderr)
+        return 1
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:  # this module and what it imports directly; nested imports are included
+            imports.append((int(cumulative_us) / 1e6, name.strip()))
+    imports.sort(reverse=True)
+    df_imports = pd.DataFrame(imports[:top], columns=["SECONDS", "MODULE"])
+    print(df_imports.to_string(index=False, float_format="%.3f"))
+
+    print(f"Startup: {elapsed:.2f}s (budget {budget_seconds:.2f}s)")
+    if elapsed > budget_seconds:
+        print("Startup budget exceeded")
+        return 1
+    return 0
+
 
 ########################################################################################
 # RUN job()
 ########################################################################################
-job()  # Run the function once
+def main():
+    parser = argparse.ArgumentParser(description="Rivian Ascent stator fail-count Slack bot")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="stay resident and run every hour at DAEMON_RUN_MINUTE instead of running once",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stay resident, poll every STREAM_POLL_MINUTES with alerts, and post hourly reports from the polled data",
+    )
+    parser.add_argument(
+        "--check-startup",
+        action="store_true",
+        help="report per-module import time and fail if startup exceeds STARTUP_BUDGET_SECONDS",
+    )
+    parser.add_argument(
+        "--check-pruning",
+        action="store_true",
+        help="EXPLAIN the window queries (for --run-at, default: now) and fail unless each filters its raw time column",
+    )
+    parser.add_argument(
+        "--flush-outbox",
+        action="store_true",
+        help="deliver the Slack messages still queued in the local outbox, without querying the warehouse",
+    )
+    parser.add_argument(
+        "--resend-window",
+        metavar="HOUR",
+        help='queue the messages already rendered for this report window ("YYYY-MM-DD HH:00") again and flush',
+    )
+    parser.add_argument(
+        "--backfill",
+        nargs=2,
+        metavar=("START", "END"),
+        type=lambda value: datetime.strptime(value, "%Y-%m-%d %H:%M"),
+        help='rebuild the local stores for [START, END) ("YYYY-MM-DD HH:MM") without posting to Slack',
+    )
+    parser.add_argument("--backfill-chunk-hours", type=int, default=BACKFILL_CHUNK_HOURS)
+    parser.add_argument("--backfill-workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument(
+        "--run-at",
+        type=lambda value: datetime.strptime(value, "%Y-%m-%d %H:%M"),
+        help='run once as if scheduled at this local time ("YYYY-MM-DD HH:MM")',
+    )
+    replay = parser.add_mutually_exclusive_group()
+    replay.add_argument("--record-queries", metavar="DIR", help="keep every warehouse result of this run in DIR")
+    replay.add_argument(
+        "--replay-queries",
+        metavar="DIR",
+        help="answer every warehouse query from a recording in DIR instead of the warehouse",
+    )
+    args = parser.parse_args()
+    if args.record_queries or args.replay_queries:
+        global _query_cache
+        _query_cache = QueryResultCache(
+            args.record_queries or args.replay_queries, mode="record" if args.record_queries else "replay"
+        )
+    if args.check_startup:
+        sys.exit(check_startup())
+    if args.check_pruning:
+        sys.exit(check_pruning(args.run_at))
+    if args.flush_outbox or args.resend_window:
+        outbox = SlackOutbox()
+        if args.resend_window:
+            print(f"Outbox: {outbox.resend(args.resend_window)} message(s) of {args.resend_window} queued again")
+        sys.exit(1 if outbox.flush() else 0)
+    if args.backfill:
+        sys.exit(backfill(*args.backfill, chunk_hours=args.backfill_chunk_hours, workers=args.backfill_workers))
+    if args.stream:
+        StreamingMonitor().run()
+    elif args.daemon:
+        StatorBotDaemon().run()
+    else:
+        job(run_at=args.run_at)  # Run the function once
+
+
+if __name__ == "__main__":
+    main()
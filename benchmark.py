@@ -0,0 +1,186 @@
+########################################################################################
+# End-to-End Benchmark for RivianAscentStatorBot job() With Baseline Regression Gating
+########################################################################################
+# Usage:
+#   python benchmark.py --scales 1 10 --repeat 5 --save-baseline
+#   python benchmark.py --scales 1 10 --repeat 5            # fails if slower than baseline
+#
+# Each run is a fresh bot process with an empty state directory against a fixed
+# synthetic dataset (see local_warehouse.py), for the hourly and end-of-shift paths.
+########################################################################################
+import argparse
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+from local_warehouse import SCRIPT_DIR, SlackSink, generate_warehouse, run_bot
+
+BENCHMARK_DIR = os.path.join(".stator_bot_state", "benchmark")
+BASELINE_PATH = os.path.join(SCRIPT_DIR, "benchmark_baseline.json")
+
+# Fixed datasets: data ends at DATASET_END; the hourly path runs at 12:10, end of shift at 15:10
+DATASET_END = "2026-01-15 16:00"
+DATASET_HOURS = 24
+DATASET_SEED = 7
+BENCHMARK_PATHS = {"hourly": "2026-01-15 12:10", "end_of_shift": "2026-01-15 15:10"}
+
+# Metrics compared against the baseline (p50); job stages are reported but not gated
+GATED_METRICS = ["job_seconds", "peak_rss_mb"]
+
+
+########################################################################################
+# Function to Generate (or Reuse) the Fixed Dataset for a Volume Scale
+########################################################################################
+def dataset_path(scale):
+    path = os.path.abspath(os.path.join(BENCHMARK_DIR, f"{scale:g}x", "manufacturing.duckdb"))
+    spec = {"scale": scale, "end": DATASET_END, "hours": DATASET_HOURS, "seed": DATASET_SEED}
+    spec_path = path + ".json"
+    try:
+        with open(spec_path) as f:
+            if json.load(f) == spec and os.path.exists(path):
+                return path
+    except (FileNotFoundError, ValueError):
+        pass
+    generate_warehouse(path, scale=scale, hours=DATASET_HOURS, end=DATASET_END, seed=DATASET_SEED)
+    with open(spec_path, "w") as f:
+        json.dump(spec, f)
+    return path
+
+
+########################################################################################
+# Function to Time Repeated job() Runs per Scale and Path
+########################################################################################
+def run_benchmark(scales, repeat):
+    samples = []
+    sink = SlackSink().start()
+    try:
+        for scale in scales:
+            warehouse_path = dataset_path(scale)
+            for path_name, run_at in BENCHMARK_PATHS.items():
+                state_dir = os.path.abspath(os.path.join(BENCHMARK_DIR, f"{scale:g}x", f"state_{path_name}"))
+                for _ in range(repeat):
+                    # Cold state every run so hour-bucket and genealogy caches don't skew repeats
+                    shutil.rmtree(state_dir, ignore_errors=True)
+                    elapsed, peak_rss, records = run_bot(warehouse_path, state_dir, sink.url, run_at)
+                    sample = {
+                        "scale": f"{scale:g}x",
+                        "path": path_name,
+                        "process_seconds": elapsed,
+                        "job_seconds": next(r["seconds"] for r in records if r["kind"] == "run"),
+                        "peak_rss_mb": peak_rss / 2**20,
+                    }
+                    for record in records:
+                        if record["kind"] == "stage":
+                            sample[f"{record['stage']}_seconds"] = record["seconds"]
+                    samples.append(sample)
+                    print(
+                        f"{sample['scale']:>5} {path_name:<13} job {sample['job_seconds']:.2f}s "
+                        f"process {elapsed:.2f}s rss {sample['peak_rss_mb']:.0f}MB"
+                    )
+    finally:
+        sink.stop()
+    return pd.DataFrame(samples)
+
+
+def summarize(samples):
+    # {"<scale>/<path>": {"<metric>": {"p50": .., "p95": ..}}}
+    summary = {}
+    metrics = [column for column in samples.columns if column not in ("scale", "path")]
+    for (scale, path_name), group in samples.groupby(["scale", "path"], sort=False):
+        summary[f"{scale}/{path_name}"] = {
+            metric: {
+                "p50": float(np.percentile(group[metric].dropna(), 50)),
+                "p95": float(np.percentile(group[metric].dropna(), 95)),
+            }
+            for metric in metrics
+            if group[metric].notna().any()
+        }
+    return summary
+
+
+########################################################################################
+# Function to Compare a Summary Against the Stored Baseline
+########################################################################################
+def compare_to_baseline(summary, baseline, threshold):
+    rows = []
+    for case, metrics in summary.items():
+        for metric in GATED_METRICS:
+            if metric not in metrics:
+                continue
+            if case not in baseline or metric not in baseline[case]:
+                # A case or metric the baseline doesn't know is a failure, not a free pass
+                rows.append(
+                    {
+                        "CASE": case,
+                        "METRIC": metric,
+                        "BASELINE_P50": np.nan,
+                        "P50": metrics[metric]["p50"],
+                        "CHANGE": "no baseline",
+                        "REGRESSED": True,
+                    }
+                )
+                continue
+            base = baseline[case][metric]["p50"]
+            current = metrics[metric]["p50"]
+            change = (current - base) / base if base else 0.0
+            rows.append(
+                {
+                    "CASE": case,
+                    "METRIC": metric,
+                    "BASELINE_P50": base,
+                    "P50": current,
+                    "CHANGE": f"{change:+.0%}",
+                    "REGRESSED": change > threshold,
+                }
+            )
+    return pd.DataFrame(rows, columns=["CASE", "METRIC", "BASELINE_P50", "P50", "CHANGE", "REGRESSED"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RivianAscentStatorBot job() on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown, e.g. 0.2 = 20%%")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    samples = run_benchmark(args.scales, args.repeat)
+    summary = summarize(samples)
+
+    report = []
+    for case, metrics in summary.items():
+        for metric, stats in metrics.items():
+            report.append({"CASE": case, "METRIC": metric, "P50": stats["p50"], "P95": stats["p95"]})
+    print(pd.DataFrame(report).to_string(index=False, float_format="%.3f"))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(summary)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    comparison = compare_to_baseline(summary, baseline, args.threshold)
+    print(comparison.to_string(index=False, float_format="%.3f"))
+    if comparison["REGRESSED"].any():
+        print(
+            f"Benchmark regression: p50 more than {args.threshold:.0%} above baseline, "
+            "or a case missing from the baseline"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,554 @@
+########################################################################################
+# Local Stand-In Warehouse and Slack Sink for Running RivianAscentStatorBot Offline
+########################################################################################
+# Usage:
+#   python local_warehouse.py generate --scale 10
+#   python local_warehouse.py sink --port 8765
+#   python local_warehouse.py run --scales 1 10 100
+#
+# The bot talks to this backend when WAREHOUSE_BACKEND=duckdb; the generated tables
+# carry the columns the bot's queries read from the production tables.
+########################################################################################
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_SCRIPT = os.path.join(SCRIPT_DIR, "RivianAscentStatorBot.py")
+SPEC_LIMITS_PATH = os.getenv("SPEC_LIMITS_PATH", os.path.join(SCRIPT_DIR, "spec_limits.json"))
+
+# The file name is the DuckDB catalog name, so manufacturing.<schema>.<table> resolves as in Databricks
+LOCAL_WAREHOUSE_PATH = os.getenv(
+    "LOCAL_WAREHOUSE_PATH", os.path.join(".stator_bot_state", "local_warehouse", "manufacturing.duckdb")
+)
+
+# Assumed 1x production volume and failure rates for the generator
+STATORS_PER_HOUR = 40
+STATION_FAIL_RATE = 0.03
+ALARMS_PER_HOUR = 12
+
+NEST_STATIONS = ["030-1", "030-2", "030-3", "030-4"]
+JOB_WORK_LOCATIONS = ["Hairpin Insertion 1", "Hairpin Insertion 2"]
+ALARM_DESCRIPTIONS = {
+    "050": [
+        "Assembly error: Twisting check plate Task[301] not OK",
+        "Gripper not in work position Key [GR1]",
+        "Gripper not in work position Key [GR2]",
+        "Safety door opened",
+    ],
+    "070": ["Assembly error: cut/weld not OK", "Welding laser not ready"],
+}
+
+TABLE_COLUMNS = {
+    "spinal.fct_spinal_parameter_records": """
+        shop_name VARCHAR, line_name VARCHAR, station_name VARCHAR, parameter_name VARCHAR,
+        parameter_id INTEGER, overall_process_status VARCHAR, result_status VARCHAR,
+        recorded_at TIMESTAMP, parameter_value_raw VARCHAR, parameter_value_num DOUBLE,
+        work_location_id INTEGER, work_location_name VARCHAR, product_serial VARCHAR
+    """,
+    "mes.fct_work_location_jobs": """
+        shop_name VARCHAR, line_name VARCHAR, station_name VARCHAR, work_location_desc VARCHAR,
+        work_location_name VARCHAR, started_at TIMESTAMP, job_status VARCHAR, product_serial VARCHAR
+    """,
+    "mes.fct_genealogy_hist": """
+        shop_name VARCHAR, line_name VARCHAR, product_serial VARCHAR, scanned_child_serial VARCHAR,
+        consumed_at TIMESTAMP
+    """,
+}
+# One SCADA alarm table per shop, e.g. drive_unit.fct_du03_scada_alarms
+ALARM_TABLE_COLUMNS = """
+    alarm_source_scada_short_name VARCHAR, alarm_description VARCHAR, alarm_priority_desc VARCHAR,
+    activated_at TIMESTAMP, cleared_at TIMESTAMP
+"""
+DEFAULT_LINES = [("DU03", "STTR01")]
+
+
+def alarm_table(shop):
+    return f"drive_unit.fct_{shop.lower()}_scada_alarms"
+
+
+########################################################################################
+# Function to Import DuckDB (only needed for local runs)
+########################################################################################
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("The local warehouse needs DuckDB: pip install duckdb")
+    return duckdb
+
+
+########################################################################################
+# Synthetic STTR01 Data Generator
+########################################################################################
+def _station_parameters(registry, limit_sets):
+    # One generated parameter per (parameter, work location) in the registry; where limit
+    # sets overlap, the tighter limits apply so passing values pass every set
+    seen = {}
+    for limit in registry["limits"]:
+        if limit["limit_set"] in limit_sets:
+            key = (limit["parameter"], limit["work_location"])
+            lo, hi = seen.get(key, (limit["lo"], limit["hi"]))
+            seen[key] = (max(lo, limit["lo"]), min(hi, limit["hi"]))
+    return [(parameter, work_location, lo, hi) for (parameter, work_location), (lo, hi) in seen.items()]
+
+
+def _spinal_station_frame(rng, serials, times, station, parameters, fail_rate):
+    # Every stator gets every parameter; a failing stator has one parameter out of limits
+    n, k = len(serials), len(parameters)
+    work_locations = rng.integers(1, 3, n)
+    names = np.array([p[0] for p in parameters])
+    param_wls = np.array([-1 if p[1] is None else p[1] for p in parameters])
+    lo = np.array([p[2] for p in parameters], dtype=float)
+    hi = np.array([p[3] for p in parameters], dtype=float)
+
+    # Parameters with per-work-location limits only apply at the stator's own work location
+    keep = (param_wls[None, :] == -1) | (param_wls[None, :] == work_locations[:, None])
+    values = lo + (hi - lo) * rng.uniform(0.05, 0.95, (n, k))
+    failing = rng.random(n) < fail_rate
+    fail_param = np.full(n, -1)
+    fail_param[failing] = [rng.choice(np.flatnonzero(row)) for row in keep[failing]]
+    failed = np.flatnonzero(failing)
+    values[failed, fail_param[failed]] = hi[fail_param[failed]] + (hi[fail_param[failed]] - lo[fail_param[failed]] + 1) * 0.5
+
+    rows, cols = np.nonzero(keep)
+    wl = work_locations[rows]
+    return pd.DataFrame(
+        {
+            "station_name": station,
+            "parameter_name": names[cols],
+            "parameter_id": 1,
+            "overall_process_status": np.where(failing[rows], "NOK", "OK"),
+            "result_status": np.where(cols == fail_param[rows], "FAIL", "PASS"),
+            "recorded_at": times[rows] + pd.to_timedelta(rng.integers(60, 600, len(rows)), unit="s"),
+            "parameter_value_raw": np.round(values[rows, cols], 3).astype(str),
+            "parameter_value_num": np.round(values[rows, cols], 3),
+            "work_location_id": wl,
+            "work_location_name": np.char.zfill(wl.astype(str), 2),
+            "product_serial": serials[rows],
+        }
+    )
+
+
+def generate_hour(
+    rng, registry, hour_start, first_serial, scale=1.0, fail_rate=STATION_FAIL_RATE, shop="DU03", line="STTR01"
+):
+    n = max(1, int(round(STATORS_PER_HOUR * scale)))
+    serials = np.array([f"SIM{i:09d}" for i in range(first_serial, first_serial + n)])
+    children = np.char.replace(serials, "SIM", "HPN")
+    times = pd.Timestamp(hour_start) + pd.to_timedelta(np.sort(rng.integers(0, 3600, n)), unit="s")
+    times = times.values
+    tables = {}
+
+    def failing():
+        return rng.random(n) < fail_rate
+
+    tables["mes.fct_work_location_jobs"] = pd.DataFrame(
+        {
+            "shop_name": shop,
+            "line_name": line,
+            "station_name": "020",
+            "work_location_desc": rng.choice(JOB_WORK_LOCATIONS, n),
+            "work_location_name": "02",
+            "started_at": times,
+            "job_status": np.where(failing(), "NOK", "OK"),
+            "product_serial": serials,
+        }
+    )
+    tables["mes.fct_genealogy_hist"] = pd.DataFrame(
+        {
+            "shop_name": shop,
+            "line_name": line,
+            "product_serial": serials,
+            "scanned_child_serial": children,
+            "consumed_at": times,
+        }
+    )
+
+    nest = pd.DataFrame(
+        {
+            "station_name": rng.choice(NEST_STATIONS, n),
+            "parameter_name": "Nest",
+            "parameter_id": 1,
+            "overall_process_status": "OK",
+            "result_status": "PASS",
+            "recorded_at": times - pd.to_timedelta(rng.integers(300, 1800, n), unit="s").values,
+            "parameter_value_raw": "1",
+            "parameter_value_num": 1.0,
+            "product_serial": children,
+        }
+    )
+    force_nok = failing()
+    force = pd.DataFrame(
+        {
+            "station_name": "040",
+            "parameter_name": "Force process value",
+            "parameter_id": 2,
+            "overall_process_status": np.where(force_nok, "NOK", "OK"),
+            "result_status": np.where(force_nok, "FAIL", "PASS"),
+            "recorded_at": times,
+            "parameter_value_raw": "1",
+            "parameter_value_num": 1.0,
+            "product_serial": serials,
+        }
+    )
+    twist = pd.DataFrame(
+        {
+            "station_name": "050",
+            "parameter_name": "Twisting check",
+            "parameter_id": 1,
+            "overall_process_status": "OK",
+            "result_status": np.where(failing(), "FAIL", "PASS"),
+            "recorded_at": times,
+            "parameter_value_raw": "1",
+            "parameter_value_num": 1.0,
+            "product_serial": serials,
+        }
+    )
+    spinal = [df.assign(work_location_id=1, work_location_name="01") for df in [nest, force, twist]]
+    for station, limit_sets in [("090", {"090", "090_hairpin"}), ("100", {"100"}), ("180", {"180"}), ("210", {"210"})]:
+        parameters = _station_parameters(registry, limit_sets)
+        spinal.append(_spinal_station_frame(rng, serials, times, station, parameters, fail_rate))
+    columns = list(spinal[-1].columns)
+    tables["spinal.fct_spinal_parameter_records"] = pd.concat(
+        [df[columns] for df in spinal], ignore_index=True
+    ).assign(shop_name=shop, line_name=line)
+
+    # SCADA alarm timestamps are stored in UTC, like the production table
+    n_alarms = rng.poisson(ALARMS_PER_HOUR * scale)
+    stations = rng.choice(list(ALARM_DESCRIPTIONS), n_alarms)
+    activated = (
+        pd.Timestamp(hour_start).tz_localize("America/Chicago").tz_convert("UTC").tz_localize(None)
+        + pd.to_timedelta(rng.integers(0, 3600, n_alarms), unit="s")
+    )
+    tables[alarm_table(shop)] = pd.DataFrame(
+        {
+            "alarm_source_scada_short_name": [f"{shop}-{line}-{station}-PLC01" for station in stations],
+            "alarm_description": [rng.choice(ALARM_DESCRIPTIONS[station]) for station in stations],
+            "alarm_priority_desc": rng.choice(["high", "critical", "medium"], n_alarms),
+            "activated_at": activated,
+            "cleared_at": activated + pd.to_timedelta(rng.integers(5, 120, n_alarms), unit="s"),
+        }
+    )
+    return tables, first_serial + n
+
+
+def generate_warehouse(
+    path=LOCAL_WAREHOUSE_PATH, scale=1.0, hours=24, end=None, seed=0, fail_rate=STATION_FAIL_RATE, lines=DEFAULT_LINES
+):
+    # Writes `hours` of data per (shop, line) ending at `end` (naive America/Chicago time,
+    # default: this hour); `scale` applies to every line
+    duckdb = _duckdb()
+    end = pd.Timestamp(end or datetime.now()).floor("h")
+    with open(SPEC_LIMITS_PATH) as f:
+        registry = json.load(f)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    con = duckdb.connect(path)
+    try:
+        table_columns = dict(TABLE_COLUMNS, **{alarm_table(shop): ALARM_TABLE_COLUMNS for shop, _ in lines})
+        for table, columns in table_columns.items():
+            con.execute(f"CREATE SCHEMA IF NOT EXISTS {table.split('.')[0]}")
+            con.execute(f"CREATE TABLE {table} ({columns})")
+        next_serial = 0
+        for hour in range(hours, 0, -1):
+            for shop, line in lines:
+                tables, next_serial = generate_hour(
+                    rng, registry, end - timedelta(hours=hour), next_serial, scale, fail_rate, shop, line
+                )
+                for table, df in tables.items():
+                    con.register("hour_rows", df)
+                    con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM hour_rows")
+                    con.unregister("hour_rows")
+        rows = {table: con.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in table_columns}
+    finally:
+        con.close()
+    print(f"Generated {hours}h at {scale}x ({next_serial} stators) in {time.perf_counter() - started:.1f}s: {path}")
+    for table, count in rows.items():
+        print(f"  {table}: {count} rows")
+    return rows
+
+
+########################################################################################
+# DB-API Stand-In for databricks.sql Connections
+########################################################################################
+# Databricks SQL functions the bot uses that DuckDB lacks, defined per connection
+DATABRICKS_MACROS = [
+    "CREATE OR REPLACE TEMP MACRO CONVERT_TIMEZONE(source_tz, target_tz, ts) AS timezone(target_tz, timezone(source_tz, ts))",
+    "CREATE OR REPLACE TEMP MACRO collect_set(x) AS list(DISTINCT x)",
+]
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+class LocalWarehouseCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query):
+        self._cursor.execute(query)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchall_arrow(self):
+        return self._cursor.fetch_arrow_table()
+
+    def cancel(self):
+        # Called from another thread, like the Databricks cursor's cancel()
+        self._cursor.interrupt()
+
+    def close(self):
+        self._cursor.close()
+
+
+class LocalWarehouseConnection:
+    def __init__(self, path=None):
+        path = os.path.abspath(path or os.getenv("LOCAL_WAREHOUSE_PATH", LOCAL_WAREHOUSE_PATH))
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No local warehouse at {path}; run: python local_warehouse.py generate")
+        # One read-only database per file; each connection gets its own thread-safe cursor
+        with _databases_lock:
+            if path not in _databases:
+                _databases[path] = _duckdb().connect(path, read_only=True)
+            self._con = _databases[path].cursor()
+        for macro in DATABRICKS_MACROS:
+            self._con.execute(macro)
+
+    def cursor(self):
+        cursor = self._con.cursor()
+        for macro in DATABRICKS_MACROS:
+            cursor.execute(macro)
+        return LocalWarehouseCursor(cursor)
+
+    def close(self):
+        self._con.close()
+
+
+def connect_local_warehouse(path=None):
+    return LocalWarehouseConnection(path)
+
+
+########################################################################################
+# Local HTTP Sink Standing In for the Slack Webhook
+########################################################################################
+# Payloads breaking Slack's limits are rejected with 400 invalid_blocks, as Slack does.
+# `statuses` scripts the first responses (e.g. [429, 503]) to exercise the bot's retries;
+# a scripted 429 carries Retry-After: retry_after.
+SLACK_MAX_SECTION_CHARS = 3000
+SLACK_MAX_BLOCKS = 50
+
+
+class SlackSink:
+    def __init__(self, host="127.0.0.1", port=0, log_path=None, statuses=(), retry_after=1):
+        sink = self
+        self.messages = []
+        self.rejected = []
+        self.log_path = log_path
+        self.statuses = deque(statuses)
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, text = sink.respond(self.path, body)
+                self.send_response(status)
+                self.send_header("Content-type", "text/plain")
+                if status == 429:
+                    self.send_header("Retry-After", str(sink.retry_after))
+                self.end_headers()
+                self.wfile.write(text.encode())
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}/"
+        self._thread = None
+
+    def respond(self, path, body):
+        with self._lock:
+            if self.statuses:
+                status = self.statuses.popleft()
+                self.rejected.append({"path": path, "status": status})
+                return status, "scripted_error"
+        try:
+            blocks = json.loads(body).get("blocks", [])
+        except (ValueError, AttributeError):
+            blocks = []
+        too_long = any(len(block.get("text", {}).get("text", "")) > SLACK_MAX_SECTION_CHARS for block in blocks)
+        if len(blocks) > SLACK_MAX_BLOCKS or too_long:
+            with self._lock:
+                self.rejected.append({"path": path, "status": 400})
+            return 400, "invalid_blocks"
+        self.record(path, body)
+        return 200, "ok"
+
+    def record(self, path, body):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = body.decode(errors="replace")
+        message = {"path": path, "received_at": time.time(), "bytes": len(body), "payload": payload}
+        with self._lock:
+            self.messages.append(message)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(message) + "\n")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+########################################################################################
+# Function to Run the Bot Once in a Fresh Process Against a Local Warehouse
+########################################################################################
+def run_bot(warehouse_path, state_dir, url, run_at):
+    # Returns (process seconds, peak RSS in bytes, this run's metrics records)
+    os.makedirs(state_dir, exist_ok=True)
+    metrics_path = os.path.join(state_dir, "metrics.jsonl")
+    offset = os.path.getsize(metrics_path) if os.path.exists(metrics_path) else 0
+    env = dict(
+        os.environ,
+        WAREHOUSE_BACKEND="duckdb",
+        LOCAL_WAREHOUSE_PATH=warehouse_path,
+        STATOR_BOT_STATE_DIR=state_dir,
+        URL=url,
+        TZ="America/Chicago",
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, BOT_SCRIPT, "--run-at", pd.Timestamp(run_at).strftime("%Y-%m-%d %H:%M")],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    output = process.stdout.read()
+    # wait4 reports the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    if process.returncode != 0:
+        print(output[-4000:])
+        raise RuntimeError(f"Bot run against {warehouse_path} failed")
+
+    with open(metrics_path) as f:
+        f.seek(offset)
+        records = [json.loads(line) for line in f]
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return elapsed, peak_rss, records
+
+
+########################################################################################
+# Function to Run the Bot End to End Against Generated Data at Several Volumes
+########################################################################################
+def run_scales(scales, hours=24, run_at=None, seed=0, workdir=os.path.join(".stator_bot_state", "local_runs")):
+    run_at = pd.Timestamp(run_at or datetime.now().replace(minute=10, second=0, microsecond=0))
+    sink = SlackSink().start()
+    summary = []
+    try:
+        for scale in scales:
+            scale_dir = os.path.abspath(os.path.join(workdir, f"{scale:g}x"))
+            warehouse_path = os.path.join(scale_dir, "manufacturing.duckdb")
+            state_dir = os.path.join(scale_dir, "state")
+            generate_warehouse(warehouse_path, scale=scale, hours=hours, end=run_at, seed=seed)
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+            elapsed, peak_rss, records = run_bot(warehouse_path, state_dir, sink.url, run_at)
+            stages = {r["stage"]: r["seconds"] for r in records if r["kind"] == "stage"}
+            queries = [r for r in records if r["kind"] == "query"]
+            summary.append(
+                {
+                    "SCALE": f"{scale:g}x",
+                    "PROCESS_SECONDS": elapsed,
+                    "JOB_SECONDS": next(r["seconds"] for r in records if r["kind"] == "run"),
+                    "FETCH_SECONDS": stages.get("fetch"),
+                    "PEAK_RSS_MB": peak_rss / 2**20,
+                    "QUERIES": len(queries),
+                    "ROWS": sum(r.get("rows", 0) for r in queries),
+                    "BYTES": sum(r.get("bytes", 0) for r in queries),
+                }
+            )
+    finally:
+        sink.stop()
+
+    print(f"{len(sink.messages)} Slack payload(s) received by the local sink")
+    print(pd.DataFrame(summary).to_string(index=False, float_format="%.2f"))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in warehouse for RivianAscentStatorBot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write synthetic STTR01 tables to a DuckDB file")
+    generate.add_argument("--path", default=LOCAL_WAREHOUSE_PATH)
+    generate.add_argument("--scale", type=float, default=1.0, help="multiple of production volume")
+    generate.add_argument("--hours", type=int, default=24)
+    generate.add_argument("--end", help="end of the generated data (local time), default this hour")
+    generate.add_argument("--fail-rate", type=float, default=STATION_FAIL_RATE)
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--lines", nargs="+", default=["DU03/STTR01"], help="shop/line pairs to generate")
+
+    sink = commands.add_parser("sink", help="serve a local HTTP endpoint in place of the Slack webhook")
+    sink.add_argument("--port", type=int, default=8765)
+    sink.add_argument("--log", default="slack_sink.jsonl")
+    sink.add_argument("--statuses", type=int, nargs="*", default=[], help="first responses, e.g. 429 503")
+    sink.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with a 429")
+
+    run = commands.add_parser("run", help="generate data and run the bot once per volume scale")
+    run.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100])
+    run.add_argument("--hours", type=int, default=24)
+    run.add_argument("--run-at", help="scheduled run time (local), default this hour at :10")
+    run.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        lines = [tuple(pair.split("/", 1)) for pair in args.lines]
+        generate_warehouse(args.path, args.scale, args.hours, args.end, args.seed, args.fail_rate, lines)
+    elif args.command == "sink":
+        server = SlackSink(port=args.port, log_path=args.log, statuses=args.statuses, retry_after=args.retry_after)
+        print(f"Slack sink listening on {server.url} (set URL to this), logging to {args.log}")
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+    elif args.command == "run":
+        run_scales(args.scales, args.hours, args.run_at, args.seed)
+
+
+if __name__ == "__main__":
+    main()
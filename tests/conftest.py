@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the bot and local_warehouse as top-level modules from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+from RivianAscentStatorBot import chunk_blocks, split_section_text
+
+
+def table_text(rows, width=20):
+    header = "STATION  PARAMETER  COUNT"
+    return "```" + "\n".join([header] + [f"{i:03d} " + "x" * width for i in range(rows)]) + "```"
+
+
+def section(text):
+    return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
+
+def test_text_at_the_limit_is_not_split():
+    text = "a" * 100
+    assert split_section_text(text, limit=100) == [text]
+
+
+def test_table_one_char_over_the_limit_is_split_and_refenced():
+    text = table_text(10)
+    limit = len(text) - 1
+    parts = split_section_text(text, limit=limit)
+    assert len(parts) == 2
+    header = "STATION  PARAMETER  COUNT\n"
+    for part in parts:
+        assert len(part) <= limit
+        assert part.startswith("```" + header) and part.endswith("```")
+    rows = [line for part in parts for line in part[3 + len(header) : -3].split("\n")]
+    assert "\n".join(rows) == text[3 + len(header) : -3]
+
+
+def test_parts_fill_up_to_exactly_the_limit():
+    lines = ["x" * 9] * 10  # 10 lines of 9 chars: two lines plus a newline is 19
+    parts = split_section_text("\n".join(lines), limit=19)
+    assert parts == ["x" * 9 + "\n" + "x" * 9] * 5
+
+
+def test_single_line_longer_than_the_limit_is_cut():
+    text = "short\n" + "y" * 250 + "\nend"
+    parts = split_section_text(text, limit=100)
+    assert all(len(part) <= 100 for part in parts)
+    assert parts == ["short", "y" * 100, "y" * 100, "y" * 50 + "\nend"]
+
+
+def test_long_row_in_a_fenced_table_keeps_fence_and_header():
+    text = "```HEADER\n" + "z" * 300 + "```"
+    parts = split_section_text(text, limit=100)
+    assert all(len(part) <= 100 for part in parts)
+    assert all(part.startswith("```HEADER\n") and part.endswith("```") for part in parts)
+    assert "".join(part[len("```HEADER\n") : -3] for part in parts) == "z" * 300
+
+
+def test_blocks_at_the_block_limit_stay_one_message():
+    blocks = [{"type": "divider"}] * 50
+    assert chunk_blocks(blocks, max_blocks=50) == [blocks]
+
+
+def test_one_block_over_the_limit_starts_a_second_message():
+    blocks = [{"type": "divider"}] * 51
+    messages = chunk_blocks(blocks, max_blocks=50)
+    assert [len(message) for message in messages] == [50, 1]
+
+
+def test_no_blocks_is_one_empty_message():
+    assert chunk_blocks([]) == [[]]
+
+
+def test_oversized_section_becomes_several_sections():
+    text = table_text(400)
+    blocks = [{"type": "divider"}, section(text), {"type": "divider"}]
+    (message,) = chunk_blocks(blocks)
+    sections = [block for block in message if block["type"] == "section"]
+    assert len(sections) > 1
+    assert all(len(block["text"]["text"]) <= 3000 for block in sections)
+    assert all(block["text"]["type"] == "mrkdwn" for block in sections)
+    assert message[0] == {"type": "divider"} and message[-1] == {"type": "divider"}
+
+
+def test_split_sections_count_towards_the_block_limit():
+    blocks = [section(table_text(400))] + [{"type": "divider"}] * 49
+    messages = chunk_blocks(blocks, max_blocks=50)
+    assert len(messages) == 2
+    assert sum(len(message) for message in messages) == len(split_section_text(table_text(400))) + 49
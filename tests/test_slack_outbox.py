@@ -0,0 +1,82 @@
+import pytest
+
+from RivianAscentStatorBot import SlackOutbox
+
+TARGET = {"shop": "DU03", "line": "STTR01"}
+BLOCKS = [{"type": "section", "text": {"type": "mrkdwn", "text": "report"}}]
+
+
+class FakeSender:
+    # Posts to a webhook in `down` fail; otherwise each post takes the next scripted
+    # outcome, True once the script runs out
+    workers = 2
+
+    def __init__(self, outcomes=(), down=()):
+        self.outcomes = list(outcomes)
+        self.down = set(down)
+        self.posts = []
+
+    def post(self, url, payload):
+        self.posts.append((url, payload))
+        if url in self.down:
+            return False
+        return self.outcomes.pop(0) if self.outcomes else True
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return SlackOutbox(path=str(tmp_path / "slack_outbox.sqlite"))
+
+
+def test_delivered_message_is_not_queued_again(outbox):
+    assert outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS) == 1
+    sender = FakeSender()
+    assert outbox.flush(sender) == 0
+    assert outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS) == 0
+    assert outbox.flush(sender) == 0
+    assert len(sender.posts) == 1
+
+
+def test_rerendered_undelivered_message_replaces_the_queued_one(outbox):
+    outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS)
+    newer = [{"type": "section", "text": {"type": "mrkdwn", "text": "newer"}}]
+    outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", newer)
+    sender = FakeSender()
+    assert outbox.flush(sender) == 0
+    assert sender.posts == [("http://hook/a", {"blocks": newer})]
+
+
+def test_failed_send_is_redelivered_on_the_next_flush(outbox):
+    outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS)
+    assert outbox.flush(FakeSender([False])) == 1
+    sender = FakeSender()
+    assert outbox.flush(sender) == 0
+    assert sender.posts == [("http://hook/a", {"blocks": BLOCKS})]
+    assert outbox.flush(FakeSender()) == 0
+
+
+def test_failure_holds_back_later_messages_to_the_same_webhook_only(outbox):
+    outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS)
+    outbox.enqueue("2026-10-16 14:00", TARGET, "report", "http://hook/a", BLOCKS)
+    outbox.enqueue("2026-10-16 13:00", TARGET, "station 100", "http://hook/b", BLOCKS)
+    sender = FakeSender(down=["http://hook/a"])
+    assert outbox.flush(sender) == 2
+    assert sorted(url for url, _ in sender.posts) == ["http://hook/a", "http://hook/b"]
+
+    retry = FakeSender()
+    assert outbox.flush(retry) == 0
+    assert [url for url, _ in retry.posts] == ["http://hook/a", "http://hook/a"]
+
+
+def test_resend_queues_a_delivered_window_again(outbox):
+    outbox.enqueue("2026-10-16 13:00", TARGET, "report", "http://hook/a", BLOCKS)
+    outbox.flush(FakeSender())
+    assert outbox.resend("2026-10-16 13:00") == 1
+    sender = FakeSender()
+    assert outbox.flush(sender) == 0
+    assert len(sender.posts) == 1
+
+
+def test_message_without_a_webhook_is_not_queued(outbox):
+    assert outbox.enqueue("2026-10-16 13:00", TARGET, "report", None, BLOCKS) == 0
+    assert outbox.flush(FakeSender()) == 0